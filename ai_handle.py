@@ -6,56 +6,47 @@
 
 # the function 'adventure_response' is our main API call to get a main response which you can call, it should have a more general name like 'ai_response'
 
+# the bots don't call OpenAI directly but a backend (see backend_handle), chosen with 'llm_backend' in config.ini:
+# the OpenAI API, or a deterministic local stand-in for offline testing, optionally recorded to and replayed from disk
 
+# 'async_ai_bot' does the same calls asynchronously with a shared connection pool, concurrency limit, retries with backoff, timeouts
+# and hedged requests, 'pooled_ai_bot' wraps it so it can be used anywhere an 'ai_bot' is expected
 
-from openai import OpenAI
-from helper_tools import construct_data
+# every bot can also stream the main response with 'stream_response', handing out the text of the 'thinking' and 'response'
+# fields while the model is still writing them
+
+
+
+from openai import APIConnectionError, APITimeoutError, RateLimitError
+from backend_handle import llm_result, make_backend, openai_backend
+from cache_handle import summary_cache as summary_cache_class
+from helper_tools import context_builder
+from metrics_handle import metrics as default_metrics
 from pydantic import BaseModel
 
+import asyncio
 import configparser
+import queue
+import random
+import threading
+import time
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 action_model = config['AI']['action_model']
 memory_model = config['AI']['memory_model']
+context_token_budget = config['AI'].getint('context_token_budget', fallback=0)  # 0 sends all memories
+memory_prompt_budget = config['AI'].getint('memory_prompt_budget', fallback=4000)  # Tokens of memories compaction aims for
+llm_backend = config['AI'].get('llm_backend', fallback='openai')  # 'openai' or 'local'
+llm_record_dir = config['AI'].get('llm_record_dir', fallback='')  # Record (and replay) every request here if set
+llm_record_mode = config['AI'].get('llm_record_mode', fallback='auto')  # 'auto', 'record' or 'replay'
+summary_cache_file = config['AI'].get('summary_cache_file', fallback='')  # Persistent summary cache, empty disables it
+summary_cache_size = config['AI'].getint('summary_cache_size', fallback=1000)
+requests_per_minute = config['AI'].getfloat('requests_per_minute', fallback=0)  # 0 doesn't limit the request rate
 
 
-class response_strucuture(BaseModel):
-    thinking: str
-    response: str
-
-class ai_bot:
-    client = OpenAI()  # client is correctly set up here at the class level
-
-    def _call_openai(self, role, system, input_content): # Renamed 'input' to 'input_content' for clarity
-
-        try:
-            completion = self.client.chat.completions.create(
-                model=memory_model,
-                messages=[
-                    {"role": "system", "content": system},
-                    {
-                        "role": role,
-                        "content": input_content # Use input_content here
-                    }
-                ]
-            )
-
-            # Access the content of the message, not 'response' - this was the main issue
-            response_content = completion.choices[0].message.content
-
-            #print(response_content) # Print the actual content for debugging/logging
-            return response_content
-
-        except Exception as e: # It's good practice to have a try-except block for API calls
-            print(f"Error calling OpenAI API: {e}")
-            return None  # Or handle the error in a way that suits your application
-
-
-    def summarize_memories(self, to_summarize, memory_type): # Renamed 'type' to 'memory_type' for clarity
-
-        if memory_type == "short_term":
-            system_prompt =  """
+# The system prompts used to summarize each memory type
+SHORT_TERM_SUMMARY_PROMPT = """
 
             Create a concise summary from the provided information that captures the key points, including answering what, when, where, and why, from a first-person perspective. Remember to highlight important and useful behaviors or objectives for future reference to prevent repeated errors and guide planning.
 
@@ -81,15 +72,8 @@ A concise summary written in the first person perspective that addresses the key
 
 
             """
-            role = "user" # User role is appropriate for input to be summarized
-            response = self._call_openai(role, system_prompt, to_summarize) # Correct argument order: role, system, input
-
-
-
-
 
-        elif memory_type == "long_term": # Use elif for clarity and to avoid unnecessary checks if short_term is already true
-            system_prompt = """
+LONG_TERM_SUMMARY_PROMPT = """
 
 Summarize memories into 'nuclear memories' that preserve essential information, focusing on key events, individual details, overarching states, changes, and objectives. The summary should be detailed enough to maintain the essence of the memory and written in the first person perspective.
 
@@ -118,6 +102,309 @@ Summarize memories into 'nuclear memories' that preserve essential information,
 
 
             """
+
+SUMMARY_PROMPTS = {
+    "short_term": SHORT_TERM_SUMMARY_PROMPT,
+    "long_term": LONG_TERM_SUMMARY_PROMPT,
+}
+
+
+class ai_request_error(Exception):
+    """
+    Raised when a call to the API failed (after any retries).
+    """
+
+
+def _build_messages(bot, mem_structure, system_prompt, token_budget=None, retriever=None):
+    """
+    Builds the messages for adventure_response with the bot's context builder for this system prompt
+    (one per prompt, so the messages are built incrementally turn after turn).
+    """
+    builder = bot._context_builders.get(system_prompt)
+    if builder is None:
+        builder = bot._context_builders[system_prompt] = context_builder(system_prompt)
+    builder.retriever = retriever
+    if token_budget is None:
+        token_budget = context_token_budget
+    messages = builder.build(mem_structure, token_budget)
+    bot.last_context_usage = builder.last_usage
+    return messages
+
+
+def _record_usage(metrics, result, kind, model):
+    """
+    Counts the prompt and completion tokens the backend reports for a result.
+    """
+    if result.usage is None:
+        return
+    metrics.count("llm_prompt_tokens_total", result.usage["prompt_tokens"], kind=kind, model=model)
+    metrics.count("llm_completion_tokens_total", result.usage["completion_tokens"], kind=kind, model=model)
+
+
+class request_rate_limiter:
+    """
+    Spaces requests out to at most requests_per_minute, allowing bursts of up to `burst` requests (a token bucket).
+
+    One limiter can be shared by any number of bots, threads and event loops, so the limit holds for everything
+    calling the same API. acquire() waits (asynchronously) until a request may be sent.
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        # Takes a token if there is one, otherwise returns the seconds until the next one
+        with self._lock:
+            now = time.monotonic()
+            rate = self.requests_per_minute / 60
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / rate
+
+    async def acquire(self):
+        """
+        Waits for the next free request slot, returns how long it waited in seconds.
+        """
+        waited = 0.0
+        while True:
+            delay = self._reserve()
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+class json_stream_error(ValueError):
+    """
+    Raised by json_field_stream when the streamed text is not valid JSON (a malformed escape sequence).
+    """
+
+
+class json_field_stream:
+    """
+    Parses a JSON object with string values while it streams in, e.g. '{"thinking": "...", "response": "..."}'.
+
+    feed() takes the next piece of JSON text and returns the decoded text that arrived for each field as
+    (field, text) pairs, so a field can be shown before the object is complete. fields holds the text so far.
+    Values that aren't strings are skipped. A malformed escape sequence raises json_stream_error.
+    """
+
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+    HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+    def __init__(self):
+        self.fields = {}
+        self._state = "between"  # between, key, colon, value
+        self._key = ""
+        self._escape = None  # The escape sequence being read in a value, e.g. '\\u00e'
+        self._high_surrogate = None  # First half of a character outside the BMP, waiting for its second half
+
+    def _decode_escape(self):
+        # Returns the decoded character once the escape sequence is complete, None before
+        escape = self._escape
+        if len(escape) < 2:
+            return None
+        if escape[1] != "u":
+            if escape[1] not in self.ESCAPES:
+                raise json_stream_error(f"Invalid escape sequence '{escape}' in the streamed JSON.")
+            return self.ESCAPES[escape[1]]
+        if len(escape) > 2 and escape[-1] not in self.HEX_DIGITS:
+            raise json_stream_error(f"Invalid escape sequence '{escape}' in the streamed JSON.")
+        if len(escape) < 6:
+            return None
+        return chr(int(escape[2:], 16))
+
+    def _push(self, current, char):
+        # Characters outside the BMP (emoji) arrive as two escapes, '\\ud83d\\ude00', which are joined into one.
+        # A lone half can't be printed or encoded, it becomes U+FFFD.
+        if self._high_surrogate is not None:
+            high, self._high_surrogate = self._high_surrogate, None
+            if "\udc00" <= char <= "\udfff":
+                current.append(chr(0x10000 + ((ord(high) - 0xD800) << 10) + (ord(char) - 0xDC00)))
+                return
+            current.append("\ufffd")
+        if "\ud800" <= char <= "\udbff":
+            self._high_surrogate = char
+        elif "\udc00" <= char <= "\udfff":
+            current.append("\ufffd")
+        else:
+            current.append(char)
+
+    def feed(self, text):
+        pieces = []
+        current = []
+
+        def flush():
+            if current:
+                piece = "".join(current)
+                self.fields[self._key] += piece
+                pieces.append((self._key, piece))
+                current.clear()
+
+        for char in text:
+            state = self._state
+            if state == "value":
+                if self._escape is not None:
+                    self._escape += char
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        self._escape = None
+                        self._push(current, decoded)
+                elif char == "\\":
+                    self._escape = char
+                elif char == '"':
+                    if self._high_surrogate is not None:
+                        current.append("\ufffd")  # The value ended half way through a character
+                        self._high_surrogate = None
+                    flush()
+                    self._state = "between"
+                elif self._high_surrogate is not None:
+                    self._push(current, char)
+                else:
+                    current.append(char)
+            elif state == "between":
+                if char == '"':
+                    self._state = "key"
+                    self._key = ""
+            elif state == "key":
+                if char == '"':
+                    self._state = "colon"
+                else:
+                    self._key += char
+            elif state == "colon":
+                if char == '"':
+                    self._state = "value"
+                    self.fields.setdefault(self._key, "")
+                elif char not in " \t\r\n:":
+                    self._state = "between"  # Not a string value
+        if self._state == "value":
+            flush()
+        return pieces
+
+
+_default_backend = None
+_default_summary_cache = None
+_default_rate_limiter = None
+
+
+def default_summary_cache():
+    """
+    Returns the summary cache configured in config.ini (None if disabled), shared by every bot that isn't given its own.
+    """
+    global _default_summary_cache
+    if _default_summary_cache is None and summary_cache_file:
+        _default_summary_cache = summary_cache_class(summary_cache_file, summary_cache_size)
+    return _default_summary_cache
+
+
+def _pick_summary_cache(summary_cache):
+    # None picks the configured cache, False disables caching
+    if summary_cache is None:
+        return default_summary_cache()
+    return None if summary_cache is False else summary_cache
+
+
+def default_rate_limiter():
+    """
+    Returns the rate limiter configured in config.ini (None if the rate isn't limited), shared by every async bot
+    that isn't given its own.
+    """
+    global _default_rate_limiter
+    if _default_rate_limiter is None and requests_per_minute > 0:
+        _default_rate_limiter = request_rate_limiter(requests_per_minute)
+    return _default_rate_limiter
+
+
+def _pick_rate_limiter(rate_limit):
+    # None picks the configured limiter, False disables it, a number is a new limit in requests per minute
+    if rate_limit is None:
+        return default_rate_limiter()
+    if rate_limit is False:
+        return None
+    if isinstance(rate_limit, (int, float)):
+        return request_rate_limiter(rate_limit)
+    return rate_limit
+
+
+def default_backend():
+    """
+    Returns the backend configured in config.ini, shared by every bot that isn't given its own.
+    """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = make_backend(llm_backend, llm_record_dir or None, llm_record_mode)
+    return _default_backend
+
+
+class response_strucuture(BaseModel):
+    thinking: str
+    response: str
+
+class ai_bot:
+    metrics = default_metrics  # Request latency, token usage and errors are reported here (see metrics_handle)
+
+    def __init__(self, backend=None, summary_cache=None):
+        # The model backend (see backend_handle), the one configured in config.ini by default
+        self.backend = backend if backend is not None else default_backend()
+        # Summaries already written for the same input are reused (see cache_handle), False disables it
+        self.summary_cache = _pick_summary_cache(summary_cache)
+        # One context builder per system prompt, so the messages are built incrementally turn after turn
+        self._context_builders = {}
+        self.last_context_usage = {}  # Tokens used per memory section by the last adventure_response
+
+    def _call_openai(self, role, system, input_content): # Renamed 'input' to 'input_content' for clarity
+
+        try:
+            with self.metrics.timer("llm_request_seconds", kind="summary", model=memory_model):
+                result = self.backend.complete(
+                    memory_model,
+                    [
+                        {"role": "system", "content": system},
+                        {
+                            "role": role,
+                            "content": input_content # Use input_content here
+                        }
+                    ]
+                )
+            _record_usage(self.metrics, result, "summary", memory_model)
+
+            response_content = result.content
+
+            #print(response_content) # Print the actual content for debugging/logging
+            return response_content
+
+        except Exception as e: # It's good practice to have a try-except block for API calls
+            self.metrics.count("llm_errors_total", kind="summary", model=memory_model)
+            print(f"Error calling OpenAI API: {e}")
+            return None  # Or handle the error in a way that suits your application
+
+
+    def summarize_memories(self, to_summarize, memory_type): # Renamed 'type' to 'memory_type' for clarity
+
+        cache = self.summary_cache
+        if cache is not None and memory_type in SUMMARY_PROMPTS:
+            cached = cache.get(memory_type, memory_model, SUMMARY_PROMPTS[memory_type], to_summarize)
+            if cached is not None:
+                return cached
+
+        if memory_type == "short_term":
+            system_prompt = SHORT_TERM_SUMMARY_PROMPT
+            role = "user" # User role is appropriate for input to be summarized
+            response = self._call_openai(role, system_prompt, to_summarize) # Correct argument order: role, system, input
+
+
+
+
+
+        elif memory_type == "long_term": # Use elif for clarity and to avoid unnecessary checks if short_term is already true
+            system_prompt = LONG_TERM_SUMMARY_PROMPT
             role = "user" # User role is appropriate for input to be summarized
             response = self._call_openai(role, system_prompt, to_summarize) # Correct argument order: role, system, input
 
@@ -129,28 +416,36 @@ Summarize memories into 'nuclear memories' that preserve essential information,
             print(f"Error: Invalid memory type '{memory_type}'. Must be 'short_term' or 'long_term'.")
             return None # Handle invalid input gracefully
 
+        if response and cache is not None:
+            cache.put(memory_type, memory_model, system_prompt, to_summarize, response)
         return response
     
-    def adventure_response(self,mem_structure, system_prompt): 
+    def adventure_response(self,mem_structure, system_prompt, token_budget=None, retriever=None): 
         """
         Main function to call to get a response from the API for the implementation.
 
         It expects a memory structure from the memory_handle module, and a system prompt.
+        The memories are fitted into token_budget input tokens (context_token_budget from config.ini by default,
+        0 sends everything), the tokens used per section are kept in last_context_usage.
+        With a retriever (like memory_manager.search_long_term) only the relevant long-term memories are sent.
         
         returns two strings, thinking and response strings.
 
         
         """
         try:
-            messages_data=construct_data(mem_structure, system_prompt)
-            completion = self.client.beta.chat.completions.parse(
-                model=action_model, # Consider making this configurable, or using a more robust model
-                messages=messages_data,
-                response_format=response_strucuture
+            with self.metrics.span("adventure_response", model=action_model):
+                messages_data=_build_messages(self, mem_structure, system_prompt, token_budget, retriever)
+                with self.metrics.timer("llm_request_seconds", kind="response", model=action_model):
+                    result = self.backend.parse(
+                        action_model, # Consider making this configurable, or using a more robust model
+                        messages_data,
+                        response_strucuture
 
-            )
+                    )
+            _record_usage(self.metrics, result, "response", action_model)
 
-            response_content = completion.choices[0].message.parsed
+            response_content = result.content
 
             #print(response_content.thinking) # Print the actual content for debugging/logging
             #print(response_content.response) # Print the actual content for debugging/logging
@@ -158,8 +453,309 @@ Summarize memories into 'nuclear memories' that preserve essential information,
             return response_content.response, response_content.thinking
 
         except Exception as e: # It's good practice to have a try-except block for API calls
+            self.metrics.count("llm_errors_total", kind="response", model=action_model)
             print(f"Error calling OpenAI API: {e}")
-            return None  # Or handle the error in a way that suits your application
+            # Raise instead of returning None, callers unpack two strings and would crash on None anyway
+            raise ai_request_error(f"adventure_response failed: {e}") from e
+
+    def stream_response(self, mem_structure, system_prompt, token_budget=None, retriever=None):
+        """
+        Streaming version of adventure_response, yields (field, text) pairs as the model writes them,
+        where field is 'thinking' or 'response'. Joining the texts of a field gives the whole field.
+        """
+        fields = json_field_stream()
+        started = time.perf_counter()
+        first_token = True
+        try:
+            with self.metrics.span("adventure_response", model=action_model, stream=True):
+                messages_data = _build_messages(self, mem_structure, system_prompt, token_budget, retriever)
+                with self.metrics.timer("llm_request_seconds", kind="response", model=action_model):
+                    for piece in self.backend.stream(action_model, messages_data, response_strucuture):
+                        if isinstance(piece, llm_result):
+                            _record_usage(self.metrics, piece, "response", action_model)
+                            continue
+                        if first_token:
+                            self.metrics.observe("llm_first_token_seconds", time.perf_counter() - started,
+                                                 model=action_model)
+                            first_token = False
+                        yield from fields.feed(piece)
+        except Exception as e:
+            self.metrics.count("llm_errors_total", kind="response", model=action_model)
+            print(f"Error calling OpenAI API: {e}")
+            raise ai_request_error(f"stream_response failed: {e}") from e
+
+
+class async_ai_bot:
+    """
+    Asynchronous version of ai_bot for serving many sessions from one process.
+
+    All instances share one pooled AsyncOpenAI client (connections are reused between calls, see
+    backend_handle.openai_backend) unless given another backend or client, at most
+    max_concurrency requests of an instance are in flight at the same time, and every call:
+
+    - times out after `timeout` seconds,
+    - is retried up to `max_retries` times on rate limits and transient errors, waiting a random
+      ("full jitter") part of an exponentially growing delay in between,
+    - can be hedged: if no answer arrived after `hedge_after` seconds a second identical request is sent
+      and whichever answers first wins (costs an extra request, cuts the slow tail),
+    - waits for the rate limiter first, if there is one (`requests_per_minute` in config.ini, or rate_limit).
+
+    Failures raise ai_request_error instead of returning None.
+    """
+
+    metrics = default_metrics  # Request latency, token usage, retries, hedges and errors are reported here
+
+    # HTTP status codes worth retrying: request timeout, conflict, rate limit and server errors
+    RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, client=None, max_concurrency=8, max_retries=4, base_delay=0.5, max_delay=20.0,
+                 timeout=60.0, hedge_after=None, backend=None, summary_cache=None, rate_limit=None):
+        # A given AsyncOpenAI client is used through an openai backend, otherwise the configured backend is used
+        if backend is None:
+            backend = openai_backend(async_client=client) if client is not None else default_backend()
+        self.backend = backend
+        self.summary_cache = _pick_summary_cache(summary_cache)  # See ai_bot
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay  # Seconds, doubled on every retry
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.hedge_after = hedge_after  # Seconds before a hedged request is sent, None disables hedging
+        # A request_rate_limiter or requests per minute, None uses the configured one and False disables it
+        self.rate_limiter = _pick_rate_limiter(rate_limit)
+
+        self.retries = 0  # Number of retried calls, useful for monitoring
+        self.hedges = 0  # Number of hedged requests sent
+        self._semaphore = None  # Created on first use, inside the event loop that runs the calls
+        self._context_builders = {}
+        self.last_context_usage = {}
+
+    def _is_retryable(self, error):
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError, APIConnectionError, RateLimitError)):
+            return True
+        return getattr(error, "status_code", None) in self.RETRYABLE_STATUS_CODES
+
+    def _retry_delay(self, error, attempt):
+        # Honour the server's Retry-After header when it sends one
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.max_delay)
+        except ValueError:
+            pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _attempt(self, make_call):
+        """
+        Runs one request with a timeout, holding one of the max_concurrency slots while it is in flight.
+        """
+        async with self._semaphore:
+            return await asyncio.wait_for(make_call(), self.timeout)
+
+    async def _hedged(self, make_call):
+        """
+        Runs the call with a timeout, sending a second identical request if the first one is slow. The second request
+        takes a slot of its own, so hedging never puts more than max_concurrency requests in flight.
+        """
+        first = asyncio.ensure_future(self._attempt(make_call))
+        if self.hedge_after is None:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        self.hedges += 1
+        self.metrics.count("llm_hedges_total")
+        second = asyncio.ensure_future(self._attempt(make_call))
+        pending = {first, second}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    return succeeded[0].result()
+                if not pending:
+                    return done.pop().result()  # Both failed, raise the last error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _request(self, make_call, kind, model):
+        """
+        Runs an API call under the concurrency limit, retrying transient errors with backoff.
+        make_call is a function returning a new coroutine for every attempt, kind and model label the metrics.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                waited = await self.rate_limiter.acquire()
+                self.metrics.observe("llm_rate_limit_wait_seconds", waited, kind=kind)
+            started = time.perf_counter()
+            try:
+                result = await self._hedged(make_call)
+                self.metrics.observe("llm_request_seconds", time.perf_counter() - started, kind=kind, model=model)
+                _record_usage(self.metrics, result, kind, model)
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    self.metrics.count("llm_errors_total", kind=kind, model=model)
+                    raise ai_request_error(f"OpenAI API call failed after {attempt + 1} attempt(s): {e!r}") from e
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                self.retries += 1
+                self.metrics.count("llm_retries_total", kind=kind, model=model)
+                print(f"Warning: OpenAI API call failed ({e!r}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def summarize_memories(self, to_summarize, memory_type):
+        """
+        Summarizes memories of the given type ('short_term' or 'long_term'), see ai_bot.summarize_memories.
+        """
+        if memory_type not in SUMMARY_PROMPTS:
+            raise ValueError(f"Invalid memory type '{memory_type}'. Must be 'short_term' or 'long_term'.")
+
+        cache = self.summary_cache
+        if cache is not None:
+            cached = cache.get(memory_type, memory_model, SUMMARY_PROMPTS[memory_type], to_summarize)
+            if cached is not None:
+                return cached
+
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPTS[memory_type]},
+            {"role": "user", "content": to_summarize}
+        ]
+        result = await self._request(lambda: self.backend.acomplete(memory_model, messages), "summary", memory_model)
+        if result.content and cache is not None:
+            cache.put(memory_type, memory_model, SUMMARY_PROMPTS[memory_type], to_summarize, result.content)
+        return result.content
+
+    async def adventure_response(self, mem_structure, system_prompt, token_budget=None, retriever=None):
+        """
+        Gets the main response for a memory structure, see ai_bot.adventure_response.
+        Returns the response and thinking strings.
+        """
+        with self.metrics.span("adventure_response", model=action_model):
+            messages_data = _build_messages(self, mem_structure, system_prompt, token_budget, retriever)
+            result = await self._request(lambda: self.backend.aparse(action_model, messages_data, response_strucuture),
+                                         "response", action_model)
+        response_content = result.content
+        return response_content.response, response_content.thinking
+
+    async def stream_response(self, mem_structure, system_prompt, token_budget=None, retriever=None):
+        """
+        Streaming version of adventure_response, an async generator of (field, text) pairs, see ai_bot.stream_response.
+        Only failures before the first piece arrived are retried, the pieces already handed out can't be taken back.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        fields = json_field_stream()
+        with self.metrics.span("adventure_response", model=action_model, stream=True):
+            messages_data = _build_messages(self, mem_structure, system_prompt, token_budget, retriever)
+            attempt = 0
+            while True:
+                if self.rate_limiter is not None:
+                    waited = await self.rate_limiter.acquire()
+                    self.metrics.observe("llm_rate_limit_wait_seconds", waited, kind="response")
+                started = time.perf_counter()
+                streamed = False
+                try:
+                    async with self._semaphore:
+                        async for piece in self.backend.astream(action_model, messages_data, response_strucuture):
+                            if isinstance(piece, llm_result):
+                                _record_usage(self.metrics, piece, "response", action_model)
+                                continue
+                            if not streamed:
+                                self.metrics.observe("llm_first_token_seconds", time.perf_counter() - started,
+                                                     model=action_model)
+                                streamed = True
+                            for field_piece in fields.feed(piece):
+                                yield field_piece
+                    self.metrics.observe("llm_request_seconds", time.perf_counter() - started,
+                                         kind="response", model=action_model)
+                    return
+                except Exception as e:
+                    if streamed or attempt >= self.max_retries or not self._is_retryable(e):
+                        self.metrics.count("llm_errors_total", kind="response", model=action_model)
+                        raise ai_request_error(f"OpenAI API stream failed after {attempt + 1} attempt(s): {e!r}") from e
+                    delay = self._retry_delay(e, attempt)
+                    attempt += 1
+                    self.retries += 1
+                    self.metrics.count("llm_retries_total", kind="response", model=action_model)
+                    print(f"Warning: OpenAI API stream failed ({e!r}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+
+class pooled_ai_bot:
+    """
+    Synchronous façade over async_ai_bot, a drop-in replacement for ai_bot (for memory_manager, the CLI or
+    the Zork runner) that gets its connection pooling, concurrency limit, retries, timeouts and hedging.
+
+    All façades share one event loop running on a background thread, so any number of threads and sessions
+    can call them at the same time without blocking each other. Failures raise ai_request_error.
+    An asyncio program can pass its own running loop instead, so the async bot is only ever used from that loop
+    (the façade must then be called from other threads, e.g. the memory manager's compaction worker).
+    """
+
+    _loop = None
+    _loop_lock = threading.Lock()
+
+    def __init__(self, async_bot=None, loop=None, **options):
+        self.async_bot = async_bot if async_bot is not None else async_ai_bot(**options)
+        self.loop = loop
+
+    @classmethod
+    def _get_loop(cls):
+        with cls._loop_lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name="ai-bot-loop", daemon=True).start()
+            return cls._loop
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop or self._get_loop()).result()
+
+    @property
+    def last_context_usage(self):
+        return self.async_bot.last_context_usage
+
+    def summarize_memories(self, to_summarize, memory_type):
+        return self._run(self.async_bot.summarize_memories(to_summarize, memory_type))
+
+    def adventure_response(self, mem_structure, system_prompt, token_budget=None, retriever=None):
+        return self._run(self.async_bot.adventure_response(mem_structure, system_prompt, token_budget, retriever))
+
+    def stream_response(self, mem_structure, system_prompt, token_budget=None, retriever=None):
+        """
+        Yields the (field, text) pairs of async_bot.stream_response as they arrive on the event loop.
+        """
+        pieces = queue.Queue()
+        finished = object()
+
+        async def pump():
+            try:
+                async for piece in self.async_bot.stream_response(mem_structure, system_prompt, token_budget,
+                                                                  retriever):
+                    pieces.put(piece)
+            except Exception as e:
+                pieces.put(e)
+            finally:
+                pieces.put(finished)
+
+        job = asyncio.run_coroutine_threadsafe(pump(), self.loop or self._get_loop())
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is finished:
+                    return
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            job.cancel()  # Stops the request if the caller stopped reading
 
 
 # Example Usage (you can add this outside the class or in a separate main block)
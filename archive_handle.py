@@ -0,0 +1,168 @@
+# archive_handle.py
+# Archive handle is the cold tier of the memory: entries a check() purges are kept here instead of being thrown away.
+
+# The archive is a directory of segment files. Every archived batch of entries is one zlib compressed block appended
+# to the current segment ('seg_000001.z'), and described by one fixed size record in the segment's index
+# ('seg_000001.idx'): the oldest and newest entry time, where the block starts, its compressed and raw size and its
+# number of entries. Blocks are never changed once written, and a segment is sealed for good once it grows past
+# segment_bytes, a new one is started for the next block.
+
+# The index is tiny (36 bytes per block) and read through mmap, so fetching a time range only decompresses the blocks
+# that overlap it. Appends take an advisory lock ('<directory>/archive.lock'), so several processes can share an archive.
+
+# Every archived entry is a dictionary: {"section": "short_term", "key": "user_42", "time": 1712345678.25, "value": "..."}
+# (long-term entries have no key).
+
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from storage_handle import file_lock, storage_error, _fsync_directory
+
+
+# oldest time, newest time, offset, compressed size, raw size, number of entries
+INDEX_RECORD = struct.Struct("<ddQIII")
+
+
+class cold_archive:
+    """
+    Append-only, compressed archive of purged memories.
+
+    Usage:
+        archive = cold_archive("memory_archive")
+        archive.append([{"section": "short_term", "key": "user_1", "time": time.time(), "value": "Hello"}])
+        entries = archive.fetch(start=time.time() - 3600)
+    """
+
+    def __init__(self, directory="memory_archive", segment_bytes=4 * 1024 * 1024, level=6):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.level = level  # zlib compression level
+        self.bytes_written = 0
+
+        self._lock = threading.Lock()
+        self._maps = {}  # index path -> (size, mmap), sealed segments are mapped once
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_numbers(self):
+        return sorted(int(name[4:-4]) for name in os.listdir(self.directory)
+                      if name.startswith("seg_") and name.endswith(".idx"))
+
+    def _paths(self, number):
+        base = os.path.join(self.directory, f"seg_{number:06d}")
+        return f"{base}.z", f"{base}.idx"
+
+    def _index(self, index_path):
+        """
+        Internal function returning the index records of a segment, read through a (cached) memory map.
+        """
+        try:
+            size = os.path.getsize(index_path)
+        except FileNotFoundError:
+            return []
+        size -= size % INDEX_RECORD.size  # A record cut short by a crash doesn't count
+        if size == 0:
+            return []
+        cached = self._maps.get(index_path)
+        if cached is None or cached[0] != size:
+            if cached is not None:
+                cached[1].close()
+            with open(index_path, "rb") as f:
+                cached = self._maps[index_path] = (size, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+        with memoryview(cached[1]) as view:
+            return [INDEX_RECORD.unpack_from(view, offset) for offset in range(0, size, INDEX_RECORD.size)]
+
+    def append(self, entries):
+        """
+        Archives a list of entries as one compressed block. Returns the number of entries archived.
+        """
+        entries = [dict(entry, time=entry.get("time") or time.time()) for entry in entries]
+        if not entries:
+            return 0
+        raw = json.dumps(entries, separators=(",", ":")).encode("utf-8")
+        block = zlib.compress(raw, self.level)
+        times = [entry["time"] for entry in entries]
+
+        with self._lock, file_lock(os.path.join(self.directory, "archive")):
+            numbers = self._segment_numbers()
+            number = numbers[-1] if numbers else 1
+            segment_path, index_path = self._paths(number)
+            if os.path.exists(segment_path) and os.path.getsize(segment_path) >= self.segment_bytes:
+                number += 1  # The segment is full, it stays as it is from now on
+                segment_path, index_path = self._paths(number)
+
+            try:
+                # The block is durable before the index points to it, a crash in between only leaves unused bytes
+                with open(segment_path, "ab") as f:
+                    offset = f.tell()
+                    f.write(block)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(index_path, "ab") as f:
+                    f.truncate(f.tell() - f.tell() % INDEX_RECORD.size)
+                    f.write(INDEX_RECORD.pack(min(times), max(times), offset, len(block), len(raw), len(entries)))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                raise storage_error(f"Error writing to archive {self.directory}: {e}") from e
+            if offset == 0:
+                _fsync_directory(segment_path)
+
+        self.bytes_written += len(block) + INDEX_RECORD.size
+        return len(entries)
+
+    def fetch(self, start=None, end=None, section=None):
+        """
+        Returns the archived entries saved between start and end (timestamps, both included, None is open ended),
+        optionally only those of one section, in the order they were archived.
+        Only the blocks overlapping the time range are read and decompressed.
+        """
+        entries = []
+        with self._lock:
+            for number in self._segment_numbers():
+                segment_path, index_path = self._paths(number)
+                blocks = [record for record in self._index(index_path)
+                          if (start is None or record[1] >= start) and (end is None or record[0] <= end)]
+                if not blocks:
+                    continue
+                with open(segment_path, "rb") as f:
+                    for _, _, offset, length, _, _ in blocks:
+                        f.seek(offset)
+                        try:
+                            block = json.loads(zlib.decompress(f.read(length)))
+                        except (zlib.error, ValueError) as e:
+                            raise storage_error(f"Damaged block at {offset} in {segment_path}: {e}") from e
+                        entries.extend(entry for entry in block
+                                       if (start is None or entry["time"] >= start)
+                                       and (end is None or entry["time"] <= end)
+                                       and (section is None or entry.get("section") == section))
+        return entries
+
+    def stats(self):
+        """
+        Returns the number of segments, blocks and entries, and the compressed and raw size of the entries in bytes.
+        """
+        stats = {"segments": 0, "blocks": 0, "entries": 0, "compressed_bytes": 0, "raw_bytes": 0}
+        with self._lock:
+            for number in self._segment_numbers():
+                records = self._index(self._paths(number)[1])
+                stats["segments"] += 1
+                stats["blocks"] += len(records)
+                stats["entries"] += sum(record[5] for record in records)
+                stats["compressed_bytes"] += sum(record[3] for record in records)
+                stats["raw_bytes"] += sum(record[4] for record in records)
+        return stats
+
+    def __len__(self):
+        return self.stats()["entries"]
+
+    def close(self):
+        with self._lock:
+            for _, mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
@@ -0,0 +1,374 @@
+# backend_handle.py
+# Backend handle is what ai_handle talks to when it needs a model, so the bots don't depend on OpenAI directly.
+
+# Every backend offers the same four calls, returning an llm_result(content, usage):
+#   complete(model, messages)                   - plain text completion (used for summaries)
+#   parse(model, messages, response_format)     - structured completion parsed into the response_format model
+#   acomplete / aparse                          - the same, as coroutines (used by async_ai_bot)
+#   stream / astream(model, messages, response_format)
+#                                               - structured completion as it is generated: yields the pieces of the
+#                                                 JSON text as they arrive, then one llm_result with the whole text
+
+# Available backends:
+#   'openai' - the OpenAI API, the client is only created on the first request (so no API key is needed to import).
+#   'local'  - a deterministic stand-in without network, answers are derived from a hash of the request and can be
+#              given a fixed latency, for offline load tests and profiling.
+# Any backend can be wrapped in a record_replay_backend, which stores every request and its answer on disk by a hash
+# of the request, so a whole chat or Zork session can be replayed at full speed without network.
+
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+from openai import OpenAI, AsyncOpenAI
+
+from helper_tools import count_tokens, strip_timestamps
+
+
+# content is the text (complete) or the parsed response_format object (parse), usage a dictionary with
+# 'prompt_tokens' and 'completion_tokens' (None if the backend doesn't know)
+llm_result = namedtuple("llm_result", ["content", "usage"])
+
+
+def _usage_of(completion):
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens or 0, "completion_tokens": usage.completion_tokens or 0}
+
+
+def _field_names(response_format):
+    """
+    Returns the field names of a pydantic model class (v2 or v1).
+    """
+    fields = getattr(response_format, "model_fields", None) or getattr(response_format, "__fields__", None)
+    return list(fields or getattr(response_format, "__annotations__", {}))
+
+
+def _dump_model(parsed):
+    if hasattr(parsed, "model_dump"):
+        return parsed.model_dump()
+    if hasattr(parsed, "dict"):
+        return parsed.dict()
+    return dict(vars(parsed))
+
+
+class openai_backend:
+    """
+    Sends the requests to the OpenAI API. The sync and async clients are created when first used,
+    the async one is shared by every backend so connections are pooled.
+    """
+
+    name = "openai"
+    _shared_async_client = None
+
+    def __init__(self, client=None, async_client=None):
+        self._client = client
+        self._async_client = async_client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = OpenAI()
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            if openai_backend._shared_async_client is None:
+                # Retries are handled by async_ai_bot itself
+                openai_backend._shared_async_client = AsyncOpenAI(max_retries=0)
+            self._async_client = openai_backend._shared_async_client
+        return self._async_client
+
+    def complete(self, model, messages):
+        completion = self.client.chat.completions.create(model=model, messages=messages)
+        return llm_result(completion.choices[0].message.content, _usage_of(completion))
+
+    def parse(self, model, messages, response_format):
+        completion = self.client.beta.chat.completions.parse(model=model, messages=messages,
+                                                             response_format=response_format)
+        return llm_result(completion.choices[0].message.parsed, _usage_of(completion))
+
+    async def acomplete(self, model, messages):
+        completion = await self.async_client.chat.completions.create(model=model, messages=messages)
+        return llm_result(completion.choices[0].message.content, _usage_of(completion))
+
+    async def aparse(self, model, messages, response_format):
+        completion = await self.async_client.beta.chat.completions.parse(model=model, messages=messages,
+                                                                         response_format=response_format)
+        return llm_result(completion.choices[0].message.parsed, _usage_of(completion))
+
+    def stream(self, model, messages, response_format):
+        pieces = []
+        with self.client.beta.chat.completions.stream(model=model, messages=messages,
+                                                      response_format=response_format) as stream:
+            for event in stream:
+                if event.type == "content.delta":
+                    pieces.append(event.delta)
+                    yield event.delta
+            completion = stream.get_final_completion()
+        yield llm_result("".join(pieces), _usage_of(completion))
+
+    async def astream(self, model, messages, response_format):
+        pieces = []
+        async with self.async_client.beta.chat.completions.stream(model=model, messages=messages,
+                                                                  response_format=response_format) as stream:
+            async for event in stream:
+                if event.type == "content.delta":
+                    pieces.append(event.delta)
+                    yield event.delta
+            completion = await stream.get_final_completion()
+        yield llm_result("".join(pieces), _usage_of(completion))
+
+
+class local_backend:
+    """
+    A deterministic stand-in for a model, without any network.
+
+    The same request always gets the same answer: summaries are synthetic texts of summary_chars characters, and
+    structured responses fill every field of the response_format, picking the 'response' field from the canned
+    responses (e.g. text adventure commands). latency_ms is added to every request to simulate a real model.
+    Token usage is estimated with count_tokens.
+    """
+
+    name = "local"
+
+    DEFAULT_RESPONSES = ("look", "inventory", "north", "south", "east", "west", "open mailbox", "read leaflet",
+                         "take lamp", "turn on lamp", "go up", "go down", "examine house", "enter window")
+
+    def __init__(self, latency_ms=0, responses=DEFAULT_RESPONSES, summary_chars=400, stream_chunk_chars=8):
+        self.latency_ms = latency_ms
+        self.responses = tuple(responses)
+        self.summary_chars = summary_chars
+        self.stream_chunk_chars = stream_chunk_chars  # Characters per streamed piece
+        self.requests = 0
+
+    @staticmethod
+    def _digest(model, messages):
+        payload = json.dumps([model, messages], sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _text(self, digest, length):
+        words = []
+        while sum(len(word) + 1 for word in words) < length:
+            digest = hashlib.sha256(digest.encode("utf-8")).hexdigest()
+            words.extend(digest[i:i + 6] for i in range(0, 60, 6))
+        return " ".join(words)[:length]
+
+    def _usage(self, messages, content):
+        prompt_tokens = sum(count_tokens(str(message.get("content", ""))) for message in messages)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(content)}
+
+    def _complete(self, model, messages):
+        self.requests += 1
+        text = self._text(self._digest(model, messages), self.summary_chars)
+        return llm_result(text, self._usage(messages, text))
+
+    def _parse(self, model, messages, response_format):
+        self.requests += 1
+        digest = self._digest(model, messages)
+        values = {}
+        for field in _field_names(response_format):
+            if field == "response" and self.responses:
+                values[field] = self.responses[int(digest[:8], 16) % len(self.responses)]
+            else:
+                values[field] = self._text(digest + field, 120)
+        return llm_result(response_format(**values), self._usage(messages, " ".join(values.values())))
+
+    def complete(self, model, messages):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._complete(model, messages)
+
+    def parse(self, model, messages, response_format):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._parse(model, messages, response_format)
+
+    async def acomplete(self, model, messages):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._complete(model, messages)
+
+    async def aparse(self, model, messages, response_format):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._parse(model, messages, response_format)
+
+    def _pieces(self, model, messages, response_format):
+        result = self._parse(model, messages, response_format)
+        text = json.dumps(_dump_model(result.content))
+        size = max(1, self.stream_chunk_chars)
+        return [text[i:i + size] for i in range(0, len(text), size)], llm_result(text, result.usage)
+
+    def stream(self, model, messages, response_format):
+        # The latency is the time to the first piece, the rest follows right away
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        pieces, result = self._pieces(model, messages, response_format)
+        yield from pieces
+        yield result
+
+    async def astream(self, model, messages, response_format):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        pieces, result = self._pieces(model, messages, response_format)
+        for piece in pieces:
+            yield piece
+        yield result
+
+
+class replay_miss_error(LookupError):
+    """
+    Raised in 'replay' mode when a request was never recorded.
+    """
+
+
+def _without_time(messages):
+    """
+    Drops the current time message context_builder adds and the times of the memory entries, they differ on every run
+    and would make every request new.
+    """
+    return [dict(message, content=strip_timestamps(message["content"])) if isinstance(message.get("content"), str)
+            else message
+            for message in messages
+            if not str(message.get("content", "")).startswith("The current time is:")]
+
+
+class record_replay_backend:
+    """
+    Wraps a backend, storing every request and its answer as a JSON file named after a hash of the request
+    (kind, model, messages and response format) in the directory.
+
+    Modes:
+        'auto'   - replay recorded requests, send and record new ones (default)
+        'record' - always send and (re-)record
+        'replay' - only replay, a request that was never recorded raises replay_miss_error
+    The current time message and the times of the memory entries are left out of the hash, see normalize.
+    """
+
+    name = "record_replay"
+    MODES = ("auto", "record", "replay")
+
+    def __init__(self, backend, directory="llm_recordings", mode="auto", normalize=_without_time):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid mode '{mode}'. Must be one of {self.MODES}.")
+        self.backend = backend
+        self.directory = directory
+        self.mode = mode
+        self.normalize = normalize
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, kind, model, messages, response_format=None):
+        request = {"kind": kind, "model": model, "messages": self.normalize(messages),
+                   "response_format": response_format.__name__ if response_format is not None else None}
+        payload = json.dumps(request, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest(), request
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _lookup(self, key, response_format=None):
+        if self.mode == "record":
+            return None
+        try:
+            with open(self._path(key), "r") as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            if self.mode == "replay":
+                raise replay_miss_error(f"No recording for request {key} in {self.directory}.")
+            return None
+        self.hits += 1
+        content = recording["content"]
+        if response_format is not None:
+            content = response_format(**content)
+        return llm_result(content, recording.get("usage"))
+
+    def _store(self, key, request, result, parsed=False):
+        self.misses += 1
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        recording = {"request": request, "content": _dump_model(result.content) if parsed else result.content,
+                     "usage": result.usage}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(recording, f, indent=4)
+        os.replace(tmp_path, path)
+        return result
+
+    def complete(self, model, messages):
+        key, request = self._key("complete", model, messages)
+        return self._lookup(key) or self._store(key, request, self.backend.complete(model, messages))
+
+    def parse(self, model, messages, response_format):
+        key, request = self._key("parse", model, messages, response_format)
+        return (self._lookup(key, response_format)
+                or self._store(key, request, self.backend.parse(model, messages, response_format), parsed=True))
+
+    async def acomplete(self, model, messages):
+        key, request = self._key("complete", model, messages)
+        return self._lookup(key) or self._store(key, request, await self.backend.acomplete(model, messages))
+
+    async def aparse(self, model, messages, response_format):
+        key, request = self._key("parse", model, messages, response_format)
+        return (self._lookup(key, response_format)
+                or self._store(key, request, await self.backend.aparse(model, messages, response_format),
+                               parsed=True))
+
+    # Streams are recorded like parse requests (and replay their recordings), a replayed answer comes in one piece
+
+    def _replayed(self, result):
+        text = json.dumps(_dump_model(result.content))
+        return [text, llm_result(text, result.usage)]
+
+    def _store_stream(self, key, request, result):
+        self._store(key, request, llm_result(json.loads(result.content), result.usage))
+
+    def stream(self, model, messages, response_format):
+        key, request = self._key("parse", model, messages, response_format)
+        recorded = self._lookup(key, response_format)
+        if recorded is not None:
+            yield from self._replayed(recorded)
+            return
+        for piece in self.backend.stream(model, messages, response_format):
+            if isinstance(piece, llm_result):
+                self._store_stream(key, request, piece)
+            yield piece
+
+    async def astream(self, model, messages, response_format):
+        key, request = self._key("parse", model, messages, response_format)
+        recorded = self._lookup(key, response_format)
+        if recorded is not None:
+            for piece in self._replayed(recorded):
+                yield piece
+            return
+        async for piece in self.backend.astream(model, messages, response_format):
+            if isinstance(piece, llm_result):
+                self._store_stream(key, request, piece)
+            yield piece
+
+
+LLM_BACKENDS = {
+    "openai": openai_backend,
+    "local": local_backend,
+}
+
+
+def make_backend(backend="openai", record_dir=None, record_mode="auto", **options):
+    """
+    Builds a model backend by name, options are passed on to it. With a record_dir it is wrapped in a
+    record_replay_backend using that directory. An already built backend object is returned (and wrapped) as is.
+    """
+    if isinstance(backend, str):
+        if backend not in LLM_BACKENDS:
+            raise ValueError(f"Unknown LLM backend '{backend}'. Must be one of {tuple(LLM_BACKENDS)}.")
+        backend = LLM_BACKENDS[backend](**options)
+    if record_dir:
+        backend = record_replay_backend(backend, record_dir, record_mode)
+    return backend
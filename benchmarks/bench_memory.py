@@ -0,0 +1,252 @@
+# bench_memory.py
+# Benchmarks the memory pipeline turn by turn, fully offline (the AI is benchmarks.fake_bot).
+
+# Every case plays a number of turns the way the chatbot does: save the user message, read the memory structure,
+# build the messages, get a response, save it and run check(). The cases sweep the storage backend, the size of the
+# history already in the database, the short-term threshold and the message size, and report per operation latency
+# percentiles, bytes written per turn and peak memory.
+
+# Usage (from the project root):
+#   python -m benchmarks.bench_memory                      # run the default sweep and compare it to the baseline
+#   python -m benchmarks.bench_memory --save-baseline      # run it and store the results as the new baseline
+#   python -m benchmarks.bench_memory --backends sqlite --sizes 0 5000 --turns 100
+# The run exits with status 1 if a case got slower or heavier than its baseline by more than the tolerances below.
+# Every case is timed --repeats times and the fastest run counts, a single run is too easily slowed down by the rest
+# of the machine.
+# Latencies depend on the machine, save a baseline on the machine you compare on.
+
+
+import argparse
+import contextlib
+import gc
+import itertools
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from helper_tools import construct_data, DEFAULT_SYS_PROMPT
+from memory_handle import memory_manager
+
+from benchmarks.fake_bot import fake_ai_bot, fake_text
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+OPERATIONS = ("save_to_memory", "get_memory_structure", "construct_data", "adventure_response", "check")
+PERCENTILES = (50, 95, 99)
+
+# A case regresses if it exceeds its baseline by these factors. Latencies below LATENCY_FLOOR_MS are timer noise,
+# p95 rests on a handful of turns and gets more room than p50, and p99 is reported but too noisy over a few hundred
+# turns to be compared. The baseline latencies are scaled by how much slower or faster the machine runs a fixed piece
+# of work now than when the baseline was saved, the median over the cases (see calibrate).
+LATENCY_TOLERANCE = {50: 1.5, 95: 2.5}  # Compared percentiles and their factors
+LATENCY_FLOOR_MS = 0.25
+BYTES_TOLERANCE = 1.10
+MEMORY_TOLERANCE = 1.25
+
+
+def percentile(samples, p):
+    """
+    Returns the p-th percentile of the samples (nearest rank).
+    """
+    ordered = sorted(samples)
+    rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def calibrate(rounds=5):
+    """
+    Returns how many milliseconds a fixed piece of pure Python work (hashing, formatting and serializing text, like
+    the pipeline does) takes right now, the fastest of a few rounds. A virtual machine's speed drifts with the load
+    of its host by more than the latency tolerance, so every case records it next to its latencies. A single
+    calibration is noisy too, compare scales by the median over all cases.
+    """
+    def work():
+        entries = {f"user_{i}": fake_text(f"calibration {i}", 80) for i in range(300)}
+        json.dumps(entries, indent=4)
+        sorted(entries.values())
+
+    fastest = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        work()
+        elapsed = time.perf_counter() - started
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return round(fastest * 1000, 4)
+
+
+def case_name(case):
+    return f"{case['backend']}/history={case['history']}/threshold={case['threshold']}/message={case['message_chars']}"
+
+
+def _play(case, directory, turns, timings=None):
+    """
+    Plays the turns of one case in a fresh database, recording the duration of each operation in timings.
+    Returns the number of bytes the storage backend wrote during the turns.
+    """
+    extension = ".db" if case["backend"] == "sqlite" else ".json"
+    filepath = os.path.join(directory, f"bench_{len(os.listdir(directory))}{extension}")
+    bot = fake_ai_bot()
+    manager = memory_manager(ai_bot_instance=bot, filepath=filepath, backend=case["backend"])
+
+    # The history goes into long-term memory, its threshold is raised so it stays there during the run
+    manager.SHORT_TERM_THRESHOLD = case["threshold"]
+    manager.SHORT_TERM_KEEP_COUNT = max(1, case["threshold"] // 3)
+    manager.LONG_TERM_THRESHOLD = case["history"] + turns + memory_manager.LONG_TERM_THRESHOLD
+    if case["history"]:
+        manager.replace_section("long_term", [fake_text(f"history {i}", case["message_chars"])
+                                              for i in range(case["history"])])
+
+    bytes_before = manager.storage.bytes_written
+    clock = time.perf_counter
+
+    for turn in range(turns):
+        started = clock()
+        manager.save_to_memory(fake_text(f"user {turn}", case["message_chars"]), "short_term", "user")
+        saved = clock()
+        manager.get_memory_structure()
+        read = clock()
+        # Like main.py and run_zork.py the prompt is built from the read-only view, which carries the token counts
+        memory_structure = manager.get_memory_view()
+        construct_data(memory_structure, DEFAULT_SYS_PROMPT)
+        built = clock()
+        response, thinking = bot.adventure_response(memory_structure, DEFAULT_SYS_PROMPT)
+        answered = clock()
+        manager.save_to_memory(response, "short_term", "assistant")
+        saved_answer = clock()
+        manager.check()
+        checked = clock()
+
+        if timings is not None:
+            timings["save_to_memory"] += [saved - started, saved_answer - answered]
+            timings["get_memory_structure"].append(read - saved)
+            timings["construct_data"].append(built - read)
+            timings["adventure_response"].append(answered - built)
+            timings["check"].append(checked - saved_answer)
+
+    bytes_written = manager.storage.bytes_written - bytes_before
+    manager.close()
+    return bytes_written
+
+
+def run_case(case, turns, repeats=1):
+    """
+    Runs one case repeats times timed, then once under tracemalloc (which slows everything down) for the peak memory.
+    Every latency percentile is the lowest of the timed runs, the slower ones were disturbed by the rest of the machine.
+    """
+    calibration_ms = calibrate()
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):  # The memory manager prints its progress
+            runs = []
+            for _ in range(repeats):
+                timings = {operation: [] for operation in OPERATIONS}
+                gc.collect()
+                bytes_written = _play(case, directory, turns, timings)
+                runs.append(timings)
+
+            gc.collect()
+            tracemalloc.start()
+            _play(case, directory, turns)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    result = {"turns": turns, "bytes_per_turn": round(bytes_written / turns), "peak_memory_kb": round(peak / 1024),
+              "calibration_ms": min(calibration_ms, calibrate())}
+    for operation in OPERATIONS:
+        result[operation] = {f"p{p}_ms": round(min(percentile(timings[operation], p) for timings in runs) * 1000, 4)
+                             for p in PERCENTILES}
+    return result
+
+
+def compare(results, baseline):
+    """
+    Returns a list of regression messages, cases missing from the baseline are skipped.
+    """
+    regressions = []
+    # Baselines saved before calibration existed are compared as they are
+    speeds = [result["calibration_ms"] / baseline[name]["calibration_ms"] for name, result in results.items()
+              if "calibration_ms" in baseline.get(name, {})]
+    speed = statistics.median(speeds) if speeds else 1.0
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for operation in OPERATIONS:
+            for p, tolerance in LATENCY_TOLERANCE.items():
+                key = f"p{p}_ms"
+                old, new = expected[operation][key], result[operation][key]
+                if new > max(old * speed, LATENCY_FLOOR_MS) * tolerance:
+                    regressions.append(f"{name}: {operation} {key} {old} -> {new}")
+        if result["bytes_per_turn"] > expected["bytes_per_turn"] * BYTES_TOLERANCE:
+            regressions.append(f"{name}: bytes_per_turn {expected['bytes_per_turn']} -> {result['bytes_per_turn']}")
+        if result["peak_memory_kb"] > expected["peak_memory_kb"] * MEMORY_TOLERANCE:
+            regressions.append(f"{name}: peak_memory_kb {expected['peak_memory_kb']} -> {result['peak_memory_kb']}")
+    return regressions
+
+
+def print_result(name, result):
+    latencies = "  ".join(f"{operation} {result[operation]['p50_ms']:.3f}/{result[operation]['p95_ms']:.3f}"
+                          for operation in OPERATIONS)
+    print(f"{name}\n    p50/p95 ms: {latencies}\n"
+          f"    bytes/turn: {result['bytes_per_turn']}  peak memory: {result['peak_memory_kb']} KB"
+          f"  calibration: {result['calibration_ms']:.3f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the memory pipeline.")
+    parser.add_argument("--backends", nargs="+", default=["json", "journal", "sqlite"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[0, 1000], help="Long-term entries already stored")
+    parser.add_argument("--thresholds", nargs="+", type=int, default=[30, 100], help="Short-term thresholds")
+    parser.add_argument("--message-sizes", nargs="+", type=int, default=[80, 800], help="Characters per message")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case, the fastest one counts")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for backend, history, threshold, message_chars in itertools.product(
+            args.backends, args.sizes, args.thresholds, args.message_sizes):
+        case = {"backend": backend, "history": history, "threshold": threshold, "message_chars": message_chars}
+        name = case_name(case)
+        results[name] = run_case(case, args.turns, args.repeats)
+        print_result(name, results[name])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=4)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"    {regression}")
+        return 1
+    print(f"\nNo regressions against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# fake_bot.py
+# A deterministic stand-in for ai_bot, so the memory pipeline can be measured offline, without an API key and without the
+# network adding noise to the numbers.
+
+# It has the same methods as ai_bot: summaries and responses are derived from a hash of their input, so the same run
+# always produces the same memories (and writes the same number of bytes). A fixed latency can be added to every call
+# to see how the pipeline behaves around a slow model.
+
+
+import hashlib
+import time
+
+from helper_tools import context_builder
+
+
+_WORDS = ("lantern", "troll", "cellar", "forest", "mailbox", "leaflet", "sword", "treasure", "river", "dam",
+          "maze", "thief", "egg", "window", "attic", "rope", "bell", "candle", "coffin", "altar")
+
+
+def fake_text(seed, length):
+    """
+    Returns a deterministic text of about length characters, made of words picked by hashing the seed.
+    """
+    words = []
+    size = 0
+    counter = 0
+    while size < length:
+        digest = hashlib.sha1(f"{seed}:{counter}".encode("utf-8")).digest()
+        for byte in digest:
+            word = _WORDS[byte % len(_WORDS)]
+            words.append(word)
+            size += len(word) + 1
+            if size >= length:
+                break
+        counter += 1
+    return " ".join(words)[:length]
+
+
+class fake_ai_bot:
+    """
+    Deterministic fake of ai_bot: summarize_memories returns a summary_chars long text, adventure_response builds the
+    messages exactly like ai_bot does (so context building is part of the measurement) and returns a fixed size answer.
+    """
+
+    def __init__(self, summary_chars=400, response_chars=120, latency_ms=0):
+        self.summary_chars = summary_chars
+        self.response_chars = response_chars
+        self.latency_ms = latency_ms  # Simulated model latency added to every call
+
+        self.summaries = 0
+        self.responses = 0
+        self.last_context_usage = None
+        self._context_builders = {}
+
+    def _wait(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def summarize_memories(self, to_summarize, memory_type):
+        self._wait()
+        self.summaries += 1
+        digest = hashlib.sha1(to_summarize.encode("utf-8")).hexdigest()
+        return f"Summary of {memory_type}: " + fake_text(digest, self.summary_chars)
+
+    def adventure_response(self, mem_structure, system_prompt, token_budget=None, retriever=None):
+        builder = self._context_builders.get(system_prompt)
+        if builder is None:
+            builder = self._context_builders[system_prompt] = context_builder(system_prompt, retriever=retriever)
+        messages = builder.build(mem_structure, token_budget)
+        self.last_context_usage = builder.last_usage
+
+        self._wait()
+        self.responses += 1
+        digest = hashlib.sha1(messages[-2]["content"].encode("utf-8")).hexdigest()
+        return fake_text(digest, self.response_chars), fake_text(digest[::-1], self.response_chars // 2)
@@ -0,0 +1,123 @@
+# cache_handle.py
+# Cache handle remembers the summaries the model already wrote, so the same input is never summarized twice.
+
+# This happens more than one would think: a check() that failed halfway is run again on the same memories, or a
+# crashed session is resumed from its memory file. A summary is looked up by
+# (memory type, model, prompt version, hash of the input text), where the prompt version is a hash of the summary
+# prompt itself, so changing a prompt or the model never returns summaries written for the old one. The input is hashed
+# exactly as it is, times included: a summary is only reused for the very text it was written for.
+
+# The cache is a small SQLite database that survives restarts. It keeps the max_entries most recently used summaries,
+# the least recently used ones are evicted first.
+
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from metrics_handle import metrics as default_metrics
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def prompt_version(prompt):
+    """
+    Returns the version of a prompt, a short hash of its text.
+    """
+    return _digest(prompt)[:16]
+
+
+class summary_cache:
+    """
+    Persistent, size-bounded LRU cache of summaries.
+
+    Usage:
+        cache = summary_cache("summary_cache.db", max_entries=1000)
+        summary = cache.get("short_term", "gpt-4.1-nano", prompt, text)
+        if summary is None:
+            summary = ...
+            cache.put("short_term", "gpt-4.1-nano", prompt, text, summary)
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS summaries (
+            key TEXT PRIMARY KEY,
+            memory_type TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used);
+    """
+
+    metrics = default_metrics  # Hits, misses and evictions are reported here as well
+
+    def __init__(self, filepath="summary_cache.db", max_entries=1000):
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+
+    @staticmethod
+    def _key(memory_type, model, version, text):
+        return _digest(f"{memory_type}\0{model}\0{version}\0{_digest(text)}")
+
+    def get(self, memory_type, model, prompt, text):
+        """
+        Returns the cached summary of text, or None.
+        """
+        key = self._key(memory_type, model, prompt_version(prompt), text)
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                with self._conn:
+                    self._conn.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.metrics.count("summary_cache_hits_total" if row is not None else "summary_cache_misses_total",
+                           memory_type=memory_type)
+        return row[0] if row is not None else None
+
+    def put(self, memory_type, model, prompt, text, summary):
+        """
+        Stores the summary of text, evicting the least recently used summaries beyond max_entries.
+        """
+        version = prompt_version(prompt)
+        key = self._key(memory_type, model, version, text)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO summaries (key, memory_type, model, prompt_version, summary, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET summary = excluded.summary, last_used = excluded.last_used",
+                (key, memory_type, model, version, summary, now, now))
+            evicted = self._conn.execute(
+                "DELETE FROM summaries WHERE key IN (SELECT key FROM summaries ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            self.evictions += evicted
+        if evicted:
+            self.metrics.count("summary_cache_evictions_total", evicted)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM summaries")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
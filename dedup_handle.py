@@ -0,0 +1,161 @@
+# dedup_handle.py
+# Dedup handle spots short-term entries that repeat one of the latest entries, so they can be saved as a short reference.
+
+# Text adventures repeat themselves a lot: the same room description, "I don't understand that." or the same status
+# line again and again. Each copy fills the short-term window, makes the prompt longer and brings the next compaction
+# closer, without telling the AI anything new.
+
+# An entry is compared with the latest `window` entries of the same tag:
+#   - exact duplicates are found by a hash of the (whitespace normalized) text,
+#   - near duplicates by MinHash, only if a `threshold` is given: the text is cut into overlapping word shingles, and
+#     two texts whose MinHash signatures agree on at least `threshold` of their slots (an estimate of the Jaccard
+#     similarity of their shingles) count as the same.
+# Near duplicates are off by default: "The troll is here." and "The troll is dead." are nearly the same text, but not
+# the same news.
+# The filter only decides, memory_manager saves the reference and keeps the stats.
+
+
+import hashlib
+import re
+import threading
+from collections import deque
+
+from helper_tools import count_tokens
+
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORDS = re.compile(r"\w+")
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def shingles(text, size=3):
+    """
+    Returns the set of hashed word shingles (runs of size words) of a text, the whole text for shorter ones.
+    """
+    words = _WORDS.findall(text.lower())
+    if len(words) <= size:
+        return {_hash64(" ".join(words))}
+    return {_hash64(" ".join(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+class duplicate_filter:
+    """
+    Finds exact duplicates among the latest short-term entries, and near duplicates too if a threshold is given.
+
+    Usage:
+        dedup = duplicate_filter(window=20)      # threshold=0.8 also finds near duplicates
+        match = dedup.find("system", text)       # None, or ("exact" | "near", key, similarity, repeats)
+        if match is None or not dedup.saved("system", match[1], match[0], text, f"[Same as {match[1]}]"):
+            dedup.add("system", "system_12", text)   # Saved in full, saved() counts the tokens a reference saves
+    """
+
+    def __init__(self, window=20, threshold=None, num_perm=64, shingle_size=3):
+        self.window = window
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.stats = {"checked": 0, "exact": 0, "near": 0, "tokens_saved": 0}
+
+        # The same permutations in every process, so signatures can be compared across restarts
+        seeds = hashlib.sha256(b"dedup_handle").digest()
+        self._permutations = []
+        for i in range(num_perm):
+            digest = hashlib.sha256(seeds + i.to_bytes(4, "little")).digest()
+            a = int.from_bytes(digest[:8], "little") % (_MERSENNE_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:16], "little") % _MERSENNE_PRIME
+            self._permutations.append((a, b))
+
+        self._recent = {}  # tag -> deque of [key, exact hash, signature, repeats]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _exact_hash(text):
+        return hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+
+    def signature(self, text):
+        """
+        Returns the MinHash signature of a text.
+        """
+        hashes = shingles(text, self.shingle_size)
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._permutations)
+
+    @staticmethod
+    def similarity(first, second):
+        """
+        Returns the estimated Jaccard similarity of two signatures.
+        """
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+    def find(self, tag, text):
+        """
+        Looks for an earlier entry with the same tag that text repeats. Returns None, or (kind, key, similarity,
+        repeats) where kind is 'exact' or 'near' and repeats is how often the earlier entry has been seen with this
+        one, if it is saved as a reference to it (see saved).
+        """
+        exact = self._exact_hash(text)
+        with self._lock:
+            self.stats["checked"] += 1
+            recent = self._recent.get(tag)
+            if not recent:
+                return None
+
+            for entry in reversed(recent):
+                if entry[1] == exact:
+                    return "exact", entry[0], 1.0, entry[3] + 1
+
+            if self.threshold is None:
+                return None
+            signature = self.signature(text)
+            best, best_similarity = None, 0.0
+            for entry in reversed(recent):
+                if entry[2] is None:
+                    continue
+                similarity = self.similarity(signature, entry[2])
+                if similarity > best_similarity:
+                    best, best_similarity = entry, similarity
+            if best is None or best_similarity < self.threshold:
+                return None
+            return "near", best[0], best_similarity, best[3] + 1
+
+    def add(self, tag, key, text, repeats=1):
+        """
+        Remembers an entry that was saved in full (and seen repeats times so far), only the latest `window`
+        entries per tag are kept.
+        """
+        signature = None if self.threshold is None else self.signature(text)
+        with self._lock:
+            recent = self._recent.setdefault(tag, deque(maxlen=self.window))
+            recent.append([key, self._exact_hash(text), signature, repeats])
+
+    def saved(self, tag, key, kind, original, reference):
+        """
+        Counts a duplicate of the given kind of the entry key stored as reference instead of original, returns the
+        tokens saved. A reference that isn't shorter than the text ("Taken.") isn't worth it, then 0 is returned and
+        nothing counted, the text is saved in full and should be added like any new entry.
+        """
+        tokens = count_tokens(original) - count_tokens(reference)
+        if tokens <= 0:
+            return 0
+        with self._lock:
+            for entry in self._recent.get(tag, ()):
+                if entry[0] == key:
+                    entry[3] += 1
+            self.stats[kind] += 1
+            self.stats["tokens_saved"] += tokens
+        return tokens
+
+    def forget(self, present):
+        """
+        Forgets the entries whose key present() says is not in memory anymore, a purged entry can't be referenced.
+        """
+        with self._lock:
+            for recent in self._recent.values():
+                for entry in [entry for entry in recent if not present(entry[0])]:
+                    recent.remove(entry)
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
@@ -1,3 +1,4 @@
+import re
 import time
 
 # helper_tools.py
@@ -5,101 +6,331 @@ import time
 # This function allows you to construct messages for the openAI API to present them in a multi-turn format. It expects a 'memory_structure' 
 # which can be taken with a function in the memory_handle module 
 
+# The context_builder class does the same incrementally, keeping the start of the messages stable between turns so the
+# provider's prompt cache can be used. It can also fit the memories into a token budget, counting tokens with
+# count_tokens (exact if the optional 'tiktoken' package is installed, estimated otherwise). A memory structure can
+# carry the token counts of its entries ('token_counts', memory_handle counts every entry once when it is saved),
+# then they are not counted again.
 
-def construct_data(memory_structure, sys_prompt="You are an agent in an text adventure game, you have to interact with the CLI, figure  out what to do and how to interact these are your deep memories System Memory Overview:\n\n"):
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # The encoding of the gpt-4o and gpt-4.1 model families
+except ImportError:
+    _encoding = None
+
+
+MESSAGE_TOKEN_OVERHEAD = 4  # Tokens the API adds around every message (role and separators)
+
+# The times written into the memories ('Time of the exchange: Sun Oct 18 11:28:24 2026' in short-term entries,
+# '[2026-10-18 11:28:24] ' in front of long-term entries) and into the current time message
+_TIMESTAMPS = re.compile(r"[A-Z][a-z]{2} [A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2} \d{4}"
+                         r"|\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] ?")
+
+
+def count_tokens(text):
     """
-    Constructs the data to be sent to the OpenAI API for processing in a multi-turn format.
-    It expects a memory structure and a system prompt.
+    Returns the number of tokens in a text.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)  # Rough estimate for English text when tiktoken is not installed
 
-    Creates an initial 'developer' message containing time, base prompt, base memory,
-    and long-term memory. Then, processes short-term memory entries:
-    'system_' and '0_system_' keys become separate 'system' messages.
-    Other keys ('user_', 'assistant_', etc.) become messages with their corresponding roles.
-    Messages are added in chronological order based on short-term keys.
 
-    Args:
-        memory_structure (dict): The dictionary representing the memory structure.
-                                    Expected keys: 'base_memory', 'long_term', 'short_term'.
-        sys_prompt (str): The base system prompt to include in the developer message.
+def strip_timestamps(text):
+    """
+    Returns a text without the times memory_handle and context_builder write into the memories and messages,
+    so the same conversation had at another time gives the same text (used for the keys of recordings and by
+    retrieval).
+    """
+    return _TIMESTAMPS.sub("", text)
 
-    Returns:
-        list: A list of message dictionaries formatted for the OpenAI API.
+
+DEFAULT_SYS_PROMPT = "You are an agent in an text adventure game, you have to interact with the CLI, figure  out what to do and how to interact these are your deep memories System Memory Overview:\n\n"
+
+
+class context_builder:
     """
-    messages = []
+    Builds the messages for the OpenAI API turn after turn without starting from scratch every time.
 
-    # --- Construct the initial 'developer' message (keeping original structure) ---
-    current_time_unix = int(time.time())
-    formatted_time = time.ctime(current_time_unix)
+    The messages are laid out so their beginning stays the same between turns, which lets the provider reuse its
+    cached prefix (and bill those input tokens as cached):
 
-    system_message_content = f"The current time is: {formatted_time} \n\n"
-    system_message_content += f"{sys_prompt}\n\n"
+        1. A 'developer' message with the system prompt, base memory and long-term memory. It is only rebuilt
+           when one of those changes, which only happens when the memory is summarized.
+        2. One message per short-term entry. Messages for entries seen in an earlier turn are reused, only new
+           entries are turned into messages.
+        3. A last 'system' message with the current time, the only part that changes every turn.
 
-    base_memory = memory_structure.get("base_memory", "No base memory available.")
-    system_message_content += "Base Memory:\n"
-    system_message_content += base_memory + "\n\n"
+    With a retriever the long-term memory is left out of the prefix, instead the entries relevant to the latest
+    user (or game) message are sent in a 'developer' message right before the current time.
 
-    long_term_memory = memory_structure.get("long_term", [])
-    if long_term_memory:
-        system_message_content += "Long-Term Memory:\n"
-        for i, entry in enumerate(long_term_memory, 1):
-            system_message_content += f"{i}. {entry}\n"
-    else:
-        system_message_content += "No long-term memory entries available.\n"
+    Keep one builder per conversation (and system prompt) to get the benefits, construct_data() builds from scratch.
+    build() can also fit the memories into a token budget, dropping the oldest entries first.
+    """
 
-    developer_message = {
-        "role": "developer",
-        "content": system_message_content
-    }
-    messages.append(developer_message) # Add the initial developer message
+    # The order in which the sections get what is left of a token budget after the system prompt,
+    # the current time and the latest turns
+    DEFAULT_PRIORITIES = ("base_memory", "long_term", "short_term")
 
-    # --- Process Short-Term Memory entries ---
-    short_term_memory = memory_structure.get("short_term", {})
+    def __init__(self, sys_prompt=DEFAULT_SYS_PROMPT, priorities=DEFAULT_PRIORITIES, min_recent_turns=2,
+                 retriever=None, retrieval_k=5):
+        self.sys_prompt = sys_prompt
+        self.priorities = priorities
+        self.min_recent_turns = min_recent_turns  # Latest short-term entries that are always sent, even over budget
+        # Optional function (query, k) -> long-term entries best first, e.g. memory_manager.search_long_term.
+        # When set only the retrieval_k entries relevant to the latest message are sent instead of all of them.
+        self.retriever = retriever
+        self.retrieval_k = retrieval_k
+        self.prefix_rebuilds = 0  # How often the stable prefix had to be rebuilt, useful to see how well it caches
+        self.last_usage = {}  # Tokens used per section by the last build
 
-    # Sort keys to maintain chronological order for conversation turns
-    # Assumes keys like "user_timestamp", "assistant_timestamp", "0_system_timestamp", etc.
-    # Sort keys based on the numeric timestamp part
-    sorted_short_term_keys = sorted(short_term_memory.keys(), key=lambda k: int(k.split('_')[-1]))
+        self._prefix_key = None
+        self._prefix_message = None
+        self._short_term_messages = {}  # Short-term key -> message built for it
+        self._sys_prompt_counted = (None, 0)  # (system prompt, its tokens)
+
+    def _build_prefix(self, base_memory, long_term_memory):
+        system_message_content = f"{self.sys_prompt}\n\n"
+
+        system_message_content += "Base Memory:\n"
+        system_message_content += base_memory + "\n\n"
+
+        if long_term_memory is None:
+            pass  # Long-term memories are retrieved per turn and sent after the conversation
+        elif long_term_memory:
+            system_message_content += "Long-Term Memory:\n"
+            system_message_content += "".join(f"{i}. {entry}\n" for i, entry in enumerate(long_term_memory, 1))
+        else:
+            system_message_content += "No long-term memory entries available.\n"
 
-    for key in sorted_short_term_keys:
-        text = short_term_memory[key]
-        message_entry = None # Initialize message entry
+        return {
+            "role": "developer",
+            "content": system_message_content
+        }
 
+    @staticmethod
+    def _build_short_term_message(key, text):
         # Check if the key is a system variant
         if key.startswith("0_system_") or key.startswith("system_"):
-                # Create a system message from this entry
-                message_entry = {
-                    "role": "system",
-                    "content": text
-                }
-                # Note: The '0_' or 'system_' prefix is implicitly handled
-                # by just assigning the "system" role and using the value as content.
+            # Create a system message from this entry
+            # Note: The '0_' or 'system_' prefix is implicitly handled
+            # by just assigning the "system" role and using the value as content.
+            return {"role": "system", "content": text}
 
+        # Process non-system keys (user, assistant, etc.)
+        # Extract the role from the key (e.g., "user_123" -> "user")
+        # Use split('_', 1) to handle potential underscores within the identifier part
+        parts = key.split('_', 1)
+        if len(parts) > 1:
+            role = parts[0]
+            # Basic validation for common API roles, excluding 'system' which is handled above
+            valid_roles = ["user", "assistant"]
+            if role in valid_roles:
+                return {"role": role, "content": text}
+
+            # Handle unexpected roles - maybe default to user?
+            print(f"Warning: Unexpected role '{role}' extracted from key '{key}'. Treating as 'user'.")
+            return {"role": "user", "content": text}
+
+        # Handle keys with no underscore - unexpected, treat as user?
+        print(f"Warning: Key '{key}' in short_term has no underscore. Treating as 'user'.")
+        return {"role": "user", "content": text}
+
+    def _sys_prompt_tokens(self):
+        if self._sys_prompt_counted[0] is not self.sys_prompt:
+            self._sys_prompt_counted = (self.sys_prompt, count_tokens(self.sys_prompt))
+        return self._sys_prompt_counted[1]
+
+    @staticmethod
+    def _count_entries(memory_structure, base_memory, long_term_memory, short_term_items):
+        """
+        Returns the tokens of the base memory, of every long-term entry and of every short-term entry. The counts the
+        memory structure carries ('token_counts') are used when it has them, anything else is counted here.
+        """
+        token_counts = memory_structure.get("token_counts") or {}
+
+        base_tokens = token_counts.get("base_memory")
+        if base_tokens is None or base_memory is not memory_structure.get("base_memory"):
+            base_tokens = count_tokens(base_memory)
+
+        long_term_counts = token_counts.get("long_term", ())
+        if long_term_memory is memory_structure.get("long_term") and len(long_term_counts) >= len(long_term_memory):
+            long_term_tokens = list(long_term_counts[:len(long_term_memory)])
         else:
-                # Process non-system keys (user, assistant, etc.)
-                # Extract the role from the key (e.g., "user_123" -> "user")
-                # Use split('_', 1) to handle potential underscores within the identifier part
-                parts = key.split('_', 1)
-                if len(parts) > 0:
-                    role = parts[0]
-                    # Basic validation for common API roles, excluding 'system' which is handled above
-                    valid_roles = ["user", "assistant"]
-                    if role in valid_roles:
-                            message_entry = {"role": role, "content": text}
-                    else:
-                        # Handle unexpected roles - maybe default to user?
-                        print(f"Warning: Unexpected role '{role}' extracted from key '{key}'. Treating as 'user'.")
-                        
-                        message_entry = {"role": "user", "content": text}
+            # Retrieved entries (or a structure without counts)
+            long_term_tokens = [count_tokens(entry) for entry in long_term_memory]
+
+        short_term_counts = token_counts.get("short_term", {})
+        short_term_tokens = []
+        for key, text in short_term_items:
+            tokens = short_term_counts.get(key)
+            short_term_tokens.append(count_tokens(text) if tokens is None else tokens)
+
+        return base_tokens, long_term_tokens, short_term_tokens
+
+    def _fit_budget(self, base_memory, long_term_memory, short_term_items, token_budget, time_tokens, counts):
+        """
+        Picks what fits into the token budget. The system prompt, the current time and the latest
+        `min_recent_turns` short-term entries are always sent, the rest of the budget goes to the sections in the
+        order of `priorities`. Long-term and short-term entries are taken newest first, so the oldest are dropped.
+        Returns the chosen base memory, long-term entries, short-term items and the tokens used per section.
+        """
+        base_tokens, long_term_tokens, short_term_tokens = counts
+        short_term_costs = [tokens + MESSAGE_TOKEN_OVERHEAD for tokens in short_term_tokens]
+
+        usage = {"system_prompt": self._sys_prompt_tokens() + MESSAGE_TOKEN_OVERHEAD, "time": time_tokens,
+                 "base_memory": 0, "long_term": 0, "short_term": 0}
+
+        recent_count = min(self.min_recent_turns, len(short_term_items))
+        split = len(short_term_items) - recent_count
+        recent = short_term_items[split:]
+        older = short_term_items[:split]
+        usage["short_term"] = sum(short_term_costs[split:])
+
+        remaining = token_budget - usage["system_prompt"] - usage["time"] - usage["short_term"]
+        chosen_base, chosen_long_term, chosen_older = "", [], []
+
+        for section in self.priorities:
+            if section == "base_memory":
+                tokens = base_tokens
+                if tokens <= remaining:
+                    chosen_base = base_memory
+                elif remaining > 0:
+                    # Keep the beginning of the base memory, cut roughly where the budget runs out
+                    chosen_base = base_memory[:len(base_memory) * remaining // tokens] + " [...]"
+                    tokens = count_tokens(chosen_base)
                 else:
-                    # Handle keys with no underscore - unexpected, treat as user?
-                    print(f"Warning: Key '{key}' in short_term has no underscore. Treating as 'user'.")
-                    message_entry = {"role": "user", "content": text}
+                    tokens = 0
+                usage["base_memory"] = tokens
+                remaining -= tokens
+
+            elif section == "long_term":
+                for i in range(len(long_term_memory) - 1, -1, -1):
+                    entry = long_term_memory[i]
+                    tokens = long_term_tokens[i] + 2  # The numbering in front of the entry
+                    if tokens > remaining:
+                        break
+                    chosen_long_term.append(entry)
+                    usage["long_term"] += tokens
+                    remaining -= tokens
+                chosen_long_term.reverse()
+
+            elif section == "short_term":
+                for i in range(split - 1, -1, -1):
+                    item = older[i]
+                    tokens = short_term_costs[i]
+                    if tokens > remaining:
+                        break
+                    chosen_older.append(item)
+                    usage["short_term"] += tokens
+                    remaining -= tokens
+                chosen_older.reverse()
+
+        usage["total"] = sum(usage.values())
+        usage["budget"] = token_budget
+        usage["dropped_long_term"] = len(long_term_memory) - len(chosen_long_term)
+        usage["dropped_short_term"] = len(older) - len(chosen_older)
+        return chosen_base, chosen_long_term, chosen_older + recent, usage
+
+    def build(self, memory_structure, token_budget=None):
+        """
+        Returns the list of messages for the given memory structure (see construct_data).
 
-        # Append the created message entry if one was generated
-        if message_entry:
+        With a token_budget the memories are fitted into that many input tokens (see _fit_budget).
+        The tokens used per section are reported in `last_usage` either way.
+        """
+        base_memory = memory_structure.get("base_memory", "No base memory available.")
+        long_term_memory = memory_structure.get("long_term", [])
+        short_term_items = list(memory_structure.get("short_term", {}).items())
+
+        if self.retriever is not None:
+            # Query with the latest message that isn't our own answer, least relevant first so the most relevant
+            # entry ends up closest to the conversation (and is the last one dropped by a token budget)
+            query = next((text for key, text in reversed(short_term_items) if not key.startswith("assistant_")), "")
+            long_term_memory = self.retriever(query, self.retrieval_k)[::-1] if query else []
+
+        formatted_time = time.ctime(int(time.time()))
+        time_message = {"role": "system", "content": f"The current time is: {formatted_time}"}
+        time_tokens = count_tokens(time_message["content"]) + MESSAGE_TOKEN_OVERHEAD
+        counts = self._count_entries(memory_structure, base_memory, long_term_memory, short_term_items)
+
+        if token_budget:
+            base_memory, long_term_memory, short_term_items, self.last_usage = self._fit_budget(
+                base_memory, long_term_memory, short_term_items, token_budget, time_tokens, counts)
+        else:
+            base_tokens, long_term_tokens, short_term_tokens = counts
+            self.last_usage = {
+                "system_prompt": self._sys_prompt_tokens() + MESSAGE_TOKEN_OVERHEAD,
+                "time": time_tokens,
+                "base_memory": base_tokens,
+                "long_term": sum(long_term_tokens) + 2 * len(long_term_tokens),
+                "short_term": sum(short_term_tokens) + MESSAGE_TOKEN_OVERHEAD * len(short_term_tokens),
+            }
+            self.last_usage["total"] = sum(self.last_usage.values())
+
+        # --- The stable prefix, only rebuilt when the system prompt, base or long-term memory change ---
+        # Comparing is cheap, entries that come from the same memory are the same string objects.
+        # Note that trimming the base or long-term memory to a budget changes the prefix as well.
+        prefix_long_term = None if self.retriever is not None else long_term_memory
+        prefix_key = (self.sys_prompt, base_memory, None if prefix_long_term is None else tuple(prefix_long_term))
+        if prefix_key != self._prefix_key:
+            self._prefix_message = self._build_prefix(base_memory, prefix_long_term)
+            self._prefix_key = prefix_key
+            self.prefix_rebuilds += 1
+
+        messages = [self._prefix_message]
+
+        # --- Short-Term Memory entries, in chronological order ---
+        # Keys like "user_sequence", "assistant_sequence", "0_system_sequence", etc. are stored by memory_handle
+        # in chronological order already, so the conversation turns are simply taken in order
+        previous_messages = self._short_term_messages
+        short_term_messages = {}
+        for key, text in short_term_items:
+            message_entry = previous_messages.get(key)
+            if message_entry is None or message_entry["content"] is not text:
+                message_entry = self._build_short_term_message(key, text)
+            short_term_messages[key] = message_entry
             messages.append(message_entry)
+        # Messages of purged entries are dropped here
+        self._short_term_messages = short_term_messages
+
+        # --- The volatile part goes last so it never breaks the cached prefix ---
+        if self.retriever is not None and long_term_memory:
+            messages.append({
+                "role": "developer",
+                "content": "Relevant Long-Term Memory:\n" + "".join(f"- {entry}\n" for entry in long_term_memory)
+            })
+        messages.append(time_message)
+
+        # print("👾👾 👾👾 THESE ARE THE MESSAGES WE ARE SENDING INTO THE AI 👾👾 👾👾")
+        # print(messages)
+        return messages
 
 
-    # print("👾👾 👾👾 THESE ARE THE MESSAGES WE ARE SENDING INTO THE AI 👾👾 👾👾")
-    # print(messages)
-    return messages
+def construct_data(memory_structure, sys_prompt=DEFAULT_SYS_PROMPT, token_budget=None):
+    """
+    Constructs the data to be sent to the OpenAI API for processing in a multi-turn format.
+    It expects a memory structure and a system prompt.
+
+    Creates an initial 'developer' message containing the base prompt, base memory,
+    and long-term memory. Then, processes short-term memory entries:
+    'system_' and '0_system_' keys become separate 'system' messages.
+    Other keys ('user_', 'assistant_', etc.) become messages with their corresponding roles.
+    Messages are added in the order of the short-term section, which memory_handle keeps chronological.
+    A final 'system' message holds the current time, it is kept at the end so the start of the
+    messages stays the same between turns.
+
+    This builds everything from scratch, use a context_builder to build turn after turn incrementally.
+
+    Args:
+        memory_structure (dict): The dictionary representing the memory structure.
+                                    Expected keys: 'base_memory', 'long_term', 'short_term'.
+        sys_prompt (str): The base system prompt to include in the developer message.
+        token_budget (int, optional): Maximum number of input tokens, the oldest memories are left out to fit.
+
+    Returns:
+        list: A list of message dictionaries formatted for the OpenAI API.
+    """
+    return context_builder(sys_prompt).build(memory_structure, token_budget)
@@ -4,15 +4,20 @@
 
 import os
 import sys
-from ai_handle import ai_bot
+from ai_handle import pooled_ai_bot, memory_prompt_budget
 from memory_handle import memory_manager
+from metrics_handle import metrics
 import time
 
 class CLIChatbot:
     def __init__(self):
         """Initialize the CLI chatbot with AI bot and memory systems."""
-        self.ai = ai_bot()
-        self.memory = memory_manager(ai_bot_instance=self.ai)
+        self.ai = pooled_ai_bot()  # Retries rate limits and transient API errors instead of failing the turn
+        # Summaries are created in the background so the conversation never waits on them, and the oldest
+        # memories are already summarized before the threshold is reached. Compaction keeps the memories within
+        # memory_prompt_budget tokens (config.ini), however long the single messages are
+        self.memory = memory_manager(ai_bot_instance=self.ai, compaction="background", speculative=True,
+                                     scheduler="tokens", scheduler_options={"prompt_budget": memory_prompt_budget})
         self.running = True
         self.clear_screen()
         self.show_welcome()
@@ -29,8 +34,9 @@ class CLIChatbot:
         print("\nWelcome to your AI assistant with memory capabilities!")
         print("\nCommands:")
         print("  !exit    - Exit the chatbot")
-        print("  !memory  - View current memory structure")
+        print("  !memory  - View a summary of the memory (!memory all for everything)")
         print("  !check   - Manually trigger memory check/summarization")
+        print("  !metrics - Show timings, token usage and other metrics")
         print("  !clear   - Clear the screen")
         print("  !help    - Show this help message")
         print("\nStart chatting below:")
@@ -46,6 +52,25 @@ class CLIChatbot:
             return True
             
         elif command == "!memory":
+            counts = self.memory.get_counts()
+            view = self.memory.get_memory_view()
+            print("\n--- CURRENT MEMORY ---")
+            print(f"Short-term entries: {counts['short_term']} "
+                  f"({', '.join(f'{tag}: {n}' for tag, n in counts['short_term_tags'].items()) or 'none'})")
+            print(f"Long-term entries: {counts['long_term']}")
+            plan = self.memory.get_compaction_plan()
+            print(f"Next compaction: short-term {plan['short_term']['reason']}, long-term {plan['long_term']['reason']}")
+            print(f"\nBase memory:\n{view['base_memory'] or '(empty)'}")
+            print("\nLatest long-term memories:")
+            for entry in view["long_term"][-3:]:
+                print(f"  - {entry}")
+            print("\nLatest short-term memories:")
+            for key, entry in self.memory.get_last_short_term(6):
+                print(f"  [{key}] {entry}")
+            print("\n(!memory all shows the whole memory structure)")
+            return True
+
+        elif command == "!memory all":
             print("\n--- CURRENT MEMORY STRUCTURE ---")
             print(self.memory.get_memory_structure(formatted=True))
             return True
@@ -53,9 +78,15 @@ class CLIChatbot:
         elif command == "!check":
             print("\nTriggering memory check...")
             self.memory.check()
+            self.memory.drain()  # Wait for the summaries when the check is requested by hand
             print("Memory check complete.")
             return True
             
+        elif command == "!metrics":
+            print("\n--- Metrics ---")
+            print(metrics.to_prometheus())
+            return True
+            
         elif command == "!clear":
             self.clear_screen()
             self.show_welcome()
@@ -72,27 +103,33 @@ class CLIChatbot:
         # Save user input to short-term memory
         self.memory.save_to_memory(user_input, "short_term", "user")
         
-        # Get current memory structure for the AI to use
-        mem_structure = self.memory.get_memory_structure()
+        # Get a read-only view of the memory for the AI to use, nothing is copied
+        mem_structure = self.memory.get_memory_view()
         
         # Get AI response
         try:
             print("\n🤖 Thinking...")
-            response, thinking = self.ai.adventure_response(mem_structure, "You are a conversational bot with absolute freedom. You are a digital entity.")
+            # The answer is shown while it is being written, field by field
+            streamed = {"thinking": "", "response": ""}
+            headings = {"thinking": "\n🧠 Thinking process:", "response": "\n\n🤖 Response:"}
+            shown = None
+            for field, text in self.ai.stream_response(mem_structure, "You are a conversational bot with absolute freedom. You are a digital entity."):
+                if field not in streamed:
+                    continue
+                if field != shown:
+                    print(headings[field])
+                    shown = field
+                print(text, end="", flush=True)
+                streamed[field] += text
+            print()
+            thinking, response = streamed["thinking"], streamed["response"]
             
-            # Save AI response to short-term memory
+            # Save AI response to short-term memory once it is complete
             # here one can choose to append the thinking process to the memories or keep them out
             memory_snippet= f"Thoughts: {thinking}\n Action:{response}"
 
             self.memory.save_to_memory(memory_snippet, "short_term", "assistant")
             
-            # Uncomment to show AI's thinking process
-            print("\n🧠 Thinking process:")
-            print(f"{thinking}")
-            
-            print("\n🤖 Response:")
-            print(f"{response}")
-            
             
             
         except Exception as e:
@@ -128,6 +165,8 @@ class CLIChatbot:
         except Exception as e:
             print(f"\nUnexpected error: {e}")
         finally:
+            # Write any memories still waiting in the write-back cache
+            self.memory.close()
             print("\nThank you for using the Memory-Enabled AI Chatbot!")
 
 def main():
@@ -5,70 +5,678 @@
 # It helps you set up a JSON database, to do different kinds of querries for memory management, the memory manager class contains functions to save
 # memories into different sections and engage in a 'check' to summarize memories above our thesholds.
 
+# How the memories are written to disk is decided by a storage backend from storage_handle ('json' by default, 'journal' for an append-only log,
+# 'sqlite' for indexed tables).
 
+
+import contextvars
+import hashlib
 import json
-import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from datetime import datetime
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from storage_handle import make_storage, apply_op, replace_ops, file_lock
+from helper_tools import count_tokens
+from retrieval_handle import bm25_index
+from archive_handle import cold_archive
+from dedup_handle import duplicate_filter
+from schedule_handle import make_scheduler
+from metrics_handle import metrics as default_metrics
+
+class short_term_index:
+    """
+    Keeps the short-term keys in the order they were saved, next to their sequence numbers and timestamps.
+
+    Short-term keys look like 'tag_sequence' where the sequence number only ever grows, so new entries are always
+    added at the end and nothing ever has to be sorted. Reading the last N entries or the entries after a given
+    sequence number only costs the number of entries returned.
+
+    The number of tokens of every entry is counted once when it is added and kept here, for the context builder
+    and the scheduler, together with their running total.
+    """
+
+    def __init__(self):
+        self.seqs = []
+        self.keys = []
+        self.times = []
+        self.tags = {}  # tag -> keys with that tag, oldest first
+        self.tokens = {}  # key -> tokens of the entry
+        self.total_tokens = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def parse_key(key):
+        """
+        Splits a short-term key into its tag and sequence number (None if it has no numeric suffix).
+        """
+        tag, _, suffix = key.rpartition('_')
+        if not tag:
+            return key, None
+        try:
+            return tag, int(suffix)
+        except ValueError:
+            return tag, None
+
+    def add(self, seq, key, timestamp, tokens):
+        self.seqs.append(seq)
+        self.keys.append(key)
+        self.times.append(timestamp)
+        self.tags.setdefault(self.parse_key(key)[0], []).append(key)
+        self.tokens[key] = tokens
+        self.total_tokens += tokens
+
+    def rebuild(self, short_term_memory, meta=None):
+        """
+        Rebuilds the index from a short-term section (in its stored order). Older databases used the unix time
+        as the key suffix, it is used as the timestamp of the entries that have no saved time.
+        Only entries the index didn't have before are counted again.
+        Returns False if the stored order did not follow the sequence numbers.
+        """
+        meta = meta or {}
+        counted = self.tokens
+        self.seqs, self.keys, self.times, self.tags, self.tokens = [], [], [], {}, {}
+        self.total_tokens = 0
+        last_seq = 0
+        for key, value in short_term_memory.items():
+            seq = self.parse_key(key)[1]
+            if seq is None:
+                seq = last_seq + 1
+            timestamp = meta.get(key, {}).get("time", seq if seq > 1e9 else 0.0)
+            tokens = counted.get(key)
+            self.add(seq, key, timestamp, count_tokens(value) if tokens is None else tokens)
+            last_seq = max(last_seq, seq)
+        return self.seqs == sorted(self.seqs)
+
+    def drop_oldest(self, n):
+        """
+        Forgets the oldest n entries, which is all a purge does, without rebuilding the whole index.
+        """
+        dropped = set(self.keys[:n])
+        self.seqs, self.keys, self.times = self.seqs[n:], self.keys[n:], self.times[n:]
+        self.tags = {tag: kept for tag, kept in ((tag, [key for key in keys if key not in dropped])
+                                                 for tag, keys in self.tags.items()) if kept}
+        self.total_tokens -= sum(self.tokens[key] for key in dropped)
+        # A new dictionary, views handed out keep the counts of the entries they show
+        self.tokens = {key: tokens for key, tokens in self.tokens.items() if key not in dropped}
+
+    @property
+    def last_seq(self):
+        return max(self.seqs) if self.seqs else 0
+
+    def last(self, n):
+        """
+        Returns the keys of the latest n entries, oldest first.
+        """
+        return self.keys[-n:] if n > 0 else []
+
+    def since(self, seq):
+        """
+        Returns the keys of the entries with a sequence number greater than seq, oldest first.
+        """
+        return self.keys[bisect_right(self.seqs, seq):]
+
+    def by_tag(self, tag, n=None):
+        """
+        Returns the keys of the entries with the given tag (the latest n if given), oldest first.
+        """
+        keys = self.tags.get(tag, [])
+        return keys if n is None else keys[-n:] if n > 0 else []
+
+    def between(self, start=None, end=None):
+        """
+        Returns the keys of the entries saved between the start and end timestamps (both included, None is open ended).
+        """
+        first = bisect_left(self.times, start) if start is not None else 0
+        last = bisect_right(self.times, end) if end is not None else len(self.times)
+        return self.keys[first:last]
+
+
+class long_term_index:
+    """
+    Keeps the time and the number of tokens of every long-term entry, in the same order as the entries.
+
+    Long-term entries start with the time they were saved ('[2025-01-31 12:00:00] ...'), entries without one get the
+    time of the entry before them, so the times never go down and can be searched by bisection.
+    """
+
+    TIME_PREFIX = re.compile(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]")
+
+    def __init__(self):
+        self.times = []
+        self.tokens = []
+        self.total_tokens = 0
+
+    @classmethod
+    def entry_time(cls, entry):
+        """
+        Returns the time in the entry's '[timestamp]' prefix, None if it has none.
+        """
+        match = cls.TIME_PREFIX.match(entry) if isinstance(entry, str) else None
+        return datetime.fromisoformat(match.group(1)).timestamp() if match else None  # Much faster than strptime
+
+    def add(self, entry):
+        timestamp = self.times[-1] if self.times else 0.0
+        entry_time = self.entry_time(entry)
+        if entry_time is not None:
+            timestamp = max(timestamp, entry_time)
+        self.times.append(timestamp)
+        self.tokens.append(count_tokens(entry if isinstance(entry, str) else str(entry)))
+        self.total_tokens += self.tokens[-1]
+
+    def rebuild(self, entries):
+        self.times, self.tokens, self.total_tokens = [], [], 0
+        for entry in entries:
+            self.add(entry)
+
+    def since(self, timestamp):
+        """
+        Returns the position of the first entry saved at or after the timestamp.
+        """
+        return bisect_left(self.times, timestamp)
+
+
+class list_view(Sequence):
+    """
+    Read-only view of a list, the list isn't copied.
+    """
+
+    def __init__(self, items):
+        self._items = items
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def __repr__(self):
+        return f"list_view({self._items!r})"
+
 
 class memory_manager:
 
     # These numbers need to be adjusted to find an optimal spot, lower seems to be better for coherence during conversation and summarization.
+    # They are used by the default 'count' scheduler, the 'tokens' scheduler sizes the tiers by tokens instead (see schedule_handle).
     SHORT_TERM_THRESHOLD = 30  # Number of short-term entries before summarizing
     LONG_TERM_THRESHOLD = 20   # Number of long-term entries before summarizing
     SHORT_TERM_KEEP_COUNT = 10  # Number of latest short-term entries to keep after summarizing
     LONG_TERM_KEEP_COUNT = 10   # Number of latest long-term entries to keep after summarizing
 
-    def __init__(self, ai_bot_instance=None, filepath="memory_database.json"):
+    # Write-back policies, deciding when the in-memory state is written to the storage backend:
+    #   'through'  - every save is written immediately (default, same durability as before)
+    #   'count'    - written once every `flush_every` saves
+    #   'interval' - written at most `flush_interval_ms` milliseconds after the first unsaved change
+    #   'close'    - only written on flush(), close() or when leaving a `with memory_manager(...)` block
+    #   'group'    - group commit: saves arriving within `group_commit_ms` of each other are written and fsynced
+    #                together, every save only returns once it is durable
+    WRITE_BACK_POLICIES = ("through", "count", "interval", "close", "group")
+
+    # Compaction modes: 'sync' summarizes inside check(), 'background' hands it to a worker thread
+    COMPACTION_MODES = ("sync", "background")
+
+    # Summarization modes, deciding what a check sends to the AI:
+    #   'full'        - every short-term entry, and the base memory with every long-term entry (the original behaviour,
+    #                   entries kept after a purge are summarized again by the next check)
+    #   'incremental' - only the entries no earlier check summarized yet, folded into the existing summaries
+    #   'map_reduce'  - incremental, and a backlog over `summary_chunk_tokens` is split into chunks that are summarized
+    #                   in parallel, the chunk summaries are then folded in (chunked again if still too long)
+    SUMMARIZATION_MODES = ("full", "incremental", "map_reduce")
+
+    # Where load/save timings, bytes written, compactions and summarization latency are reported (see metrics_handle)
+    metrics = default_metrics
+
+    def __init__(self, ai_bot_instance=None, filepath=None, backend="json", storage_options=None,
+                 write_back="through", flush_every=10, flush_interval_ms=1000, group_commit_ms=5,
+                 compaction="sync", executor=None, retrieval=False,
+                 summarization="full", summary_chunk_tokens=2000, summary_workers=4,
+                 speculative=False, speculative_ratio=0.8, archive=None, dedup=None,
+                 scheduler="count", scheduler_options=None):
         """
         Initializes the memory manager with the path to the JSON database file
         and an optional AI bot instance.
+
+        The backend can be the name of a storage backend ('json', 'journal' or 'sqlite') or an already built storage object,
+        storage_options are passed on to it (e.g. {"session": "game_1"} for 'sqlite'). Without a filepath the backend's
+        default file is used ('memory_database.json', or 'memory_database.db' for 'sqlite').
+        The memory is loaded once, afterwards the manager works on its in-memory copy and writes changes back
+        according to the write_back policy (see WRITE_BACK_POLICIES).
+        With compaction="background" summarization runs on a worker thread, an executor can be passed in to share one.
+        With retrieval=True a BM25 index is kept over the long-term entries, and entries dropped from long-term
+        memory are archived instead of discarded (in the cold archive if there is one, otherwise appended to a file
+        next to the database, see _retrieval_archive_path), so search_long_term() can find the relevant ones.
+        The summarization mode decides how much a check sends to the AI (see SUMMARIZATION_MODES), map_reduce summarizes
+        chunks of at most summary_chunk_tokens tokens with up to summary_workers requests at the same time.
+        With speculative=True the oldest short-term entries are already summarized in the background once short-term
+        memory reaches speculative_ratio of its threshold, so the check at the threshold only has to apply the summary.
+        With an archive (a directory, or a cold_archive from archive_handle) every entry a check purges is kept there,
+        get_archived() reads them back by time range.
+        With dedup (True, or a duplicate_filter from dedup_handle) a short-term entry repeating one of the latest
+        entries of the same tag (exactly, or nearly with a duplicate_filter given a threshold) is saved as a short
+        reference to it, naming its tag and time, with a repeat count.
+        The scheduler ('count', 'tokens' or an already built scheduler from schedule_handle) decides when a check
+        compacts a tier and how much it keeps, scheduler_options are passed on to it (e.g. {"prompt_budget": 3000}).
         """
-        self.filepath = filepath  # Now filepath is configurable
+        if write_back not in self.WRITE_BACK_POLICIES:
+            raise ValueError(f"Invalid write_back policy '{write_back}'. Must be one of {self.WRITE_BACK_POLICIES}.")
+        if compaction not in self.COMPACTION_MODES:
+            raise ValueError(f"Invalid compaction mode '{compaction}'. Must be one of {self.COMPACTION_MODES}.")
+        if summarization not in self.SUMMARIZATION_MODES:
+            raise ValueError(f"Invalid summarization mode '{summarization}'. Must be one of {self.SUMMARIZATION_MODES}.")
+
+        self.storage = make_storage(backend, filepath, **(storage_options or {}))
+        self.filepath = self.storage.filepath  # Now filepath is configurable
+        self.write_back = write_back
+        self.flush_every = flush_every
+        self.flush_interval_ms = flush_interval_ms
+        self.group_commit_ms = group_commit_ms
+
+        self._lock = threading.RLock()
+        self._committed = threading.Condition(self._lock)  # Notified whenever a flush finished
+        self._saves_recorded = 0  # Saves recorded so far, and how many of them have been written
+        self._saves_written = 0
+        self._group_leader = False  # True while a save is collecting a group commit
+        self._pending = []  # Operations not yet handed to the storage backend
+        self._dirty = set()  # Sections changed since the last flush
+        self._saves_since_flush = 0
+        self._timer = None
+        self._batch_depth = 0  # Number of open batch() blocks, changes are only written when it drops back to 0
+
+        self.compaction = compaction
+        self._executor = executor
+        self._owns_executor = False
+        self._compaction_job = None
+
+        self.summarization = summarization
+        self.summary_chunk_tokens = summary_chunk_tokens
+        self.summary_workers = summary_workers
+
+        self.speculative = speculative
+        self.speculative_ratio = speculative_ratio
+        self._speculation = None  # The running or finished speculative summary: {"keys", "lines", "job"}
+        self._speculation_executor = None
+
+        self.scheduler = make_scheduler(scheduler, **(scheduler_options or {}))
+
+        self._backend_name = getattr(self.storage, "name", type(self.storage).__name__)
         self._check_and_create_db()
-
-        # Use provided bot instance or create a new one if needed
-        if ai_bot_instance:
-            self.bot_instance = ai_bot_instance
-        else:
+        with self.metrics.timer("memory_load_seconds", backend=self._backend_name):
+            self._memory = self.storage.load()
+
+        # Short-term entries are kept in saving order, each one gets the next sequence number
+        self._short_term_index = short_term_index()
+        self._long_term_index = long_term_index()
+        self._base_memory_counted = ("", 0)  # (base memory, its tokens)
+        self._viewed = set()  # Sections handed out as views, they are copied before they are changed in place
+        self._next_seq = 1
+        self._last_time = 0.0
+
+        # Long-term entries (and archived ones) are indexed by their text for retrieval
+        self.retriever = bm25_index() if retrieval else None
+        self._retrieval_archive = set()  # Long-term entries archived for retrieval
+
+        # Purged entries go to the cold archive, if there is one
+        self._owns_archive = isinstance(archive, str)
+        self.archive = cold_archive(archive) if self._owns_archive else archive
+
+        # Repeated short-term entries are saved as references, if there is a duplicate filter
+        self.dedup = duplicate_filter() if dedup is True else (dedup or None)
+
+        if self._memory is not None:
+            if self.retriever is not None:
+                self._open_retrieval_archive()
+            self._rebuild_indexes()
+
+        # Use provided bot instance or create a new one when it is first needed
+        self._bot_instance = ai_bot_instance
+
+    @property
+    def bot_instance(self):
+        if self._bot_instance is None:
             from ai_handle import ai_bot
-            self.bot_instance = ai_bot()
+            self._bot_instance = ai_bot()
+        return self._bot_instance
+
+    @bot_instance.setter
+    def bot_instance(self, bot_instance):
+        self._bot_instance = bot_instance
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _check_and_create_db(self):
         """
         Internal function to check if the JSON database file exists and create it if not.
         """
-        if not os.path.exists(self.filepath):
-            initial_memory = {
-                "short_term": {},
-                "long_term": [],
-                "base_memory": ""
-            }
-            with open(self.filepath, 'w') as f:
-                json.dump(initial_memory, f, indent=4)
+        if self.storage.create():
             print(f"Database file created at: {self.filepath}")
 
     def _load_memory(self):
         """
-        Internal function to load memory data from the JSON file.
+        Internal function returning the in-memory memory data, the storage backend is only read on startup.
         """
-        try:
-            with open(self.filepath, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"Error: Database file not found at {self.filepath}. Please check the path.")
-            return None
-        except json.JSONDecodeError:
-            print(f"Error: Could not decode JSON from {self.filepath}. File might be corrupted.")
-            return None
+        return self._memory
 
     def _save_memory(self, memory_data):
         """
-        Internal function to save memory data to the JSON file.
+        Internal function to replace the memory data, only the sections that actually changed are written.
         """
-        try:
-            with open(self.filepath, 'w') as f:
-                json.dump(memory_data, f, indent=4)
-        except Exception as e:
-            print(f"Error saving to database file: {e}")
+        changed = [section for section, value in memory_data.items() if self._memory.get(section) is not value]
+        self._record(replace_ops(memory_data, changed))
+
+    def _rebuild_indexes(self):
+        """
+        Internal function rebuilding every in-memory index from the in-memory memory data.
+        """
+        self._index_short_term()
+        self._index_dedup()
+        self._long_term_index.rebuild(self._memory.get("long_term", []))
+        if self.retriever is not None:
+            self.retriever = bm25_index()
+            for entry in self._memory.get("long_term", []) + list(self._retrieval_archive):
+                self.retriever.add(entry, str(entry))
+
+    def _retrieval_archive_path(self):
+        """
+        Internal function returning the file the long-term entries dropped by a purge are archived in for retrieval:
+        '<filepath>.archive', or one file per session for a database several sessions share.
+        """
+        session = getattr(self.storage, "session", None)
+        if session is None:
+            return f"{self.filepath}.archive"
+        return f"{self.filepath}.{hashlib.sha1(session.encode('utf-8')).hexdigest()[:12]}.archive"
+
+    def _open_retrieval_archive(self):
+        """
+        Internal function reading the archived long-term entries. With a cold archive they are read from it, otherwise
+        from an append-only file of JSON lines kept out of the database file, so it doesn't have to be rewritten with
+        every change. Databases written before that kept them in a 'long_term_archive' section, which is moved out.
+        """
+        if self.archive is not None:
+            self._retrieval_archive = {entry["value"] for entry in self.archive.fetch(section="long_term")}
+        else:
+            path = self._retrieval_archive_path()
+            with file_lock(path):
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    data = b""
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    # An append cut short by a crash, it would run into the next one
+                    with open(path, 'r+b') as f:
+                        f.truncate(end)
+            self._retrieval_archive = {json.loads(line) for line in data[:end].splitlines() if line}
+
+        if self._memory.get("long_term_archive"):
+            self._archive_long_term(self._memory["long_term_archive"])
+            self._record([{"op": "replace", "section": "long_term_archive", "value": []}])
+
+    def _archive_long_term(self, entries):
+        """
+        Internal function archiving long-term entries dropped by a purge, once: in the cold archive if there is one
+        (with the time of their '[timestamp]' prefix), otherwise with retrieval=True in the retrieval archive file.
+        """
+        if not entries:
+            return
+        if self.archive is not None:
+            timed, entry_time = [], None
+            for entry in entries:
+                # Entries without a time of their own get the time of the entry before them, like in the index
+                entry_time = self._long_term_index.entry_time(entry) or entry_time
+                timed.append((None, entry, entry_time))
+            self._archive_entries("long_term", timed)
+        elif self.retriever is not None:
+            data = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+            with file_lock(self._retrieval_archive_path()):
+                with open(self._retrieval_archive_path(), 'ab') as f:
+                    f.write(data)
+        if self.retriever is not None:
+            self._retrieval_archive.update(entries)
+
+    def _index_short_term(self):
+        """
+        Internal function (re)building the short-term index from the in-memory short-term section.
+        """
+        short_term_memory = self._memory.get("short_term", {})
+        meta = self._memory.get("meta", {}).get("short_term", {})
+        if not self._short_term_index.rebuild(short_term_memory, meta):
+            # Only happens with databases written before keys had sequence numbers, sort them once
+            self._memory["short_term"] = dict(sorted(short_term_memory.items(),
+                                                     key=lambda item: short_term_index.parse_key(item[0])[1] or 0))
+            self._short_term_index.rebuild(self._memory["short_term"], meta)
+        self._next_seq = max(self._next_seq, self._short_term_index.last_seq + 1)
+
+    def _index_dedup(self):
+        """
+        Internal function telling the duplicate filter about the latest short-term entries saved in full.
+        """
+        if self.dedup is None:
+            return
+        self.dedup.clear()
+        meta = self._memory.get("meta", {}).get("short_term", {})
+        short_term_memory = self._memory.get("short_term", {})
+        keys = self._short_term_index.last(len(self._short_term_index))
+        repeats = {}
+        for key in keys:
+            original = meta.get(key, {}).get("repeat_of")
+            if original is not None:
+                repeats[original] = max(repeats.get(original, 1), meta[key].get("repeats", 1))
+        for key in keys:
+            if "repeat_of" not in meta.get(key, {}):
+                tag = short_term_index.parse_key(key)[0]
+                self.dedup.add(tag, key, short_term_memory[key].split("\n Exchange: ", 1)[-1], repeats.get(key, 1))
+
+    def _deduplicate(self, key, tag, string_to_save):
+        """
+        Internal function returning what to save for a new short-term entry: the text itself, or a reference to
+        the earlier entry it repeats, and the extra metadata of the entry.
+        The reference names the earlier entry by its tag and its time of the exchange, which the AI sees with every
+        entry (the keys are never shown to it).
+        """
+        match = self.dedup.find(tag, string_to_save)
+        if match is None:
+            self.dedup.add(tag, key, string_to_save)
+            return string_to_save, {}
+
+        kind, original, similarity, repeats = match
+        saved = self._memory.get("short_term", {}).get(original, "").split("\n Exchange: ", 1)[0]
+        original_time = saved[len("Time of the exchange: "):] if saved.startswith("Time of the exchange: ") else ""
+        if not original_time:
+            # Not in memory yet (saved by another thread right now), it can't be named
+            self.dedup.add(tag, key, string_to_save)
+            return string_to_save, {}
+        described = f"the {tag} message of {original_time}"
+        if kind == "exact":
+            reference = f"[Same as {described}, seen {repeats} times]"
+        else:
+            reference = f"[Nearly the same as {described} ({similarity:.0%} alike), seen {repeats} times]"
+        tokens = self.dedup.saved(tag, original, kind, string_to_save, reference)
+        if not tokens:
+            self.dedup.add(tag, key, string_to_save)
+            return string_to_save, {}
+        self.metrics.count("deduplicated_entries_total", kind=kind)
+        self.metrics.count("dedup_tokens_saved_total", tokens)
+        return reference, {"repeat_of": original, "repeats": repeats}
+
+    def get_dedup_stats(self):
+        """
+        Returns how many short-term entries were checked for repeats, how many were saved as references to an
+        exact or a near duplicate, and the number of tokens that saved. Only available with dedup.
+        """
+        if self.dedup is None:
+            print("Error: No duplicate filter, create the memory_manager with dedup=True.")
+            return {}
+        return dict(self.dedup.stats)
+
+    def _record(self, ops):
+        """
+        Internal function applying operations to the in-memory state and queueing them for the storage backend.
+        """
+        if not ops:
+            return
+        with self._lock:
+            for op in ops:
+                new_entry = op["op"] == "put" and op["key"] not in self._memory.get(op["section"], {})
+                replaced = self._memory.get(op["section"]) if op["op"] == "replace" else None
+                if op["op"] in ("put", "append") and op["section"] in self._viewed:
+                    # Views handed out keep showing the section as it was, the change goes to a copy
+                    section = self._memory.get(op["section"])
+                    if section is not None:
+                        self._memory[op["section"]] = section.copy()
+                    self._viewed.discard(op["section"])
+                apply_op(self._memory, op)
+                if op["section"] == "short_term":
+                    if new_entry:
+                        # Counted once here, the context builder and the scheduler read the count from the index
+                        self._short_term_index.add(short_term_index.parse_key(op["key"])[1], op["key"],
+                                                   op.get("meta", {}).get("time", 0.0), count_tokens(op["value"]))
+                    elif op["op"] == "replace":
+                        kept = self._memory["short_term"]
+                        dropped = len(self._short_term_index) - len(kept)
+                        if ("meta" not in op and dropped >= 0 and list(kept) == self._short_term_index.keys[dropped:]
+                                and all(replaced.get(key) is value for key, value in kept.items())):
+                            # A purge of the oldest entries, the rest of the index stays as it is
+                            self._short_term_index.drop_oldest(dropped)
+                        else:
+                            self._index_short_term()
+                        if self.dedup is not None:
+                            self.dedup.forget(self._memory["short_term"].__contains__)
+                elif op["section"] == "long_term":
+                    if op["op"] == "append":
+                        self._long_term_index.add(op["value"])
+                    else:
+                        self._long_term_index.rebuild(self._memory["long_term"])
+                if self.retriever is not None and op["section"] == "long_term":
+                    self._index_long_term(op, replaced)
+                if op["op"] in ("set", "replace"):
+                    # The section is overwritten as a whole, earlier unsaved changes to it don't need to be written anymore
+                    self._pending = [p for p in self._pending if p["section"] != op["section"]]
+                self._pending.append(op)
+                self._dirty.add(op["section"])
+            self._saves_since_flush += 1
+            self._saves_recorded += 1
+
+            if self._batch_depth == 0:
+                self._after_record()
+
+    def _index_long_term(self, op, replaced):
+        """
+        Internal function keeping the retrieval index up to date with a change to the long-term entries.
+        """
+        if op["op"] == "append":
+            self.retriever.add(op["value"], str(op["value"]))
+            return
+        # A replaced section, entries that left it are only forgotten if they are not archived
+        kept = set(self._memory.get("long_term", [])) | self._retrieval_archive
+        for entry in replaced or []:
+            if entry not in kept:
+                self.retriever.remove(entry)
+        for entry in op["value"]:
+            if entry not in self.retriever:
+                self.retriever.add(entry, str(entry))
+
+    def _after_record(self):
+        """
+        Internal function writing the pending changes if the write-back policy says so.
+        """
+        with self._lock:
+            if self.write_back == "through":
+                self.flush()
+            elif self.write_back == "count" and self._saves_since_flush >= self.flush_every:
+                self.flush()
+            elif self.write_back == "interval" and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval_ms / 1000, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            elif self.write_back == "group":
+                self._group_commit()
+
+    def _group_commit(self):
+        """
+        Internal function waiting until the latest save is durable. The first waiting save leads the group: it waits
+        group_commit_ms for other saves to arrive (the lock is released while waiting) and then flushes them all at once,
+        the others just wait for that flush.
+        """
+        ticket = self._saves_recorded
+        while self._saves_written < ticket:
+            if self._group_leader:
+                self._committed.wait()
+                continue
+            self._group_leader = True
+            try:
+                self._committed.wait(self.group_commit_ms / 1000)
+                self.flush()
+            finally:
+                self._group_leader = False
+                self._committed.notify_all()
+
+    def is_dirty(self, section=None):
+        """
+        Returns True if there are unsaved changes, either in a given section or in any section.
+        """
+        with self._lock:
+            if section is None:
+                return bool(self._dirty)
+            return section in self._dirty
+
+    def flush(self):
+        """
+        Writes all unsaved changes to the storage backend.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending:
+                bytes_before = getattr(self.storage, "bytes_written", 0)
+                with self.metrics.timer("memory_save_seconds", backend=self._backend_name):
+                    self.storage.apply(self._pending)
+                    if self.write_back == "group":
+                        self.storage.sync()
+                self.metrics.count("memory_operations_written_total", len(self._pending), backend=self._backend_name)
+                self.metrics.count("memory_bytes_written_total",
+                                   getattr(self.storage, "bytes_written", 0) - bytes_before, backend=self._backend_name)
+            self._pending = []
+            self._dirty.clear()
+            self._saves_since_flush = 0
+            self._saves_written = self._saves_recorded
+            self._committed.notify_all()
+
+    def close(self):
+        """
+        Waits for a running background compaction, flushes unsaved changes and releases the storage backend.
+        """
+        self.drain()
+        self._discard_speculation()
+        if self._speculation_executor is not None:
+            self._speculation_executor.shutdown(wait=False)  # Nobody waits for a speculative summary anymore
+            self._speculation_executor = None
+        if self._owns_executor:
+            self._executor.shutdown()
+            self._executor = None
+            self._owns_executor = False
+        self.flush()
+        self.storage.close()
+        if self._owns_archive:
+            self.archive.close()
 
 
 
@@ -88,40 +696,58 @@ class memory_manager:
 
 
         """
-        memory_data = self._load_memory()
-        if memory_data is None:
+        if self._memory is None:
+            return
+
+        op = self._build_op(string_to_save, memory_type, tag)
+        if op is None:
             return
 
+        # Only the change itself is recorded, the storage backend decides how much has to be written
+        self._record([op])
+        if op["section"] == "long_term":
+            print("Long term memory saved!")
+        # print(f"Saved to '{memory_type}' memory: '{string_to_save}'") # we want to be logigng this too
+
+    def _build_op(self, string_to_save, memory_type, tag=None):
+        """
+        Internal function turning a memory to save into a storage operation, returns None if the input is invalid.
+        """
         memory_type = memory_type.lower()
-        import time
         current_time = int(time.time())
 
         if memory_type == "short_term":
             if tag is None:
                 print("Error: Tag is required for short_term memory.")
-                return
+                return None
 
             # Use tag directly without appending numbers
             tag = tag.lower()
 
             formatted_time = time.ctime(current_time)
 
-            string_to_save = f"Time of the exchange: {formatted_time}\n Exchange: {string_to_save}"
-
-            # Get the current short-term memory entries
-            short_term_memory = memory_data.get("short_term", {})
+            # Create a unique key using the tag and the next sequence number, so two entries saved within
+            # the same second never overwrite each other. The exact time is kept as metadata of the entry.
+            # The storage hands the numbers out when it can, so other processes writing the same database don't
+            # create the same keys either.
+            with self._lock:
+                next_seq = getattr(self.storage, "next_seq", None)
+                seq = self._next_seq if next_seq is None else next_seq(self._next_seq)
+                self._next_seq = seq + 1
+                self._last_time = max(time.time(), self._last_time)
+                saved_at = self._last_time
+                key = f"{tag}_{seq}"
+                extra_meta = {}
+                if self.dedup is not None:
+                    string_to_save, extra_meta = self._deduplicate(key, tag, string_to_save)
 
-            # Create a unique key using the tag and timestamp
-            key = f"{tag}_{current_time}"
-            short_term_memory[key] = string_to_save
-            memory_data["short_term"] = short_term_memory
+            string_to_save = f"Time of the exchange: {formatted_time}\n Exchange: {string_to_save}"
+            return {"op": "put", "section": "short_term", "key": key, "value": string_to_save,
+                    "meta": {"time": saved_at, **extra_meta}}
 
         elif memory_type == "long_term":
             print("Attempting to save a long term memory!")
 
-            # Get current long-term memory list
-            long_term_memory = memory_data.get("long_term", [])
-
             # Format the timestamp as a human-readable date/time
             from datetime import datetime
             timestamp_str = datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M:%S')
@@ -130,22 +756,214 @@ class memory_manager:
             formatted_memory = f"[{timestamp_str}] {string_to_save}"
 
             # Append the formatted string to the long-term memory list
-            long_term_memory.append(formatted_memory)
-            memory_data["long_term"] = long_term_memory
-
-            print("Long term memory saved!")
+            return {"op": "append", "section": "long_term", "value": formatted_memory}
 
         elif memory_type == "base_memory":
-            memory_data["base_memory"] = string_to_save
+            return {"op": "set", "section": "base_memory", "value": string_to_save}
 
-        else:
+        print(f"Error: Invalid memory_type '{memory_type}'.")
+        return None
+
+    def save_many(self, entries):
+        """
+        Saves several memories at once, they are written to storage as one single write.
+
+        Each entry is a (string_to_save, memory_type) or (string_to_save, memory_type, tag) tuple, or a dictionary
+        with the keys 'string_to_save', 'memory_type' and optionally 'tag'. Invalid entries are skipped.
+        Returns the number of memories saved.
+        """
+        if self._memory is None:
+            return 0
+
+        ops = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                op = self._build_op(entry["string_to_save"], entry["memory_type"], entry.get("tag"))
+            else:
+                op = self._build_op(*entry)
+            if op is not None:
+                ops.append(op)
+
+        self._record(ops)
+        return len(ops)
+
+    def replace_section(self, memory_type, value):
+        """
+        Replaces a whole memory section with the given value, entries are stored exactly as given
+        (no timestamps are added). 'short_term' expects a dictionary of key -> entry, 'long_term' a list
+        of entries and 'base_memory' a string.
+        """
+        if self._memory is None:
+            return
+
+        expected = {"short_term": dict, "long_term": list, "base_memory": str}
+        memory_type = memory_type.lower()
+        if memory_type not in expected:
             print(f"Error: Invalid memory_type '{memory_type}'.")
             return
+        if not isinstance(value, expected[memory_type]):
+            print(f"Error: '{memory_type}' must be replaced with a {expected[memory_type].__name__}.")
+            return
 
-        self._save_memory(memory_data)
-        # print(f"Saved to '{memory_type}' memory: '{string_to_save}'") # we want to be logigng this too
+        self._record([{"op": "replace", "section": memory_type, "value": value}])
 
+    @contextmanager
+    def batch(self):
+        """
+        Groups several changes into one transaction:
 
+            with manager.batch():
+                manager.save_to_memory(...)
+                manager.replace_section(...)
+
+        Nothing is written while the block runs, everything is written as one single write when it ends
+        (following the write_back policy). If the block raises, the in-memory state is rolled back and nothing
+        is written. Other threads can't change the memory while a batch is open, batches can be nested.
+        """
+        with self._lock:
+            if self._batch_depth == 0:
+                memory_before = None
+                if self._memory is not None:
+                    # The sections are kept like views are, copied only once a change would alter them in place
+                    memory_before = dict(self._memory)
+                    if "meta" in memory_before:
+                        memory_before["meta"] = {section: dict(entries)
+                                                 for section, entries in memory_before["meta"].items()}
+                shared = {section for section, value in (memory_before or {}).items()
+                          if section != "meta" and isinstance(value, (dict, list))}
+                self._viewed.update(shared)
+                pending_before = list(self._pending)
+                dirty_before = set(self._dirty)
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._memory = memory_before
+                    # The restored sections may be shown by views taken before or during the batch
+                    self._viewed.update(shared)
+                    self._pending = pending_before
+                    self._dirty = dirty_before
+                    if self._memory is not None:
+                        self._rebuild_indexes()
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._pending:
+                self._after_record()
+
+
+
+    def get_last_short_term(self, n):
+        """
+        Returns the latest n short-term entries as a list of (key, entry) tuples, oldest first.
+        """
+        with self._lock:
+            short_term_memory = self._memory.get("short_term", {})
+            return [(key, short_term_memory[key]) for key in self._short_term_index.last(n)]
+
+    def get_short_term_since(self, seq):
+        """
+        Returns the short-term entries saved after the given sequence number (the number at the end of a
+        short-term key) as a list of (key, entry) tuples, oldest first.
+        """
+        with self._lock:
+            short_term_memory = self._memory.get("short_term", {})
+            return [(key, short_term_memory[key]) for key in self._short_term_index.since(seq)]
+
+    def get_short_term_by_tag(self, tag, n=None):
+        """
+        Returns the short-term entries saved with the given tag ('user', 'assistant', ...), the latest n if given,
+        as a list of (key, entry) tuples, oldest first.
+        """
+        with self._lock:
+            short_term_memory = self._memory.get("short_term", {})
+            return [(key, short_term_memory[key]) for key in self._short_term_index.by_tag(tag.lower(), n)]
+
+    def get_short_term_between(self, start=None, end=None):
+        """
+        Returns the short-term entries saved between the start and end timestamps (both included, None is open ended)
+        as a list of (key, entry) tuples, oldest first.
+        """
+        with self._lock:
+            short_term_memory = self._memory.get("short_term", {})
+            return [(key, short_term_memory[key]) for key in self._short_term_index.between(start, end)]
+
+    def get_long_term_since(self, timestamp):
+        """
+        Returns the long-term entries saved at or after the timestamp, oldest first.
+        """
+        with self._lock:
+            long_term_memory = self._memory.get("long_term", [])
+            return long_term_memory[self._long_term_index.since(timestamp):]
+
+    def get_counts(self):
+        """
+        Returns the number of entries per section, and of short-term entries per tag.
+        """
+        with self._lock:
+            counts = {section: len(self._memory.get(section, [])) for section in ("short_term", "long_term")}
+            counts["base_memory"] = 1 if self._memory.get("base_memory") else 0
+            if self.retriever is not None:
+                counts["long_term_archive"] = len(self._retrieval_archive)
+            counts["short_term_tags"] = {tag: len(keys) for tag, keys in self._short_term_index.tags.items()}
+        return counts
+
+    def get_memory_view(self):
+        """
+        Returns a read-only view of the memory structure, shaped like get_memory_structure() but without copying
+        anything, so it costs the same however much is stored. The view shows the memory as it was when it was
+        taken, later changes don't show up in it.
+
+        The view also holds the number of tokens of every entry under 'token_counts' (counted when the entries were
+        saved), so the context builder doesn't have to count them again.
+        """
+        if self._memory is None:
+            return None
+        with self._lock:
+            self._viewed.update(("short_term", "long_term"))
+            return MappingProxyType({
+                "short_term": MappingProxyType(self._memory.setdefault("short_term", {})),
+                "long_term": list_view(self._memory.setdefault("long_term", [])),
+                "base_memory": self._memory.get("base_memory", ""),
+                "token_counts": MappingProxyType({
+                    "short_term": MappingProxyType(self._short_term_index.tokens),
+                    "long_term": list_view(self._long_term_index.tokens),
+                    "base_memory": self._base_memory_tokens()
+                })
+            })
+
+    def search_long_term(self, query, k=5):
+        """
+        Returns up to k long-term entries (archived ones included) most relevant to the query, best first.
+        Only available with retrieval=True.
+        """
+        if self.retriever is None:
+            print("Error: Retrieval is not enabled, create the memory_manager with retrieval=True.")
+            return []
+        with self._lock:
+            return [entry for entry, _ in self.retriever.search(query, k)]
+
+    def get_archived(self, start=None, end=None, section=None):
+        """
+        Returns the purged entries saved between the start and end timestamps (None is open ended), optionally only
+        those of one section ('short_term' or 'long_term'), oldest first. Only available with an archive.
+        """
+        if self.archive is None:
+            print("Error: No archive, create the memory_manager with archive='<directory>'.")
+            return []
+        return self.archive.fetch(start, end, section)
+
+    def _archive_entries(self, section, entries):
+        """
+        Internal function moving purged entries to the cold archive, before they are dropped from the memory.
+        entries are (key, value, time) tuples.
+        """
+        if self.archive is None or not entries:
+            return
+        self.archive.append([{"section": section, "key": key, "time": entry_time, "value": value}
+                             for key, value, entry_time in entries])
+        self.metrics.count("archived_entries_total", len(entries), section=section)
 
     def get_memory_structure(self, formatted=False):
         """
@@ -161,6 +979,15 @@ class memory_manager:
                          or a formatted string if formatted=True.
         """
         memory_data = self._load_memory()
+        if memory_data is None:
+            return None
+        with self._lock:
+            # Copy the sections so callers can't change our in-memory state by accident
+            memory_data = {
+                "short_term": dict(memory_data.get("short_term", {})),
+                "long_term": list(memory_data.get("long_term", [])),
+                "base_memory": memory_data.get("base_memory", "")
+            }
         if formatted:
             return json.dumps(memory_data, indent=4) # Return formatted JSON string
         else:
@@ -172,103 +999,414 @@ class memory_manager:
     def check(self):
         """
         Checks memory lengths, summarizes if thresholds are reached, and purges old memories.
+
+        With compaction="background" this only starts the work on a worker thread and returns right away,
+        the current memories stay usable and the summaries are spliced in once they are ready.
+        Use drain() to wait for a running compaction.
         """
-        memory_data = self._load_memory()
-        if memory_data is None:
+        if self._memory is None:
             return
 
-        # --- Short-Term Memory Check ---
-        short_term_memory = memory_data.get("short_term", {})
-        if len(short_term_memory) >= self.SHORT_TERM_THRESHOLD:
-            print("\n--- Short-Term Memory Check Triggered ---")
-            structured_short_term = ""
+        self.scheduler.observe_check(self, self._usage())
+        if self.speculative:
+            self._speculate()
+
+        if self.compaction == "background":
+            with self._lock:
+                if self._compaction_job is not None and not self._compaction_job.done():
+                    return  # A compaction is already running, it will see the new entries next time
+                if not self._needs_compaction():
+                    return
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-compaction")
+                    self._owns_executor = True
+                print("\n--- Background Memory Compaction Started ---")
+                self._compaction_job = self._executor.submit(self._run_background_check)
+            return
 
-            # Sort keys by timestamp (newest last)
-            # Keys are in format "tag_timestamp" so splitting and getting the timestamp part
-            sorted_short_term_keys = sorted(short_term_memory.keys(),
-                                        key=lambda k: int(k.split('_')[1]))
+        # Like in the background, the memory is only locked while splicing each tier's results in (one write per
+        # tier), so saves from other threads are not blocked while the AI summarizes
+        self._run_check()
 
-            for key in sorted_short_term_keys:
-                tag = key.split('_')[0].capitalize() # Extract tag from key
-                structured_short_term += f"[{tag}]: {short_term_memory[key]}\n"
+    def drain(self, timeout=None):
+        """
+        Waits for a running background compaction to finish. Returns False if it is still running after the timeout.
+        """
+        job = self._compaction_job
+        if job is None:
+            return True
+        try:
+            job.result(timeout=timeout)
+        except FuturesTimeoutError:
+            return False
+        return True
 
-            if structured_short_term: # Only call AI if there's something to summarize
-                print("DEBUG: Creating short-term summary")
-                # Assuming ai_bot_instance is defined and has summarize_memories method
-                summary_short_term = self.bot_instance.summarize_memories(structured_short_term, "short_term")
-                print(f"DEBUG: Summary created: {summary_short_term[:50]}...")  # Print first 50 chars
+    # --- Speculative compaction ---
 
-                # Use save_to_memory instead of directly modifying the data structure
-                self.save_to_memory(summary_short_term, "long_term")
-                print("DEBUG: Summary saved to long-term memory")
+    def _speculative_segment(self, short_term_memory):
+        """
+        Internal function returning the short-term keys the next purge will drop and no check summarized yet.
+        """
+        plan = self.scheduler.plan_short_term(self, self._usage(short_term_memory=short_term_memory))
+        keys = list(short_term_memory)[:plan["segment"]]
+        if self.summarization != "full":
+            summarized_seq = self._memory.get("compaction_state", {}).get("short_term_seq", 0)
+            keys = [key for key in keys if short_term_index.parse_key(key)[1] > summarized_seq]
+        return keys
+
+    def _speculate(self):
+        """
+        Internal function starting a speculative summary of the oldest short-term segment, once short-term memory
+        reached speculative_ratio of the point where the scheduler compacts it and the segment is followed by newer
+        entries (so it won't change by itself anymore). The segment is summarized once, until it is used or turns
+        out to be stale.
+        """
+        with self._lock:
+            short_term_memory = self._memory.get("short_term", {})
+            plan = self.scheduler.plan_short_term(self, self._usage(short_term_memory=short_term_memory))
+            if plan["compact"] or plan["pressure"] < self.speculative_ratio:
+                return
+            keys = self._speculative_segment(short_term_memory)
+            if not keys or len(keys) >= len(short_term_memory):
+                return
+            lines = self._short_term_lines(short_term_memory, keys)
+            if self._speculation is not None:
+                if self._speculation["lines"] == lines:
+                    return  # Already summarized or being summarized
+                self._discard_speculation()
+
+            if self._speculation_executor is None:
+                self._speculation_executor = ThreadPoolExecutor(max_workers=1,
+                                                                thread_name_prefix="memory-speculation")
+            job = self._speculation_executor.submit(contextvars.copy_context().run,
+                                                    self._summarize_short_term, list(lines))
+            self._speculation = {"keys": tuple(keys), "lines": lines, "job": job}
+        self.metrics.count("speculative_compactions_total", result="started")
+        print(f"\n--- Speculative Compaction Started ({len(keys)} entries) ---")
+
+    def _discard_speculation(self):
+        with self._lock:
+            speculation, self._speculation = self._speculation, None
+        if speculation is not None:
+            speculation["job"].cancel()
+
+    def _claim_speculation(self, short_term_memory):
+        """
+        Internal function taking the speculative summary for the check, if its segment is unchanged.
+        Returns (summary, summarized keys), or None if there is no usable speculative summary.
+        """
+        with self._lock:
+            speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return None
 
-                # Reload memory data after saving the summary
-                memory_data = self._load_memory()
+        keys = speculation["keys"]
+        if (any(key not in short_term_memory for key in keys)
+                or self._short_term_lines(short_term_memory, keys) != speculation["lines"]):
+            speculation["job"].cancel()
+            self.metrics.count("speculative_compactions_total", result="stale")
+            return None
 
-                # Purge oldest short-term memories, keep latest SHORT_TERM_KEEP_COUNT
-                # Take the keys from the end of the sorted list (newest ones)
-                keys_to_keep = sorted_short_term_keys[-self.SHORT_TERM_KEEP_COUNT:]
-                new_short_term = {key: short_term_memory[key] for key in keys_to_keep}
+        try:
+            summary = speculation["job"].result()  # Normally long done, otherwise it is already on its way
+        except Exception as e:
+            print(f"Error during speculative compaction: {e}")
+            summary = None
+        if not summary:
+            self.metrics.count("speculative_compactions_total", result="failed")
+            return None
 
-                # Use a temporary dictionary to update short_term
-                temp_memory = memory_data.copy()
-                temp_memory["short_term"] = new_short_term
-                self._save_memory(temp_memory)
+        self.metrics.count("speculative_compactions_total", result="hit")
+        return summary, list(keys)
 
-                print(f"Short-term memory purged, keeping latest {self.SHORT_TERM_KEEP_COUNT} entries.")
+    def _needs_compaction(self):
+        usage = self._usage()
+        return (self.scheduler.plan_short_term(self, usage)["compact"]
+                or self.scheduler.plan_long_term(self, usage)["compact"])
 
-        # --- Long-Term Memory Check ---
-        # Reload memory to ensure we're working with the latest data including any short-term summaries
-        memory_data = self._load_memory()
-        long_term_memory = memory_data.get("long_term", [])
-
-        if len(long_term_memory) >= self.LONG_TERM_THRESHOLD:
-            print("\n--- Long-Term Memory Check Triggered ---")
-            structured_long_term = ""
-
-            for i, entry in enumerate(long_term_memory):
-                if isinstance(entry, dict) and "memory" in entry:
-                    entry_text = entry["memory"]
-                else:
-                    entry_text = str(entry)
-                structured_long_term += f"[Entry {i+1}]: {entry_text}\n"
-
-            base_memory_content = memory_data.get("base_memory", "")
-            structured_for_ai = f"Base Memory:\n{base_memory_content}\n\nLong-Term Memories:\n{structured_long_term}"
-
-            if structured_for_ai: # Only call AI if there's something to summarize
-                print("DEBUG: Creating long-term summary")
-                summary_long_term_base = self.bot_instance.summarize_memories(structured_for_ai, "long_term")
-                print(f"DEBUG: Base memory summary created: {summary_long_term_base[:50]}...")
-
-                # Use save_to_memory for base memory too
-                self.save_to_memory(summary_long_term_base, "base_memory")
-                print("DEBUG: Summary saved to base memory")
-
-                # Reload memory to get the latest state
-                memory_data = self._load_memory()
-                long_term_memory = memory_data.get("long_term", [])
-
-                # Keep only the latest entries
-                if len(long_term_memory) > self.LONG_TERM_KEEP_COUNT:
-                    entries_to_keep = long_term_memory[-self.LONG_TERM_KEEP_COUNT:]
-
-                    # Clear the long-term memory first
-                    temp_memory = memory_data.copy()
-                    temp_memory["long_term"] = []
-                    self._save_memory(temp_memory)
-
-                    # Re-add each entry using save_to_memory
-                    for entry in entries_to_keep:
-                        if isinstance(entry, dict) and "memory" in entry:
-                            self.save_to_memory(entry["memory"], "long_term")
-                        else:
-                            self.save_to_memory(str(entry), "long_term")
+    def _usage(self, short_term_memory=None, long_term_memory=None):
+        """
+        Internal function returning the size of every tier for the scheduler: the tokens of each entry, oldest first,
+        or only the number of entries for a scheduler that doesn't need tokens (needs_tokens, e.g. 'count').
+        Entries are counted once when they are saved, so this only looks the counts up.
+        """
+        with self._lock:
+            if short_term_memory is None:
+                short_term_memory = self._memory.get("short_term", {})
+            if long_term_memory is None:
+                long_term_memory = self._memory.get("long_term", [])
+            if not getattr(self.scheduler, "needs_tokens", True):
+                return {"short_term": len(short_term_memory), "long_term": len(long_term_memory)}
+            counted = self._short_term_index.tokens
+            # The section or a copy of it the check took earlier, entries can only have been appended since
+            long_term_tokens = self._long_term_index.tokens[:len(long_term_memory)]
+            return {
+                "short_term": [counted[key] if key in counted else count_tokens(value)
+                               for key, value in short_term_memory.items()],
+                "long_term": long_term_tokens,
+                "base_memory": self._base_memory_tokens(),
+            }
+
+    def _base_memory_tokens(self):
+        """
+        Internal function returning the tokens of the base memory, only counted again when it changed.
+        """
+        base_memory = self._memory.get("base_memory", "") or ""
+        if self._base_memory_counted[0] is not base_memory:
+            self._base_memory_counted = (base_memory, count_tokens(base_memory))
+        return self._base_memory_counted[1]
 
-                    print(f"Long-term memory purged, keeping latest {self.LONG_TERM_KEEP_COUNT} entries.")
+    def get_compaction_plan(self):
+        """
+        Returns what the scheduler would do if check() ran now, for each tier, and what it observed so far
+        (summarization latency and tokens, and for the 'tokens' scheduler its budget and growth estimates).
+        """
+        if self._memory is None:
+            return None
+        usage = self._usage()
+        with self._lock:
+            tokens = {"short_term": self._short_term_index.total_tokens,
+                      "long_term": self._long_term_index.total_tokens,
+                      "base_memory": self._base_memory_tokens()}
+        return {"short_term": self.scheduler.plan_short_term(self, usage),
+                "long_term": self.scheduler.plan_long_term(self, usage),
+                "tokens": tokens,
+                "scheduler": self.scheduler.state()}
+
+    def _run_background_check(self):
+        try:
+            self._run_check()
+        except Exception as e:
+            print(f"Error during background memory compaction: {e}")
 
+    def _run_check(self):
+        """
+        Internal function doing the actual check. The memory is only locked while reading what to summarize
+        and while splicing the results in, never during the calls to the AI.
+        """
+        with self.metrics.span("check", compaction=self.compaction), \
+                self.metrics.timer("memory_check_seconds", compaction=self.compaction):
+            self._check_short_term()
+            self._check_long_term()
         print("\n--- Memory Check Completed ---")
 
+    def _summarize(self, text, memory_type):
+        """
+        Internal function asking the AI bot for a summary, timed as summarization latency.
+        """
+        started = time.perf_counter()
+        with self.metrics.span("summarize", memory_type=memory_type, input_chars=len(text)), \
+                self.metrics.timer("summarization_seconds", memory_type=memory_type):
+            summary = self.bot_instance.summarize_memories(text, memory_type)
+        if summary:
+            # The scheduler learns how long summaries take and, if it goes by tokens, how much shorter they are
+            seconds = time.perf_counter() - started
+            if getattr(self.scheduler, "needs_tokens", True):
+                self.scheduler.observe_summary(memory_type, seconds, count_tokens(text), count_tokens(summary))
+            else:
+                self.scheduler.observe_summary(memory_type, seconds, None, None)
+        return summary
+
+    def _chunk(self, lines):
+        """
+        Internal function splitting lines into chunks of at most summary_chunk_tokens tokens (a longer line is its own chunk).
+        """
+        chunks = [[]]
+        size = 0
+        for line in lines:
+            tokens = count_tokens(line)
+            if chunks[-1] and size + tokens > self.summary_chunk_tokens:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += tokens
+        return chunks
+
+    def _reduce_lines(self, lines):
+        """
+        Internal function used by the map_reduce mode: as long as the lines are longer than summary_chunk_tokens, they are
+        split into chunks which are summarized in parallel, continuing with the chunk summaries.
+        Returns the lines to send to the final summary, or None if a chunk summary failed.
+        """
+        if self.summarization != "map_reduce":
+            return lines
+        total = sum(count_tokens(line) for line in lines)
+        while total > self.summary_chunk_tokens:
+            chunks = self._chunk(lines)
+            if len(chunks) == 1:
+                break  # A single entry over the limit can't be split any further
+
+            self.metrics.count("summary_chunks_total", len(chunks))
+            with ThreadPoolExecutor(max_workers=self.summary_workers, thread_name_prefix="memory-summary") as pool:
+                # Each chunk runs in a copy of our context, so its spans are nested in the current one
+                jobs = [pool.submit(contextvars.copy_context().run, self._summarize, "".join(chunk), "short_term")
+                        for chunk in chunks]
+                summaries = [job.result() for job in jobs]
+            if not all(summaries):
+                return None
+
+            reduced = [f"[Part {i+1}]: {summary}\n" for i, summary in enumerate(summaries)]
+            reduced_total = sum(count_tokens(line) for line in reduced)
+            lines = reduced
+            if reduced_total >= total:
+                break  # The summaries don't get any shorter, send them as they are
+            total = reduced_total
+        return lines
+
+    def _set_compaction_state(self, **changes):
+        """
+        Internal function recording what the checks already summarized (in the 'compaction_state' section).
+        """
+        with self._lock:
+            state = dict(self._memory.get("compaction_state", {}), **changes)
+            self._record([{"op": "set", "section": "compaction_state", "value": state}])
+
+    @staticmethod
+    def _short_term_lines(short_term_memory, keys):
+        return [f"[{short_term_index.parse_key(key)[0].capitalize()}]: {short_term_memory[key]}\n"  # Extract tag from key
+                for key in keys]
+
+    def _summarize_short_term(self, lines):
+        lines = self._reduce_lines(lines)
+        # Assuming ai_bot_instance is defined and has summarize_memories method
+        return self._summarize("".join(lines), "short_term") if lines else None
+
+    def _check_short_term(self):
+        # --- Short-Term Memory Check ---
+        with self._lock:
+            short_term_memory = dict(self._memory.get("short_term", {}))
+            state = dict(self._memory.get("compaction_state", {}))
+        plan = self.scheduler.plan_short_term(self, self._usage(short_term_memory=short_term_memory))
+        if not plan["compact"]:
+            return
+        keep = max(1, plan["keep"])
+
+        print(f"\n--- Short-Term Memory Check Triggered ({plan['reason']}) ---")
+
+        # Keys are in format "tag_sequence" and already stored in saving order (newest last)
+        sorted_short_term_keys = list(short_term_memory)
+
+        claimed = self._claim_speculation(short_term_memory) if self.speculative else None
+        if claimed is not None:
+            # The summary covers exactly the oldest segment, so only that segment is purged
+            summary_short_term, keys_to_summarize = claimed
+            keys_to_purge = set(keys_to_summarize)
+        else:
+            keys_to_summarize = sorted_short_term_keys
+            if self.summarization != "full":
+                # Entries kept by an earlier purge are already part of its summary
+                summarized_seq = state.get("short_term_seq", 0)
+                keys_to_summarize = [key for key in sorted_short_term_keys
+                                     if short_term_index.parse_key(key)[1] > summarized_seq]
+
+            lines = self._short_term_lines(short_term_memory, keys_to_summarize)
+
+            if not lines: # Only call AI if there's something to summarize
+                return
+
+            print("DEBUG: Creating short-term summary")
+            summary_short_term = self._summarize_short_term(lines)
+            if not summary_short_term:
+                print("Error: No short-term summary was created, keeping the short-term memories.")
+                return
+
+            # Purge oldest short-term memories, keep the latest ones the scheduler asked for
+            # Take the keys from the end of the sorted list (newest ones), entries saved while we were
+            # summarizing weren't part of the summary so they are kept as well
+            keys_to_purge = set(sorted_short_term_keys[:-keep])
+        print(f"DEBUG: Summary created: {summary_short_term[:50]}...")  # Print first 50 chars
+
+        # The purged entries are archived first, a crash can archive them twice but never lose them
+        if self.archive is not None:
+            with self._lock:
+                meta = self._memory.get("meta", {}).get("short_term", {})
+                purged = [(key, short_term_memory[key], meta.get(key, {}).get("time"))
+                          for key in sorted_short_term_keys if key in keys_to_purge]
+            self._archive_entries("short_term", purged)
+
+        # Saving the summary and purging is written as one single change
+        with self.batch():
+            # Use save_to_memory instead of directly modifying the data structure
+            self.save_to_memory(summary_short_term, "long_term")
+            print("DEBUG: Summary saved to long-term memory")
+
+            new_short_term = {key: value for key, value in self._memory.get("short_term", {}).items()
+                              if key not in keys_to_purge}
+
+            # Replace the section as a whole instead of changing it in place
+            self.replace_section("short_term", new_short_term)
+
+            if self.summarization != "full":
+                self._set_compaction_state(short_term_seq=short_term_index.parse_key(keys_to_summarize[-1])[1])
+
+        self.metrics.count("compactions_total", memory_type="short_term")
+        self.scheduler.observe_compaction("short_term")
+        print(f"Short-term memory purged, keeping latest {len(short_term_memory) - len(keys_to_purge)} entries.")
+
+    def _check_long_term(self):
+        # --- Long-Term Memory Check ---
+        # Read the memory again to ensure we're working with the latest data including any short-term summaries
+        with self._lock:
+            long_term_memory = list(self._memory.get("long_term", []))
+            base_memory_content = self._memory.get("base_memory", "")
+            state = dict(self._memory.get("compaction_state", {}))
+        plan = self.scheduler.plan_long_term(self, self._usage(short_term_memory={}, long_term_memory=long_term_memory))
+        if not plan["compact"]:
+            return
+        keep = max(1, plan["keep"])
+
+        print(f"\n--- Long-Term Memory Check Triggered ({plan['reason']}) ---")
+
+        # The first `long_term_folded` entries were kept by an earlier purge and are already part of the base memory
+        folded = state.get("long_term_folded", 0) if self.summarization != "full" else 0
+        if folded >= len(long_term_memory):
+            folded = 0  # The section was replaced from outside, fold everything again
+
+        lines = []
+        for i, entry in enumerate(long_term_memory[folded:]):
+            if isinstance(entry, dict) and "memory" in entry:
+                entry_text = entry["memory"]
+            else:
+                entry_text = str(entry)
+            lines.append(f"[Entry {i+1}]: {entry_text}\n")
+
+        print("DEBUG: Creating long-term summary")
+        lines = self._reduce_lines(lines)
+        heading = "Long-Term Memories" if self.summarization == "full" else "New Long-Term Memories"
+        structured_for_ai = f"Base Memory:\n{base_memory_content}\n\n{heading}:\n{''.join(lines or [])}"
+        summary_long_term_base = self._summarize(structured_for_ai, "long_term") if lines else None
+        if not summary_long_term_base:
+            print("Error: No long-term summary was created, keeping the long-term memories.")
+            return
+        print(f"DEBUG: Base memory summary created: {summary_long_term_base[:50]}...")
+
+        # Entries dropped by the purge are archived first, a crash can archive them twice but never lose them
+        if len(long_term_memory) > keep:
+            self._archive_long_term(long_term_memory[:-keep])
+
+        # The new base memory and the purge are written as one single change
+        with self.batch():
+            # Use save_to_memory for base memory too
+            self.save_to_memory(summary_long_term_base, "base_memory")
+            print("DEBUG: Summary saved to base memory")
+
+            # Keep only the latest entries
+            if len(long_term_memory) > keep:
+                entries_to_keep = long_term_memory[-keep:]
+
+                # Entries saved while we were summarizing (only appends can happen in the meantime) are kept too,
+                # all entries are kept exactly as they were stored, with their original timestamps
+                added_meanwhile = self._memory.get("long_term", [])[len(long_term_memory):]
+                self.replace_section("long_term", entries_to_keep + added_meanwhile)
+
+                print(f"Long-term memory purged, keeping latest {keep} entries.")
+
+            if self.summarization != "full":
+                # Everything that was summarized stays folded, entries added meanwhile still have to be
+                self._set_compaction_state(long_term_folded=min(len(long_term_memory), keep))
+        self.metrics.count("compactions_total", memory_type="long_term")
+        self.scheduler.observe_compaction("long_term")
+
 # Example Usage (with check function):
 if __name__ == "__main__":
     # Example 1: Using default filepath "memory_database.json"
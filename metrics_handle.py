@@ -0,0 +1,269 @@
+# metrics_handle.py
+# Metrics handle shows where the time of a turn goes: storage, summaries or the model.
+
+# The memory manager, the AI bots and the Zork runner report into a metrics_registry:
+#   - counters, e.g. how many compactions ran or how many tokens were used,
+#   - timers, e.g. how long a storage write or a model request took, kept as Prometheus style histograms,
+#   - spans (optional, off by default), a trace of nested timed steps like a turn > check() > summarization.
+
+# Everything goes to the shared `metrics` registry unless a class is given its own (e.g. `manager.metrics = ...`).
+# The registry can be dumped as Prometheus text or JSON, and listeners (any function taking one event dictionary)
+# receive every measurement as it happens, to forward it to a logger or a monitoring system.
+
+
+import contextvars
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+
+# Upper bounds (in seconds) of the timer histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# The span open in the current thread or asyncio task, new spans are nested in it
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+_label_keys = {}  # Labels as passed -> their key, the same few label sets come up again and again
+
+
+def _label_key(labels):
+    passed = tuple(labels.items())
+    try:
+        return _label_keys[passed]
+    except KeyError:
+        pass
+    except TypeError:  # A label value that can't be hashed
+        return tuple(sorted((name, str(value)) for name, value in passed))
+    key = tuple(sorted((name, str(value)) for name, value in passed))
+    if len(_label_keys) < 10000:
+        _label_keys[passed] = key
+    return key
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+_NO_SPAN = nullcontext()  # What span() returns while tracing is off, it costs nothing
+
+
+class _timing:
+    """
+    The context manager returned by metrics_registry.timer(), a class since it runs on every save and check.
+    """
+
+    __slots__ = ("registry", "name", "labels", "started")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class metrics_registry:
+    """
+    Collects counters, timers and (optionally) spans, and hands every measurement to the registered listeners.
+
+    Usage:
+        metrics.count("compactions_total", memory_type="short_term")
+        with metrics.timer("memory_save_seconds", backend="json"):
+            ...
+        with metrics.span("turn", number=12):
+            ...
+        print(metrics.to_prometheus())
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, tracing=False, max_spans=1000):
+        self.buckets = tuple(buckets)
+        self.tracing = tracing  # Spans are only recorded while tracing is on, timers and counters always are
+        self.spans = deque(maxlen=max_spans)  # The latest finished spans, oldest first
+
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {label_key: value}
+        self._timers = {}  # name -> {label_key: [count, sum, max, bucket counts...]}
+        self._listeners = []
+        self._next_span_id = 1
+
+    # --- Listeners ---
+
+    def add_listener(self, listener):
+        """
+        Registers a function called with an event dictionary for every counter increment, timing and finished span:
+        {"type": "counter" | "timer" | "span", "name": ..., "value": ..., "labels": {...}}.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _emit(self, event):
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Error in metrics listener {listener!r}: {e}")
+
+    # --- Counters and timers ---
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds value to a counter.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        if self._listeners:
+            self._emit({"type": "counter", "name": name, "value": value, "labels": labels})
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records one duration in a timer.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._timers.setdefault(name, {})
+            stats = series.get(key)
+            if stats is None:
+                stats = series[key] = [0, 0.0, 0.0] + [0] * len(self.buckets)
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            index = bisect_left(self.buckets, seconds)  # The first bucket with seconds <= its bound
+            if index < len(self.buckets):
+                stats[3 + index] += 1
+        if self._listeners:
+            self._emit({"type": "timer", "name": name, "value": seconds, "labels": labels})
+
+    def timer(self, name, **labels):
+        """
+        Times the with block into a timer, also when it raises.
+        """
+        return _timing(self, name, labels)
+
+    def counter_value(self, name, **labels):
+        """
+        Returns the current value of a counter, 0 if it was never incremented.
+        """
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def timer_stats(self, name, **labels):
+        """
+        Returns {"count", "sum", "max"} of a timer, None if it never recorded anything.
+        """
+        with self._lock:
+            stats = self._timers.get(name, {}).get(_label_key(labels))
+            if stats is None:
+                return None
+            return {"count": stats[0], "sum": stats[1], "max": stats[2]}
+
+    def reset(self):
+        """
+        Forgets every counter, timer and span.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self.spans.clear()
+
+    # --- Tracing ---
+
+    def span(self, name, **attributes):
+        """
+        Traces the with block as a span, nested in the span that is open in this thread or asyncio task (if any).
+        Yields the span dictionary so attributes can be added while it runs, or None when tracing is off.
+        """
+        if not self.tracing:
+            return _NO_SPAN
+        return self._span(name, attributes)
+
+    @contextmanager
+    def _span(self, name, attributes):
+        with self._lock:
+            span_id = self._next_span_id
+            self._next_span_id += 1
+        parent = _current_span.get()
+        span = {"id": span_id, "parent": parent["id"] if parent else None, "name": name,
+                "start": time.time(), "duration": None, "attributes": dict(attributes), "error": None}
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = repr(e)
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - started
+            _current_span.reset(token)
+            self.spans.append(span)
+            if self._listeners:
+                self._emit({"type": "span", "name": name, "value": span["duration"], "labels": span["attributes"],
+                            "span": span})
+
+    # --- Export ---
+
+    def to_dict(self):
+        """
+        Returns every counter and timer as plain dictionaries, labels are written as 'name=value,name=value'.
+        """
+        def label_string(key):
+            return ",".join(f"{name}={value}" for name, value in key)
+
+        with self._lock:
+            counters = {name: {label_string(key): value for key, value in series.items()}
+                        for name, series in self._counters.items()}
+            timers = {}
+            for name, series in self._timers.items():
+                timers[name] = {}
+                for key, stats in series.items():
+                    timers[name][label_string(key)] = {
+                        "count": stats[0], "sum": stats[1], "max": stats[2],
+                        "mean": stats[1] / stats[0] if stats[0] else 0.0,
+                        "buckets": dict(zip((str(bound) for bound in self.buckets), stats[3:])),
+                    }
+        return {"counters": counters, "timers": timers}
+
+    def to_json(self, indent=4):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self):
+        """
+        Returns the counters and timers in the Prometheus text exposition format (timers as histograms).
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._timers.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, stats in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets, stats[3:]):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {stats[0]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {stats[1]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {stats[0]}")
+        return "\n".join(lines) + "\n"
+
+
+# The registry everything reports to by default
+metrics = metrics_registry()
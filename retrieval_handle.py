@@ -0,0 +1,109 @@
+# retrieval_handle.py
+# Retrieval handle lets the memory system pick only the memories that matter for the current turn instead of sending all of them.
+
+# It contains a small BM25 index (the ranking used by classic search engines) that runs fully locally, without any network
+# calls or external services. Documents can be added and removed one by one, so the index is kept up to date as memories
+# are saved and purged instead of being rebuilt.
+
+
+import math
+import re
+from collections import Counter
+from heapq import nlargest
+
+from helper_tools import strip_timestamps
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+# The labels memory_handle writes around every short-term entry, like the times they are in every entry
+_ENTRY_LABELS = re.compile(r"Time of the exchange:|\bExchange:")
+
+# Very common words carry no meaning for ranking, leaving them out keeps the index small
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from had has have he her his i if in into is it its me my of on or our she so
+than that the their them then there they this to was we were what when where which who will with you your
+""".split())
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase terms, leaving out stop words and the times and labels memory_handle writes into the
+    entries. Those match between any two entries of the same day and would outweigh the words that matter.
+    """
+    text = _ENTRY_LABELS.sub(" ", strip_timestamps(text))
+    return [term for term in _TOKEN_PATTERN.findall(text.lower()) if term not in STOP_WORDS]
+
+
+class bm25_index:
+    """
+    An incrementally updated inverted index ranking documents with BM25.
+
+    Each term points to the documents containing it and how often, so a search only looks at the documents
+    sharing a term with the query. Adding or removing a document only touches that document's terms.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1  # How quickly repeating a term stops adding to the score
+        self.b = b  # How much longer documents are penalized
+
+        self._postings = {}  # term -> {doc_id: term frequency}
+        self._doc_terms = {}  # doc_id -> Counter of its terms
+        self._doc_lengths = {}  # doc_id -> number of terms
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_terms
+
+    def add(self, doc_id, text):
+        """
+        Adds a document to the index, replacing it if the doc_id is already indexed.
+        """
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+
+        terms = Counter(tokenize(text))
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = sum(terms.values())
+        self._total_length += self._doc_lengths[doc_id]
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_id):
+        """
+        Removes a document from the index, unknown ids are ignored.
+        """
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query, k=5):
+        """
+        Returns up to k (doc_id, score) tuples for the documents best matching the query, best first.
+        Documents that share no term with the query are never returned.
+        """
+        doc_count = len(self._doc_terms)
+        if not doc_count:
+            return []
+        average_length = self._total_length / doc_count or 1
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return nlargest(k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,264 @@
+# schedule_handle.py
+# Schedule handle decides when a memory check compacts a tier (short-term or long-term memory) and how many entries it keeps.
+
+# Every check() the memory_manager hands its scheduler the size of each tier: in tokens (one number per entry, oldest
+# first) if the scheduler needs_tokens, otherwise only the number of entries. After every summary it also reports how
+# long the summary took and how many tokens went in and came out. The scheduler answers with a plan per tier:
+#   {"compact": True, "keep": 4, "segment": 12, "pressure": 1.08, "reason": "1620 + 80 tokens >= 1600 budget"}
+#   - compact:  whether to summarize the tier now
+#   - keep:     how many of the newest entries stay after the purge
+#   - segment:  how many of the oldest entries the next compaction will drop for sure (what speculative compaction
+#               may summarize ahead of time)
+#   - pressure: how full the tier is, a compaction is due at 1.0
+#   - reason:   why, for humans
+#
+# Schedulers:
+#   'count'  - the fixed entry counts of the memory_manager (SHORT_TERM_THRESHOLD, SHORT_TERM_KEEP_COUNT, ...),
+#              the original behaviour
+#   'tokens' - a per-turn prompt budget split over the tiers. A tier is compacted early enough that the entries still
+#              arriving while the summary is made (observed growth times observed summarization latency) fit into its
+#              share, and only if the summary is expected to be shorter than what it replaces. How much is kept
+#              adapts to how often compactions happen: when they come too close together (every summary costs a model
+#              call), more is compacted at once.
+#
+# The plans and everything a scheduler observed are returned by memory_manager.get_compaction_plan(). A scheduler can
+# be changed per memory_manager (memory.scheduler = token_scheduler(prompt_budget=2000)) or replaced by any object with
+# the same methods.
+
+
+import threading
+import time
+
+
+class compaction_scheduler:
+    """
+    Common part of the schedulers: keeps the observed summarization latency and token counts per tier.
+    """
+
+    name = "base"
+    needs_tokens = True  # Whether the plans need the tokens of every entry, or only the number of entries
+
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing  # Weight of the newest observation in the moving averages
+        self.summaries = {}  # memory type -> observed summaries
+        self.last_plans = {}  # memory type -> the latest plan
+        self.turns = 0
+        self._lock = threading.Lock()
+
+    def _average(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def observe_check(self, memory, usage):
+        """
+        Called once per check() with the size of every tier (see needs_tokens).
+        """
+        with self._lock:
+            self.turns += 1
+
+    def observe_summary(self, memory_type, seconds, input_tokens, output_tokens):
+        """
+        Called after every summary the AI made (also the chunk summaries of map_reduce). The tokens are None for a
+        scheduler that doesn't need them, then only the latency is kept.
+        """
+        with self._lock:
+            stats = self.summaries.setdefault(memory_type, {
+                "count": 0, "input_tokens": 0, "output_tokens": 0,
+                "seconds": None, "seconds_per_token": None, "compression": None, "output": None})
+            stats["count"] += 1
+            stats["seconds"] = self._average(stats["seconds"], seconds)
+            if input_tokens is None:
+                return
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["seconds_per_token"] = self._average(stats["seconds_per_token"], seconds / max(1, input_tokens))
+            stats["compression"] = self._average(stats["compression"], output_tokens / max(1, input_tokens))
+            stats["output"] = self._average(stats["output"], output_tokens)
+
+    def observe_compaction(self, memory_type):
+        """
+        Called after a tier was compacted.
+        """
+
+    def predicted_seconds(self, memory_type, input_tokens):
+        """
+        Returns how long a summary of input_tokens tokens is expected to take, 0.0 before the first one.
+        """
+        with self._lock:
+            stats = self.summaries.get(memory_type)
+            if stats is None or stats["seconds_per_token"] is None:
+                return 0.0
+            return stats["seconds_per_token"] * input_tokens
+
+    def _remember(self, memory_type, plan):
+        with self._lock:
+            self.last_plans[memory_type] = plan
+        return plan
+
+    def state(self):
+        """
+        Returns what the scheduler observed and decided last, for inspection.
+        """
+        with self._lock:
+            return {"scheduler": self.name, "turns": self.turns,
+                    "summaries": {memory_type: dict(stats) for memory_type, stats in self.summaries.items()},
+                    "last_plans": {memory_type: dict(plan) for memory_type, plan in self.last_plans.items()}}
+
+
+class count_scheduler(compaction_scheduler):
+    """
+    Compacts a tier once it has a fixed number of entries, the thresholds and keep counts of the memory_manager
+    (SHORT_TERM_THRESHOLD, SHORT_TERM_KEEP_COUNT, LONG_TERM_THRESHOLD, LONG_TERM_KEEP_COUNT) are read at every check.
+    """
+
+    name = "count"
+    needs_tokens = False
+
+    def plan_short_term(self, memory, usage):
+        entries = usage["short_term"]
+        threshold, keep = memory.SHORT_TERM_THRESHOLD, memory.SHORT_TERM_KEEP_COUNT
+        return self._remember("short_term", {
+            "compact": entries >= threshold, "keep": keep, "segment": max(0, threshold - keep),
+            "pressure": entries / threshold, "reason": f"{entries}/{threshold} entries"})
+
+    def plan_long_term(self, memory, usage):
+        entries = usage["long_term"]
+        threshold, keep = memory.LONG_TERM_THRESHOLD, memory.LONG_TERM_KEEP_COUNT
+        return self._remember("long_term", {
+            "compact": entries >= threshold, "keep": keep, "segment": max(0, threshold - keep),
+            "pressure": entries / threshold, "reason": f"{entries}/{threshold} entries"})
+
+
+class token_scheduler(compaction_scheduler):
+    """
+    Compacts by token size against a per-turn prompt budget, see the top of this file.
+
+    Usage:
+        memory = memory_manager(scheduler="tokens", scheduler_options={"prompt_budget": 3000})
+        memory.scheduler.keep_share = 0.5     # Or change it later, per instance
+    """
+
+    name = "tokens"
+
+    def __init__(self, prompt_budget=4000, short_term_share=0.5, long_term_share=0.3, keep_share=0.3,
+                 min_keep=2, min_turns_between=3, smoothing=0.3):
+        super().__init__(smoothing)
+        self.prompt_budget = prompt_budget  # Tokens the memories may use in every prompt
+        self.short_term_share = short_term_share  # Share of the budget for each tier, base memory gets the rest
+        self.long_term_share = long_term_share
+        self.keep_share = keep_share  # Share of a tier's budget kept after a compaction, tuned between bounds
+        self.max_keep_share = keep_share
+        self.min_keep_share = keep_share / 4
+        self.min_keep = min_keep  # Newest entries always kept
+        self.min_turns_between = min_turns_between  # Compactions closer together than this compact more at once
+
+        self.growth = None  # Short-term tokens added per second
+        self.turns_since_compaction = 0
+        self._last_size = None  # (time, short-term tokens) at the previous check
+
+    def observe_check(self, memory, usage):
+        now = time.monotonic()
+        size = sum(usage["short_term"])
+        with self._lock:
+            self.turns += 1
+            self.turns_since_compaction += 1
+            if self._last_size is not None:
+                elapsed, added = now - self._last_size[0], size - self._last_size[1]
+                if elapsed > 0 and added >= 0:  # A purge in between says nothing about the growth
+                    self.growth = self._average(self.growth, added / elapsed)
+            self._last_size = (now, size)
+
+    def observe_compaction(self, memory_type):
+        if memory_type != "short_term":
+            return
+        with self._lock:
+            if self.turns_since_compaction < self.min_turns_between:
+                self.keep_share = max(self.min_keep_share, self.keep_share * 0.75)
+            elif self.turns_since_compaction > 4 * self.min_turns_between:
+                self.keep_share = min(self.max_keep_share, self.keep_share / 0.75)
+            self.turns_since_compaction = 0
+
+    def _keep(self, tokens, keep_budget):
+        """
+        Returns how many of the newest entries fit into keep_budget tokens (at least min_keep, at most all).
+        """
+        keep, kept_tokens = 0, 0
+        for size in reversed(tokens):
+            if kept_tokens + size > keep_budget:
+                break
+            keep += 1
+            kept_tokens += size
+        return min(len(tokens), max(self.min_keep, keep))
+
+    def _plan(self, tokens, budget, lead, compression=None):
+        total = sum(tokens)
+        keep = self._keep(tokens, budget * self.keep_share)
+        summarized = sum(tokens[:len(tokens) - keep])
+
+        # The oldest entries the next compaction drops for sure: everything that won't fit next to what it keeps.
+        # Only known once an entry no longer fits, before that every new entry could still join the segment
+        segment, dropped = 0, 0
+        for size in tokens[:max(0, len(tokens) - self.min_keep)]:
+            if dropped + size > budget * (1 - self.keep_share):
+                break
+            segment += 1
+            dropped += size
+        else:
+            segment = 0
+
+        pressure = (total + lead) / budget if budget else 0.0
+        plan = {"compact": False, "keep": keep, "segment": segment, "pressure": round(pressure, 3),
+                "tokens": total, "budget": round(budget), "lead": round(lead)}
+        if pressure < 1:
+            plan["reason"] = f"{total} + {round(lead)} tokens < {round(budget)} budget"
+        elif summarized == 0:
+            plan["reason"] = f"over budget, but all {total} tokens are in the newest {keep} entries"
+        elif compression is not None and compression >= 1 and pressure < 2:
+            # Not worth a model call yet, but the tier can't grow without bounds either
+            plan["reason"] = f"over budget, but summaries are not shorter than their input ({compression:.2f})"
+        else:
+            plan["compact"] = True
+            plan["reason"] = f"{total} + {round(lead)} tokens >= {round(budget)} budget"
+        return plan
+
+    def plan_short_term(self, memory, usage):
+        tokens = usage["short_term"]
+        budget = self.prompt_budget * self.short_term_share
+        # Entries arriving while the summary is made still have to fit, so the compaction starts that much earlier
+        with self._lock:
+            growth = self.growth or 0.0
+            compression = self.summaries.get("short_term", {}).get("compression")
+        lead = growth * self.predicted_seconds("short_term", sum(tokens))
+        return self._remember("short_term", self._plan(tokens, budget, lead, compression))
+
+    def plan_long_term(self, memory, usage):
+        tokens = usage["long_term"]
+        budget = self.prompt_budget * self.long_term_share
+        # Long-term memory grows by one short-term summary at a time, the next one has to fit as well
+        with self._lock:
+            lead = self.summaries.get("short_term", {}).get("output") or 0.0
+        # (the base memory is rewritten every time, so there is no comparing the summary's length to its input)
+        return self._remember("long_term", self._plan(tokens, budget, lead))
+
+    def state(self):
+        state = super().state()
+        with self._lock:
+            state.update({"prompt_budget": self.prompt_budget, "keep_share": round(self.keep_share, 3),
+                          "growth_tokens_per_second": self.growth,
+                          "turns_since_compaction": self.turns_since_compaction})
+        return state
+
+
+SCHEDULERS = {"count": count_scheduler, "tokens": token_scheduler}
+
+
+def make_scheduler(scheduler="count", **options):
+    """
+    Creates a compaction scheduler by name, an already built scheduler object is returned unchanged.
+    """
+    if not isinstance(scheduler, str):
+        return scheduler
+    try:
+        scheduler_class = SCHEDULERS[scheduler.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown compaction scheduler '{scheduler}'. Available: {', '.join(SCHEDULERS)}") from None
+    return scheduler_class(**options)
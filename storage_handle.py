@@ -0,0 +1,817 @@
+# storage_handle.py
+# Storage handle is the persistence layer behind memory_handle. The memory manager never touches files directly, instead it
+# describes every change as a small 'operation' and hands it to a storage backend which decides how to persist it.
+
+# Operations are plain dictionaries so they can be written straight into a journal:
+#   {"op": "put",     "section": "short_term", "key": "user_42", "value": "...", "meta": {"time": 1712345678.25}}
+#   {"op": "append",  "section": "long_term", "value": "..."}
+#   {"op": "set",     "section": "base_memory", "value": "..."}
+#   {"op": "replace", "section": "short_term", "value": {...}, "meta": {...}}
+
+# The optional 'meta' of a 'put' is per-entry metadata (like the exact time it was saved), it is kept in the 'meta'
+# section of the memory structure: {"meta": {"short_term": {"user_42": {"time": 1712345678.25}}}}.
+
+# Available backends:
+#   'json'    - the original single pretty-printed JSON file, rewritten from memory on every change.
+#   'journal' - an append-only log of operations next to a JSON snapshot, a save only costs the size of the entry.
+#   'sqlite'  - indexed tables in an SQLite database (WAL mode), several sessions can share one database file.
+
+# Several processes can use the same database: files are only ever replaced by an atomic rename of a fully written
+# temporary file, and the 'json' and 'journal' backends take an advisory lock ('<filepath>.lock') around every change
+# ('sqlite' relies on SQLite's own locking). A backend that can't read or write its files raises storage_error.
+# Every backend has a sync() that makes everything written so far durable, so callers can pay for one fsync per group
+# of changes instead of one per change, and a bytes_written counter of the data it wrote since it was created.
+# next_seq() hands out the sequence numbers of short-term keys, counted in the database ('<filepath>.seq' next to the
+# 'json' and 'journal' files) so two processes writing the same database never create the same key.
+
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, msvcrt offers byte range locks instead
+    fcntl = None
+    import msvcrt
+
+
+class storage_error(Exception):
+    """
+    Raised when a database file can't be read, instead of carrying on with (and later overwriting) an empty memory.
+    """
+
+
+@contextmanager
+def file_lock(filepath, shared=False):
+    """
+    Holds an advisory lock on '<filepath>.lock' for the duration of the with block, shared (for reading) or exclusive.
+    The lock only keeps out processes and threads that take it too, which all storage backends do.
+    """
+    with open(f"{filepath}.lock", 'a+b') as f:
+        with _locked(f, shared):
+            yield
+
+
+@contextmanager
+def _locked(f, shared=False):
+    """
+    Holds an advisory lock on an open file for the duration of the with block.
+    """
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # No shared locks on Windows, readers lock exclusively
+    try:
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def empty_memory():
+    """
+    Returns a fresh, empty memory structure.
+    """
+    return {
+        "short_term": {},
+        "long_term": [],
+        "base_memory": ""
+    }
+
+
+def copy_memory(memory_data):
+    """
+    Returns a copy of a memory structure, the sections are copied but the (immutable) entries are shared.
+    """
+    copied = {section: dict(value) if isinstance(value, dict) else list(value) if isinstance(value, list) else value
+              for section, value in memory_data.items()}
+    if "meta" in copied:
+        copied["meta"] = {section: dict(entries) for section, entries in copied["meta"].items()}
+    return copied
+
+
+def apply_op(memory_data, op):
+    """
+    Applies a single operation to an in-memory memory structure (mutating it).
+    """
+    kind = op["op"]
+    section = op["section"]
+
+    if kind == "put":
+        memory_data.setdefault(section, {})[op["key"]] = op["value"]
+        if "meta" in op:
+            memory_data.setdefault("meta", {}).setdefault(section, {})[op["key"]] = op["meta"]
+    elif kind == "append":
+        memory_data.setdefault(section, []).append(op["value"])
+    elif kind in ("set", "replace"):
+        value = op["value"]
+        # Copy containers so the structure never shares a list or dict with the operation (or another structure)
+        if isinstance(value, dict):
+            value = dict(value)
+        elif isinstance(value, list):
+            value = list(value)
+        memory_data[section] = value
+
+        meta = memory_data.get("meta", {})
+        if "meta" in op:
+            memory_data.setdefault("meta", {})[section] = dict(op["meta"])
+        elif section in meta:
+            # Drop the metadata of entries that are not in the section anymore
+            meta[section] = {key: entry_meta for key, entry_meta in meta[section].items()
+                             if isinstance(value, dict) and key in value}
+    else:
+        raise ValueError(f"Unknown storage operation '{kind}'.")
+
+
+def replace_ops(memory_data, sections=None):
+    """
+    Returns the operations replacing the given sections (all by default) with their value in memory_data,
+    including the metadata of their entries.
+    """
+    meta = memory_data.get("meta", {})
+    ops = []
+    for section, value in memory_data.items():
+        if section == "meta" or (sections is not None and section not in sections):
+            continue
+        op = {"op": "replace", "section": section, "value": value}
+        if section in meta:
+            op["meta"] = meta[section]
+        ops.append(op)
+    return ops
+
+
+def _fsync_directory(path):
+    """
+    Makes a rename in the directory of path durable, only needed (and possible) on POSIX systems.
+    """
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_json_atomic(filepath, memory_data, fsync=True):
+    """
+    Writes memory data to a temporary file and swaps it in place, so readers never see a half written file
+    and a crash of the process leaves either the old or the new file behind. Every writer gets its own temporary file.
+    With fsync the file and the rename are made durable too, so this also holds after a power loss.
+    Returns the number of bytes written.
+    """
+    data = json.dumps(memory_data, indent=4).encode("utf-8")
+    directory, name = os.path.split(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync:
+        _fsync_directory(filepath)
+    return len(data)
+
+
+class _seq_counter:
+    """
+    Sequence numbers counted in '<filepath>.seq', shared by every process using the database. The file is kept open
+    and locked by itself, so handing out a number costs a lock, a read and a write instead of opening two files.
+    """
+
+    def __init__(self, filepath):
+        self.path = f"{filepath}.seq"
+        self._file = None
+        self._lock = threading.Lock()
+
+    def next(self, at_least):
+        with self._lock:
+            if self._file is None:
+                self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b', buffering=0)
+            with _locked(self._file):
+                self._file.seek(0)
+                try:
+                    last = int(self._file.read() or 0)
+                except ValueError:
+                    last = 0  # A counter cut short by a crash, at_least comes from the keys in the database
+                seq = max(last + 1, at_least)
+                # The number only grows, so it never has fewer digits than the one it overwrites
+                self._file.seek(0)
+                self._file.write(b"%d" % seq)
+        return seq
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _read_json(filepath):
+    """
+    Reads a JSON database file, raising storage_error if it is damaged.
+    """
+    with open(filepath, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            raise storage_error(f"Could not decode JSON from {filepath}, the file is corrupted: {e}") from e
+
+
+class json_storage:
+    """
+    The original storage format: the whole memory structure lives in one JSON file which is
+    fully rewritten on every change.
+
+    The file is parsed once, afterwards the state is kept in memory and a change only serializes it. Changes happen
+    under an exclusive file lock, and if another process replaced the file since our last write it is read again
+    first, so changes from several processes are merged instead of overwriting each other. Every rewrite is atomic,
+    with fsync=True it is also fsynced, otherwise only sync() makes it durable.
+    """
+
+    name = "json"
+
+    def __init__(self, filepath="memory_database.json", fsync=False):
+        self.filepath = filepath
+        self.fsync = fsync  # fsync every rewrite, slower but survives power loss and not only process crashes
+        self.bytes_written = 0
+        self._memory = None
+        self._stamp = None  # Identity of the file this process loaded or wrote
+        self._seq_counter = _seq_counter(filepath)
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _catch_up(self):
+        """
+        Internal function (re)reading the file if it was never read or another process replaced it since.
+        The caller holds the file lock.
+        """
+        stamp = self._file_stamp()
+        if self._memory is not None and stamp == self._stamp:
+            return
+        try:
+            self._memory = _read_json(self.filepath)
+        except FileNotFoundError:
+            self._memory = empty_memory()
+        self._stamp = stamp
+
+    def _write(self):
+        """
+        Internal function writing the in-memory state to the file, the caller holds the file lock.
+        """
+        self.bytes_written += _write_json_atomic(self.filepath, self._memory, self.fsync)
+        self._stamp = self._file_stamp()
+
+    def create(self):
+        """
+        Creates the database file if it does not exist yet. Returns True if a file was created.
+        """
+        with file_lock(self.filepath):
+            if os.path.exists(self.filepath):
+                return False
+            _write_json_atomic(self.filepath, empty_memory())
+        return True
+
+    def load(self):
+        """
+        Loads the memory data from the JSON file, returns None if it doesn't exist.
+        Raises storage_error if the file is corrupted.
+        """
+        with file_lock(self.filepath, shared=True):
+            if not os.path.exists(self.filepath):
+                print(f"Error: Database file not found at {self.filepath}. Please check the path.")
+                return None
+            self._catch_up()
+            return copy_memory(self._memory)
+
+    def save(self, memory_data):
+        """
+        Atomically rewrites the whole JSON file with the given memory data.
+        """
+        with file_lock(self.filepath):
+            self._memory = copy_memory(memory_data)
+            self._write()
+
+    def apply(self, ops):
+        """
+        Applies a list of operations to the in-memory state and rewrites the file from it, the file is only parsed
+        again if another process changed it in the meantime (so its changes are kept).
+        """
+        with file_lock(self.filepath):
+            self._catch_up()
+            for op in ops:
+                apply_op(self._memory, op)
+            self._write()
+
+    def next_seq(self, at_least=1):
+        """
+        Returns the next short-term sequence number (at least at_least), unique among all processes using the file.
+        """
+        return self._seq_counter.next(at_least)
+
+    def sync(self):
+        """
+        Makes the last rewrite durable (the file and its rename), already done by every write with fsync=True.
+        """
+        if self.fsync:
+            return
+        with file_lock(self.filepath, shared=True):
+            if os.path.exists(self.filepath):
+                _fsync_file(self.filepath)
+                _fsync_directory(self.filepath)
+
+    def close(self):
+        self._memory = None
+        self._seq_counter.close()
+
+
+class journal_storage:
+    """
+    Append-only storage: every change is appended as one record to a journal file ('<filepath>.log')
+    and the full structure is only written when the journal is compacted into the snapshot ('<filepath>').
+
+    The snapshot uses the same format as json_storage, so an existing database can be switched over.
+    Every journal record carries a sequence number and a checksum, on startup the snapshot is loaded and
+    the journal replayed on top of it. A torn last record (a crash in the middle of a write) is detected
+    by its checksum and cut off the end of the journal.
+
+    Appends and compactions happen under an exclusive file lock. If another process wrote to the journal or the snapshot
+    since our last change, the state is reloaded from disk first, so records of both processes end up in the snapshot.
+    """
+
+    name = "journal"
+
+    def __init__(self, filepath="memory_database.json", compact_every=500, fsync=False):
+        self.filepath = filepath
+        self.journal_path = f"{filepath}.log"
+        self.compact_every = compact_every  # Number of journal records before they are folded into the snapshot
+        self.fsync = fsync  # fsync after every append, slower but survives power loss and not only process crashes
+
+        self._memory = None
+        self._seq = 0  # Sequence number of the last record applied
+        self._records = 0  # Number of records currently sitting in the journal
+        self._journal = None
+        self._offset = 0  # Size of the journal as far as this process knows it
+        self._snapshot_stamp = None  # Identity of the snapshot file this process loaded or wrote
+        self._seq_counter = _seq_counter(filepath)
+        self.bytes_written = 0
+
+    def create(self):
+        """
+        Creates the snapshot file if it does not exist yet. Returns True if a file was created.
+        """
+        with file_lock(self.filepath):
+            if os.path.exists(self.filepath):
+                return False
+            _write_json_atomic(self.filepath, empty_memory())
+        return True
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _open(self):
+        """
+        Loads the snapshot, replays the journal and opens the journal for appending. The caller holds the file lock.
+        Raises storage_error if the snapshot is corrupted.
+        """
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        self._snapshot_stamp = self._stamp()
+        try:
+            memory_data = _read_json(self.filepath)
+        except FileNotFoundError:
+            memory_data = empty_memory()
+
+        # The sequence number of the last record folded into the snapshot, records up to it are skipped on replay
+        # (the journal might not have been truncated if we crashed right after writing the snapshot).
+        self._seq = memory_data.pop("journal_seq", 0)
+        self._records = 0
+        good_offset = 0
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+
+            offset = 0
+            while offset < len(data):
+                end = data.find(b"\n", offset)
+                if end == -1:
+                    break  # Torn record, the newline was never written
+                record = self._decode(data[offset:end])
+                if record is None:
+                    break
+                if record["seq"] > self._seq:
+                    apply_op(memory_data, record["op"])
+                    self._seq = record["seq"]
+                self._records += 1
+                offset = end + 1
+                good_offset = offset
+
+            if good_offset < len(data):
+                print(f"Warning: Dropping {len(data) - good_offset} bytes of incomplete journal data from {self.journal_path}.")
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(good_offset)
+
+        self._memory = memory_data
+        self._journal = open(self.journal_path, 'ab')
+        self._offset = good_offset
+
+    @staticmethod
+    def _encode(seq, op):
+        payload = json.dumps({"seq": seq, "op": op}, separators=(",", ":")).encode("utf-8")
+        return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+    @staticmethod
+    def _decode(line):
+        """
+        Decodes one journal line, returns None if the record is damaged.
+        """
+        checksum, _, payload = line.partition(b" ")
+        try:
+            if int(checksum, 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload)
+        except ValueError:
+            return None
+
+    def _catch_up(self):
+        """
+        Internal function (re)loading the state if it was never loaded or another process changed the files since.
+        The caller holds the file lock.
+        """
+        if (self._memory is None or self._stamp() != self._snapshot_stamp
+                or os.fstat(self._journal.fileno()).st_size != self._offset):
+            self._open()
+
+    def load(self):
+        """
+        Returns the current memory data. The journal is only read once, afterwards the replayed state is kept in memory.
+        """
+        if self._memory is None:
+            with file_lock(self.filepath):
+                self._open()
+        return copy_memory(self._memory)
+
+    def apply(self, ops):
+        """
+        Appends the operations to the journal, compacting it into the snapshot when it grows too long.
+        """
+        with file_lock(self.filepath):
+            self._catch_up()
+
+            chunks = []
+            for op in ops:
+                self._seq += 1
+                chunks.append(self._encode(self._seq, op))
+                apply_op(self._memory, op)
+
+            data = b"".join(chunks)
+            self._journal.write(data)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._offset += len(data)
+            self.bytes_written += len(data)
+
+            self._records += len(chunks)
+            if self._records >= self.compact_every:
+                self._compact()
+
+    def save(self, memory_data):
+        """
+        Replaces the whole memory structure, which is done by writing a new snapshot.
+        """
+        with file_lock(self.filepath):
+            self._catch_up()
+            self._memory = copy_memory(memory_data)
+            self._compact()
+
+    def next_seq(self, at_least=1):
+        """
+        Returns the next short-term sequence number (at least at_least), unique among all processes using the files.
+        """
+        return self._seq_counter.next(at_least)
+
+    def sync(self):
+        """
+        Makes every appended record durable.
+        """
+        if self._journal is not None:
+            os.fsync(self._journal.fileno())
+
+    def compact(self):
+        """
+        Folds the journal into the snapshot and truncates it.
+        """
+        with file_lock(self.filepath):
+            self._catch_up()
+            self._compact()
+
+    def _compact(self):
+        """
+        Internal function folding the journal into the snapshot, the caller holds the file lock.
+        """
+        snapshot = dict(self._memory)
+        snapshot["journal_seq"] = self._seq
+        self.bytes_written += _write_json_atomic(self.filepath, snapshot)
+        self._snapshot_stamp = self._stamp()
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        self._offset = 0
+        self._records = 0
+
+    def close(self):
+        self._seq_counter.close()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            self._memory = None
+
+
+class sqlite_storage:
+    """
+    Stores the memory sections in indexed SQLite tables, using WAL mode so readers never block the writer.
+
+    Short-term entries are rows ordered by their insertion id and indexed by timestamp and tag, long-term entries
+    are rows indexed by timestamp, every row belongs to a session so many conversations can share one database.
+    A batch of operations is written in a single transaction, inserting an entry costs the same no matter how
+    many entries are stored. Any other top-level section is kept as a JSON value in the 'extra' table.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS short_term (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session TEXT NOT NULL,
+            key TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            ts REAL NOT NULL,
+            value TEXT NOT NULL,
+            meta TEXT,
+            UNIQUE (session, key)
+        );
+        CREATE INDEX IF NOT EXISTS short_term_session_ts ON short_term (session, ts);
+        CREATE INDEX IF NOT EXISTS short_term_session_tag ON short_term (session, tag, id);
+
+        CREATE TABLE IF NOT EXISTS long_term (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session TEXT NOT NULL,
+            ts REAL NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS long_term_session_ts ON long_term (session, ts);
+
+        CREATE TABLE IF NOT EXISTS base_memory (
+            session TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS extra (
+            session TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (session, name)
+        );
+
+        CREATE TABLE IF NOT EXISTS seq (
+            session TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, filepath="memory_database.db", session="default"):
+        self.filepath = filepath
+        self.session = session
+        self.bytes_written = 0  # Size of the values written, SQLite's own page and WAL overhead is not included
+        self._conn = None
+        self._lock = threading.Lock()  # One connection is shared between threads (e.g. an interval flush)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(short_term)")]
+            if "meta" not in columns:
+                # Databases created before entries had metadata
+                self._conn.execute("ALTER TABLE short_term ADD COLUMN meta TEXT")
+        return self._conn
+
+    def create(self):
+        """
+        Creates the database and its tables if needed. Returns True if the database file was created.
+        """
+        created = not os.path.exists(self.filepath)
+        with self._lock:
+            self._connect()
+        return created
+
+    def load(self):
+        """
+        Reads all sections of this session, entries come back in insertion order.
+        """
+        with self._lock:
+            conn = self._connect()
+            memory_data = {
+                "short_term": {},
+                "long_term": [row[0] for row in conn.execute(
+                    "SELECT value FROM long_term WHERE session = ? ORDER BY id", (self.session,))],
+                "base_memory": "",
+                "meta": {"short_term": {}}
+            }
+            for key, value, ts, meta in conn.execute(
+                    "SELECT key, value, ts, meta FROM short_term WHERE session = ? ORDER BY id", (self.session,)):
+                memory_data["short_term"][key] = value
+                entry_meta = json.loads(meta) if meta else {}
+                entry_meta["time"] = ts
+                memory_data["meta"]["short_term"][key] = entry_meta
+            row = conn.execute("SELECT value FROM base_memory WHERE session = ?", (self.session,)).fetchone()
+            if row:
+                memory_data["base_memory"] = row[0]
+            for name, value in conn.execute("SELECT name, value FROM extra WHERE session = ?", (self.session,)):
+                memory_data[name] = json.loads(value)
+        return memory_data
+
+    @staticmethod
+    def _tag_of(key):
+        # Short-term keys look like 'tag_sequence', the tag itself may contain underscores
+        return key.rsplit('_', 1)[0]
+
+    def _count(self, *values):
+        self.bytes_written += sum(len(value.encode("utf-8")) for value in values if value)
+
+    def _insert_short_term(self, conn, key, value, meta=None):
+        meta = dict(meta or {})
+        ts = meta.pop("time", None) or time.time()
+        meta = json.dumps(meta) if meta else None
+        conn.execute(
+            "INSERT INTO short_term (session, key, tag, ts, value, meta) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session, key) DO UPDATE SET value = excluded.value, meta = excluded.meta",
+            (self.session, key, self._tag_of(key), ts, value, meta))
+        self._count(key, value, meta)
+
+    def _apply_op(self, conn, op):
+        kind = op["op"]
+        section = op["section"]
+
+        if section == "short_term" and kind == "put":
+            self._insert_short_term(conn, op["key"], op["value"], op.get("meta"))
+        elif section == "short_term" and kind == "replace":
+            if "meta" in op:
+                meta = op["meta"]
+            else:
+                # Keep the timestamps and metadata of the entries that stay
+                meta = {key: dict(json.loads(entry_meta or "{}"), time=ts) for key, ts, entry_meta in conn.execute(
+                    "SELECT key, ts, meta FROM short_term WHERE session = ?", (self.session,))}
+            conn.execute("DELETE FROM short_term WHERE session = ?", (self.session,))
+            for key, value in op["value"].items():
+                self._insert_short_term(conn, key, value, meta.get(key))
+        elif section == "long_term" and kind == "append":
+            conn.execute("INSERT INTO long_term (session, ts, value) VALUES (?, ?, ?)",
+                         (self.session, time.time(), op["value"]))
+            self._count(op["value"])
+        elif section == "long_term" and kind == "replace":
+            # Keep the timestamps of the entries that stay (oldest copy first), only new entries get the current time
+            kept = {}
+            for value, ts in conn.execute(
+                    "SELECT value, ts FROM long_term WHERE session = ? ORDER BY id", (self.session,)):
+                kept.setdefault(value, []).append(ts)
+            conn.execute("DELETE FROM long_term WHERE session = ?", (self.session,))
+            now = time.time()
+            conn.executemany("INSERT INTO long_term (session, ts, value) VALUES (?, ?, ?)",
+                             [(self.session, kept[value].pop(0) if kept.get(value) else now, value)
+                              for value in op["value"]])
+            self._count(*op["value"])
+        elif section == "base_memory" and kind in ("set", "replace"):
+            conn.execute("INSERT INTO base_memory (session, value) VALUES (?, ?) "
+                         "ON CONFLICT (session) DO UPDATE SET value = excluded.value",
+                         (self.session, op["value"]))
+            self._count(op["value"])
+        else:
+            # Sections without their own table are stored as a JSON value
+            row = conn.execute("SELECT value FROM extra WHERE session = ? AND name = ?",
+                               (self.session, section)).fetchone()
+            memory_data = {section: json.loads(row[0])} if row else {}
+            apply_op(memory_data, op)
+            value = json.dumps(memory_data[section])
+            conn.execute("INSERT INTO extra (session, name, value) VALUES (?, ?, ?) "
+                         "ON CONFLICT (session, name) DO UPDATE SET value = excluded.value",
+                         (self.session, section, value))
+            self._count(value)
+
+    def apply(self, ops):
+        """
+        Applies a list of operations in one transaction.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    for op in ops:
+                        self._apply_op(conn, op)
+            except sqlite3.Error as e:
+                # The transaction was rolled back, raising keeps the changes queued instead of losing them
+                raise storage_error(f"Error writing to database {self.filepath}: {e}") from e
+
+    def save(self, memory_data):
+        """
+        Replaces every section of this session in one transaction.
+        """
+        self.apply(replace_ops(memory_data))
+
+    def next_seq(self, at_least=1):
+        """
+        Returns the next short-term sequence number of this session (at least at_least), unique among all processes
+        using the database.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    return conn.execute(
+                        "INSERT INTO seq (session, value) VALUES (?, ?) "
+                        "ON CONFLICT (session) DO UPDATE SET value = max(value + 1, excluded.value) RETURNING value",
+                        (self.session, at_least)).fetchone()[0]
+            except sqlite3.Error as e:
+                raise storage_error(f"Error writing to database {self.filepath}: {e}") from e
+
+    def sync(self):
+        """
+        Makes every committed transaction durable. With synchronous=NORMAL commits only reach the WAL file,
+        which is fsynced here once instead of on every commit.
+        """
+        with self._lock:
+            wal_path = f"{self.filepath}-wal"
+            if self._conn is None or not os.path.exists(wal_path):
+                return
+            fd = os.open(wal_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+STORAGE_BACKENDS = {
+    "json": json_storage,
+    "journal": journal_storage,
+    "sqlite": sqlite_storage,
+}
+
+
+def make_storage(backend="json", filepath=None, **options):
+    """
+    Creates a storage backend by name, an already built storage object is returned unchanged.
+    Without a filepath the backend's default file ('memory_database.json' or 'memory_database.db') is used.
+    """
+    if not isinstance(backend, str):
+        return backend
+    try:
+        storage_class = STORAGE_BACKENDS[backend.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{backend}'. Available: {', '.join(STORAGE_BACKENDS)}") from None
+    if filepath is None:
+        return storage_class(**options)
+    return storage_class(filepath, **options)
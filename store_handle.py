@@ -0,0 +1,222 @@
+# store_handle.py
+# Store handle lets a single process host the memories of many agents (sessions) at once, for example one per user of a
+# chat service or one per game being played.
+
+# Every session gets its own memory_manager, but the costly parts are shared:
+#   - storage is sharded: sessions are spread over a fixed number of shard files by a hash of their id, so the number of
+#     files does not grow with the number of sessions ('sqlite' shards are one database file holding many sessions,
+#     'json' and 'journal' shards are directories holding one file per session),
+#   - only recently used sessions are kept in memory, the least recently used idle ones are flushed and closed once more
+#     than max_active are open, so memory and open files scale with the active sessions instead of all of them,
+#   - summarization runs on one shared worker pool and with one shared AI bot.
+
+# Each session has its own lock, work on one session never waits for work on another one.
+
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from memory_handle import memory_manager
+
+
+_UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class memory_store:
+    """
+    Hosts the memories of many sessions, opening their memory managers on demand and evicting idle ones.
+
+    Usage:
+        store = memory_store("memory_store", shards=16)
+        with store.session("user_42") as memory:
+            memory.save_to_memory("Hello!", "short_term", "user")
+            memory.check()
+        store.close()
+    """
+
+    def __init__(self, root="memory_store", shards=16, backend="sqlite", max_active=128, ai_bot_instance=None,
+                 summarizer_workers=4, **manager_options):
+        """
+        Initializes the store in the root directory.
+
+        shards is the number of shard files the sessions are spread over, it must stay the same for an existing store.
+        max_active is the number of sessions kept open in memory, summarizer_workers the size of the shared pool running
+        their compactions. Any other manager_options (write_back, retrieval, ...) are passed on to every memory_manager.
+        Without an ai_bot_instance one pooled_ai_bot is created for all sessions when the first one is opened.
+        """
+        if backend not in ("json", "journal", "sqlite"):
+            raise ValueError(f"Invalid backend '{backend}'. Must be one of ('json', 'journal', 'sqlite').")
+        if shards < 1 or max_active < 1:
+            raise ValueError("shards and max_active must be at least 1.")
+
+        self.root = root
+        self.shards = shards
+        self.backend = backend
+        self.max_active = max_active
+        self.ai_bot_instance = ai_bot_instance
+        self.manager_options = dict(manager_options)
+        self.manager_options.setdefault("compaction", "background")
+
+        self._executor = ThreadPoolExecutor(max_workers=summarizer_workers, thread_name_prefix="summarizer")
+        self._lock = threading.Lock()  # Only guards the dictionaries below, never held while a session is used
+        self._session_locks = {}  # session_id -> RLock
+        self._active = OrderedDict()  # session_id -> memory_manager, least recently used first
+        self._closed = False
+
+        os.makedirs(root, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._active)
+
+    def __contains__(self, session_id):
+        return session_id in self._active
+
+    def shard_of(self, session_id):
+        """
+        Returns the shard number a session is stored in, stable across processes and restarts.
+        """
+        digest = hashlib.sha1(session_id.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.shards
+
+    def _storage_for(self, session_id):
+        """
+        Internal function returning the (filepath, storage_options) of a session's storage.
+        """
+        shard = self.shard_of(session_id)
+        if self.backend == "sqlite":
+            return os.path.join(self.root, f"shard_{shard:03d}.db"), {"session": session_id}
+
+        # Session ids may contain anything, the digest keeps differently escaped ids from sharing a file
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:8]
+        filename = f"{_UNSAFE_CHARACTERS.sub('_', session_id)[:64]}_{digest}.json"
+        directory = os.path.join(self.root, f"shard_{shard:03d}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename), {}
+
+    def _bot(self):
+        """
+        Internal function returning the AI bot shared by all sessions, it is created when first needed.
+        """
+        with self._lock:
+            if self.ai_bot_instance is None:
+                from ai_handle import pooled_ai_bot
+                self.ai_bot_instance = pooled_ai_bot()
+            return self.ai_bot_instance
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The memory store is closed.")
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = self._session_locks[session_id] = threading.RLock()
+            return lock
+
+    @contextmanager
+    def session(self, session_id):
+        """
+        Opens a session (loading it from its shard if it is not in memory) and yields its memory_manager.
+
+        The session is locked for the duration of the with block, so a session is only used by one thread at a time,
+        while different sessions can be used in parallel.
+        """
+        while True:
+            lock = self._session_lock(session_id)
+            with lock:
+                # The session may have been evicted (and its lock dropped) while this thread was waiting
+                with self._lock:
+                    if self._session_locks.get(session_id) is not lock:
+                        continue
+                    manager = self._active.get(session_id)
+                    if manager is not None:
+                        self._active.move_to_end(session_id)
+
+                if manager is None:
+                    manager = self._open(session_id)
+
+                try:
+                    yield manager
+                finally:
+                    with self._lock:
+                        if session_id in self._active:
+                            self._active.move_to_end(session_id)
+            self._evict_idle()
+            return
+
+    def _open(self, session_id):
+        """
+        Internal function loading a session's memory_manager, the caller holds the session's lock.
+        """
+        filepath, storage_options = self._storage_for(session_id)
+        manager = memory_manager(ai_bot_instance=self._bot(), filepath=filepath, backend=self.backend,
+                                 storage_options=storage_options, executor=self._executor, **self.manager_options)
+        with self._lock:
+            self._active[session_id] = manager
+        return manager
+
+    def _evict_idle(self):
+        """
+        Internal function closing least recently used sessions until at most max_active are open.
+        Sessions that are in use are skipped, they will be evicted on a later call once they are idle.
+        """
+        with self._lock:
+            candidates = list(self._active)[:max(0, len(self._active) - self.max_active)]
+
+        for session_id in candidates:
+            self.evict(session_id, wait=False)
+
+    def evict(self, session_id, wait=True):
+        """
+        Flushes and closes a session's memory_manager, dropping it from memory. The session stays in its shard and is
+        loaded again the next time it is opened. Returns False if the session was not open, or is in use and wait=False.
+        """
+        with self._lock:
+            lock = self._session_locks.get(session_id)
+        if lock is None or not lock.acquire(blocking=wait):
+            return False
+
+        try:
+            with self._lock:
+                manager = self._active.pop(session_id, None)
+            if manager is not None:
+                manager.close()
+            # Dropped only once the manager is closed, so the session can't be reopened while it is still being written
+            with self._lock:
+                del self._session_locks[session_id]
+            return manager is not None
+        finally:
+            lock.release()
+
+    def flush(self):
+        """
+        Writes every open session to its storage.
+        """
+        with self._lock:
+            sessions = [(self._session_locks[session_id], manager) for session_id, manager in self._active.items()]
+        for lock, manager in sessions:
+            with lock:
+                manager.flush()
+
+    def close(self):
+        """
+        Closes every open session and the shared summarizer pool.
+        """
+        with self._lock:
+            sessions = list(self._active)
+        for session_id in sessions:
+            self.evict(session_id)
+
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,50 @@
+import os
+
+from archive_handle import INDEX_RECORD, cold_archive
+
+
+DAY = 1_700_000_000.0
+
+
+def archive_hours(archive, hours):
+    for hour in hours:
+        time = DAY + hour * 3600
+        archive.append([{"section": "short_term", "key": f"user_{hour}", "time": time, "value": f"hour {hour}"},
+                        {"section": "long_term", "time": time + 1, "value": f"summary {hour}"}])
+
+
+def test_a_full_segment_is_sealed_and_a_new_one_started(tmp_path):
+    archive = cold_archive(str(tmp_path), segment_bytes=1)
+    archive_hours(archive, range(3))
+
+    assert sorted(os.listdir(tmp_path)) == ["archive.lock", "seg_000001.idx", "seg_000001.z", "seg_000002.idx",
+                                            "seg_000002.z", "seg_000003.idx", "seg_000003.z"]
+    assert archive.stats()["segments"] == 3
+    assert len(archive) == 6
+    archive.close()
+
+
+def test_fetch_reads_across_segments(tmp_path):
+    archive = cold_archive(str(tmp_path), segment_bytes=1)
+    archive_hours(archive, range(6))
+
+    entries = archive.fetch(start=DAY + 2 * 3600, end=DAY + 4 * 3600, section="short_term")
+    assert [entry["value"] for entry in entries] == ["hour 2", "hour 3", "hour 4"]
+    assert [entry["value"] for entry in archive.fetch(start=DAY + 5 * 3600)] == ["hour 5", "summary 5"]
+    assert len(archive.fetch()) == 12
+    archive.close()
+
+
+def test_a_torn_index_record_is_ignored_and_overwritten(tmp_path):
+    archive = cold_archive(str(tmp_path))
+    archive_hours(archive, range(2))
+    archive.close()
+    with open(tmp_path / "seg_000001.idx", "ab") as f:
+        f.write(b"\x01" * (INDEX_RECORD.size // 2))  # A crash while writing the next record
+
+    reopened = cold_archive(str(tmp_path))
+    assert [entry["value"] for entry in reopened.fetch(section="short_term")] == ["hour 0", "hour 1"]
+    archive_hours(reopened, [2])
+    assert os.path.getsize(tmp_path / "seg_000001.idx") == 3 * INDEX_RECORD.size
+    assert [entry["value"] for entry in reopened.fetch(section="short_term")] == ["hour 0", "hour 1", "hour 2"]
+    reopened.close()
@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ai_handle import ai_request_error, async_ai_bot
+from backend_handle import llm_result
+
+
+class server_error(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+class fake_backend:
+    """Answers summaries after `delays[i]` seconds for the i-th request, raising `errors[i]` first if there is one."""
+
+    def __init__(self, delays=(), errors=()):
+        self.delays = list(delays)
+        self.errors = list(errors)
+        self.calls = 0
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def acomplete(self, model, messages):
+        call = self.calls
+        self.calls += 1
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays[call] if call < len(self.delays) else 0)
+            if call < len(self.errors) and self.errors[call] is not None:
+                raise self.errors[call]
+            return llm_result(f"summary {call}", None)
+        finally:
+            self.in_flight -= 1
+
+
+def make_bot(backend, **options):
+    return async_ai_bot(backend=backend, summary_cache=False, rate_limit=False, base_delay=0.01, **options)
+
+
+def test_a_transient_error_is_retried():
+    backend = fake_backend(errors=[server_error(503)])
+    bot = make_bot(backend)
+
+    assert asyncio.run(bot.summarize_memories("text", "short_term")) == "summary 1"
+    assert bot.retries == 1
+
+
+def test_retry_after_sets_the_delay():
+    bot = make_bot(fake_backend(), max_delay=5.0)
+
+    assert bot._retry_delay(server_error(429, retry_after="2"), 0) == 2.0
+    assert bot._retry_delay(server_error(429, retry_after="60"), 0) == 5.0
+    assert 0 <= bot._retry_delay(server_error(429), 3) <= 0.08
+
+
+def test_other_errors_are_not_retried():
+    backend = fake_backend(errors=[server_error(400)])
+    bot = make_bot(backend)
+
+    with pytest.raises(ai_request_error):
+        asyncio.run(bot.summarize_memories("text", "short_term"))
+    assert backend.calls == 1
+
+
+def test_a_stalled_request_times_out():
+    backend = fake_backend(delays=[10, 10])
+    bot = make_bot(backend, timeout=0.05, max_retries=1)
+
+    with pytest.raises(ai_request_error):
+        asyncio.run(bot.summarize_memories("text", "short_term"))
+    assert backend.calls == 2
+    assert bot.retries == 1
+
+
+def test_a_slow_request_is_hedged():
+    backend = fake_backend(delays=[10, 0])
+    bot = make_bot(backend, hedge_after=0.05)
+
+    assert asyncio.run(bot.summarize_memories("text", "short_term")) == "summary 1"
+    assert bot.hedges == 1
+
+
+def test_hedged_requests_stay_within_max_concurrency():
+    backend = fake_backend(delays=[0.2] * 8)
+    bot = make_bot(backend, max_concurrency=2, hedge_after=0.05)
+
+    async def run_all():
+        return await asyncio.gather(*(bot.summarize_memories(f"text {i}", "short_term") for i in range(4)))
+
+    assert len(asyncio.run(run_all())) == 4
+    assert backend.most_in_flight <= 2
@@ -0,0 +1,62 @@
+import json
+import time
+
+import pytest
+
+from ai_handle import ai_bot, response_strucuture
+from backend_handle import make_backend, replay_miss_error
+from memory_handle import memory_manager
+
+
+def play_session(directory, recordings, mode):
+    bot = ai_bot(backend=make_backend("local", record_dir=str(recordings), record_mode=mode), summary_cache=False)
+    memory = memory_manager(ai_bot_instance=bot, filepath=str(directory / "memory.json"))
+    memory.save_to_memory("You are standing in an open field west of a white house.", "short_term", "system")
+    memory.save_to_memory("The mailbox holds a leaflet.", "long_term")
+    answers = [bot.adventure_response(memory.get_memory_view(), "Play the game.")]
+    memory.save_to_memory(answers[0][0], "short_term", "assistant")
+    answers.append(bot.adventure_response(memory.get_memory_view(), "Play the game."))
+    memory.close()
+    return answers
+
+
+def test_a_recorded_session_replays_at_another_time(tmp_path, monkeypatch):
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    recorded = play_session(tmp_path / "first", tmp_path / "recordings", "record")
+
+    real_time = time.time
+    monkeypatch.setattr(time, "time", lambda: real_time() + 3 * 86400)
+    replayed = play_session(tmp_path / "second", tmp_path / "recordings", "replay")
+
+    assert replayed == recorded
+
+
+def test_replay_of_an_unknown_request_raises(tmp_path):
+    backend = make_backend("local", record_dir=str(tmp_path), record_mode="replay")
+    with pytest.raises(replay_miss_error):
+        backend.complete("model", [{"role": "user", "content": "never recorded"}])
+
+
+def test_replay_keys_ignore_times_but_not_content(tmp_path):
+    backend = make_backend("local", record_dir=str(tmp_path))
+    key = lambda content: backend._key("complete", "model", [
+        {"role": "system", "content": "The current time is: Sat Oct 18 10:00:00 2025"},
+        {"role": "user", "content": content}])[0]
+
+    assert (key("Time of the exchange: Sat Oct 18 10:00:00 2025\n Exchange: open the mailbox")
+            == key("Time of the exchange: Mon Oct 20 18:30:12 2025\n Exchange: open the mailbox"))
+    assert key("[2025-10-18 10:00:00] The mailbox is open.") == key("[2025-10-20 18:30:12] The mailbox is open.")
+    assert key("open the mailbox") != key("read the leaflet")
+
+
+def test_a_recorded_stream_replays_as_one_piece(tmp_path):
+    messages = [{"role": "user", "content": "open the mailbox"}]
+    recorded = list(make_backend("local", record_dir=str(tmp_path), record_mode="record")
+                    .stream("model", messages, response_strucuture))
+    replayed = list(make_backend("local", record_dir=str(tmp_path), record_mode="replay")
+                    .stream("model", messages, response_strucuture))
+
+    assert len(recorded) > 2 and len(replayed) == 2
+    assert json.loads("".join(recorded[:-1])) == json.loads(replayed[0])
+    assert replayed[-1].content == recorded[-1].content
@@ -0,0 +1,42 @@
+import time
+
+from ai_handle import ai_bot
+from backend_handle import make_backend
+from cache_handle import summary_cache
+from memory_handle import memory_manager
+
+
+def summarize_session(directory, cache):
+    bot = ai_bot(backend=make_backend("local"), summary_cache=cache)
+    memory = memory_manager(ai_bot_instance=bot, filepath=str(directory / "memory.json"))
+    for i in range(memory.SHORT_TERM_THRESHOLD):
+        memory.save_to_memory(f"go north {i}", "short_term", "user")
+    memory.check()
+    memory.close()
+
+
+def test_the_same_session_misses_the_cache_at_another_time(tmp_path, monkeypatch):
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    cache = summary_cache(str(tmp_path / "summary_cache.db"))
+
+    summarize_session(tmp_path / "first", cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    real_time = time.time
+    monkeypatch.setattr(time, "time", lambda: real_time() + 86400)
+    summarize_session(tmp_path / "second", cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    cache.close()
+
+
+def test_only_the_exact_input_hits(tmp_path):
+    cache = summary_cache(str(tmp_path / "summary_cache.db"))
+    cache.put("short_term", "model", "prompt", "[User]: Time of the exchange: Sun Oct 18 11:28:24 2026\n Exchange: a", "s")
+    assert cache.get("short_term", "model", "prompt",
+                     "[User]: Time of the exchange: Sun Oct 18 11:28:24 2026\n Exchange: a") == "s"
+    assert cache.get("short_term", "model", "prompt",
+                     "[User]: Time of the exchange: Mon Oct 19 09:00:00 2026\n Exchange: a") is None
+    assert cache.get("short_term", "model", "prompt",
+                     "[User]: Time of the exchange: Sun Oct 18 11:28:24 2026\n Exchange: b") is None
+    cache.close()
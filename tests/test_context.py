@@ -0,0 +1,26 @@
+import helper_tools
+from benchmarks.fake_bot import fake_ai_bot
+from helper_tools import context_builder
+from memory_handle import memory_manager
+
+
+def test_builder_reads_the_token_counts_saved_with_the_entries(tmp_path, monkeypatch):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"))
+    for i in range(10):
+        memory.save_to_memory(f"message number {i}", "short_term", "user" if i % 2 else "assistant")
+    memory.save_to_memory("the lamp is in the attic", "long_term")
+    view = memory.get_memory_view()
+    copied = memory.get_memory_structure()
+
+    expected = context_builder()
+    expected.build(copied, token_budget=10000)
+
+    counted = []
+    original = helper_tools.count_tokens
+    monkeypatch.setattr(helper_tools, "count_tokens", lambda text: counted.append(text) or original(text))
+    builder = context_builder()
+    builder.build(view, token_budget=10000)
+
+    assert builder.last_usage == expected.last_usage
+    assert len(counted) == 2  # The system prompt and the current time, none of the entries
+    memory.close()
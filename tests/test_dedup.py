@@ -0,0 +1,54 @@
+from benchmarks.fake_bot import fake_ai_bot
+from dedup_handle import duplicate_filter
+from memory_handle import memory_manager
+
+ROOM = "West of House. You are standing in an open field west of a white house, with a boarded front door."
+
+
+def short_term_texts(memory):
+    return [entry.split("\n Exchange: ", 1)[1] for entry in memory.get_memory_structure()["short_term"].values()]
+
+
+def test_a_repeat_names_the_tag_and_time_of_the_original(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"), dedup=True)
+    memory.save_to_memory(ROOM, "short_term", "system")
+    memory.save_to_memory("go north", "short_term", "assistant")
+    memory.save_to_memory(ROOM, "short_term", "system")
+    memory.save_to_memory(ROOM, "short_term", "system")
+
+    first = next(iter(memory.get_memory_structure()["short_term"].values()))
+    original_time = first.split("\n Exchange: ", 1)[0][len("Time of the exchange: "):]
+    texts = short_term_texts(memory)
+    assert texts[2] == f"[Same as the system message of {original_time}, seen 2 times]"
+    assert texts[3] == f"[Same as the system message of {original_time}, seen 3 times]"
+    assert memory.get_dedup_stats()["exact"] == 2
+    memory.close()
+
+
+def test_near_duplicates_are_kept_by_default(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"), dedup=True)
+    memory.save_to_memory(ROOM + " There is a small mailbox here.", "short_term", "system")
+    memory.save_to_memory(ROOM + " There is a small mailbox here, open.", "short_term", "system")
+    assert not short_term_texts(memory)[1].startswith("[")
+    memory.close()
+
+
+def test_near_duplicates_with_a_threshold():
+    dedup = duplicate_filter(threshold=0.5)
+    dedup.add("system", "system_1", ROOM + " There is a small mailbox here.")
+    kind, key, similarity, repeats = dedup.find("system", ROOM + " There is a small mailbox here, open.")
+    assert (kind, key, repeats) == ("near", "system_1", 2)
+    assert 0.5 <= similarity < 1
+    assert dedup.find("user", ROOM) is None
+
+
+def test_a_repeat_too_short_for_a_reference_is_saved_and_remembered_in_full(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"), dedup=True)
+    for _ in range(3):
+        memory.save_to_memory("Taken.", "short_term", "system")
+
+    assert short_term_texts(memory) == ["Taken."] * 3
+    assert [(entry[0], entry[3]) for entry in memory.dedup._recent["system"]] == \
+        [("system_1", 1), ("system_2", 1), ("system_3", 1)]
+    assert memory.get_dedup_stats()["exact"] == 0
+    memory.close()
@@ -0,0 +1,222 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_bot import fake_ai_bot
+import memory_handle
+from memory_handle import memory_manager
+from metrics_handle import metrics_registry
+
+
+class blocking_bot(fake_ai_bot):
+    """
+    A fake bot whose summaries wait until they are released, to look at the memory while a check is summarizing.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def summarize_memories(self, to_summarize, memory_type):
+        self.started.set()
+        self.release.wait(5)
+        return super().summarize_memories(to_summarize, memory_type)
+
+
+def fill(memory, count, tag="user"):
+    for i in range(count):
+        memory.save_to_memory(f"message number {i}", "short_term", tag)
+
+
+def test_sync_check_does_not_block_saves_while_summarizing(tmp_path):
+    bot = blocking_bot()
+    memory = memory_manager(ai_bot_instance=bot, filepath=str(tmp_path / "memory.json"))
+    fill(memory, memory.SHORT_TERM_THRESHOLD)
+
+    checker = threading.Thread(target=memory.check)
+    checker.start()
+    assert bot.started.wait(5)
+
+    saver = threading.Thread(target=memory.save_to_memory, args=("saved meanwhile", "short_term", "user"))
+    saver.start()
+    saver.join(2)
+    saved_while_summarizing = not saver.is_alive()
+    bot.release.set()
+    checker.join(5)
+    saver.join(5)
+
+    assert saved_while_summarizing
+    assert any(entry.endswith("saved meanwhile") for entry in memory.get_memory_structure()["short_term"].values())
+    memory.close()
+
+
+def test_map_reduce_summarizes_chunks_and_counts_them(tmp_path, capsys):
+    bot = fake_ai_bot(summary_chars=40)
+    memory = memory_manager(ai_bot_instance=bot, filepath=str(tmp_path / "memory.json"),
+                            summarization="map_reduce", summary_chunk_tokens=100)
+    memory.metrics = metrics_registry()
+    fill(memory, memory.SHORT_TERM_THRESHOLD)
+    memory.check()
+
+    assert memory.metrics.counter_value("summary_chunks_total") > 1
+    assert bot.summaries == memory.metrics.counter_value("summary_chunks_total") + 1
+    assert "chunks in parallel" not in capsys.readouterr().out
+    memory.close()
+
+
+def test_count_scheduler_checks_without_counting_tokens(tmp_path, monkeypatch):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"))
+    fill(memory, 3)
+    counted = []
+    monkeypatch.setattr(memory_handle, "count_tokens", lambda text: counted.append(text) or 1)
+    memory.check()
+    assert counted == []
+    assert memory.get_compaction_plan()["short_term"]["reason"] == f"3/{memory.SHORT_TERM_THRESHOLD} entries"
+    memory.close()
+
+
+def test_token_totals_follow_saves_and_purges(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"),
+                            scheduler="tokens", scheduler_options={"prompt_budget": 100000})
+    fill(memory, 5)
+    tokens = memory.get_compaction_plan()["tokens"]
+    view = memory.get_memory_view()
+    assert tokens["short_term"] == sum(view["token_counts"]["short_term"].values()) > 0
+    memory.replace_section("short_term", {})
+    assert memory.get_compaction_plan()["tokens"]["short_term"] == 0
+    memory.close()
+
+
+def test_keys_keep_their_order_after_a_purge_and_a_reload(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend="journal")
+    fill(memory, memory.SHORT_TERM_THRESHOLD)
+    memory.check()
+    kept = list(memory.get_memory_structure()["short_term"])
+    assert [key for key, _ in memory.get_last_short_term(len(kept) + 5)] == kept
+    memory.close()
+
+    reloaded = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend="journal")
+    reloaded.save_to_memory("after the reload", "short_term", "assistant")
+    keys = list(reloaded.get_memory_structure()["short_term"])
+    seqs = [memory_handle.short_term_index.parse_key(key)[1] for key in keys]
+    assert keys[:-1] == kept and seqs == sorted(set(seqs))
+    assert reloaded.get_last_short_term(1)[0][1].endswith("after the reload")
+    reloaded.close()
+
+
+def test_a_failed_batch_is_rolled_back_and_not_written(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend="journal", dedup=True)
+    fill(memory, 2)
+    before = memory.get_memory_structure()
+    written = memory.storage.bytes_written
+
+    try:
+        with memory.batch():
+            memory.save_to_memory("inside the batch", "short_term", "user")
+            memory.save_to_memory("a summary", "long_term")
+            memory.replace_section("short_term", {})
+            raise RuntimeError("summary failed")
+    except RuntimeError:
+        pass
+
+    assert memory.get_memory_structure() == before
+    assert memory.storage.bytes_written == written
+    assert len(memory.get_last_short_term(10)) == 2
+    # The duplicate filter only knows the entries that are still there
+    assert [entry[0] for entry in memory.dedup._recent["user"]] == list(before["short_term"])
+    memory.close()
+    reloaded = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend="journal")
+    assert reloaded.get_memory_structure() == before
+    reloaded.close()
+
+
+def test_group_commit_is_durable_when_the_save_returns(tmp_path, monkeypatch):
+    filepath = str(tmp_path / "memory.json")
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend="journal",
+                            write_back="group", group_commit_ms=50)
+    syncs = []
+    original_sync = memory.storage.sync
+    monkeypatch.setattr(memory.storage, "sync", lambda: syncs.append(1) or original_sync())
+
+    savers = [threading.Thread(target=memory.save_to_memory, args=(f"message {i}", "short_term", "user"))
+              for i in range(8)]
+    for saver in savers:
+        saver.start()
+    for saver in savers:
+        saver.join(5)
+
+    assert not memory.is_dirty()
+    assert 1 <= len(syncs) < 8  # Saves arriving together share one sync
+    other = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend="journal")
+    assert len(other.get_memory_structure()["short_term"]) == 8
+    other.close()
+    memory.close()
+
+
+def test_a_view_does_not_change_with_later_saves(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"))
+    fill(memory, 3)
+    memory.save_to_memory("first summary", "long_term")
+    view = memory.get_memory_view()
+    short_term, long_term = dict(view["short_term"]), list(view["long_term"])
+
+    memory.save_to_memory("later message", "short_term", "user")
+    memory.save_to_memory("later summary", "long_term")
+    with memory.batch():
+        memory.save_to_memory("message in a batch", "short_term", "user")
+
+    assert dict(view["short_term"]) == short_term
+    assert list(view["long_term"]) == long_term
+    assert len(memory.get_memory_view()["short_term"]) == 5
+    memory.close()
+
+
+@pytest.mark.parametrize("backend, filename", [("json", "memory.json"), ("journal", "memory.json"),
+                                               ("sqlite", "memory.db")])
+def test_range_and_since_queries_survive_a_reload(tmp_path, monkeypatch, backend, filename):
+    start = 1_700_000_000.0
+    clock = [start]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    filepath = str(tmp_path / filename)
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend=backend)
+    for hour in range(6):
+        clock[0] = start + hour * 3600
+        memory.save_to_memory(f"message at hour {hour}", "short_term", "user" if hour % 2 else "assistant")
+        memory.save_to_memory(f"summary at hour {hour}", "long_term")
+    memory.close()
+
+    for memory in (memory, memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend=backend)):
+        between = memory.get_short_term_between(start + 3600, start + 3 * 3600)
+        assert [entry.rpartition(": ")[2] for _, entry in between] == [f"message at hour {hour}" for hour in (1, 2, 3)]
+        assert memory.get_short_term_between(end=start - 1) == []
+        assert [key for key, _ in memory.get_short_term_since(4)] == ["assistant_5", "user_6"]
+        since = memory.get_long_term_since(start + 4 * 3600)
+        assert [entry.partition("] ")[2] for entry in since] == ["summary at hour 4", "summary at hour 5"]
+        assert memory.get_long_term_since(start + 6 * 3600) == []
+        assert memory.get_counts()["short_term_tags"] == {"assistant": 3, "user": 3}
+    memory.close()
+
+
+def test_a_failed_batch_leaves_earlier_views_alone(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"))
+    memory.save_to_memory("a", "short_term", "user")
+    memory.save_to_memory("first summary", "long_term")
+    view = memory.get_memory_view()
+
+    try:
+        with memory.batch():
+            memory.save_to_memory("b", "short_term", "user")
+            memory.save_to_memory("second summary", "long_term")
+            raise RuntimeError("summary failed")
+    except RuntimeError:
+        pass
+    memory.save_to_memory("c", "short_term", "user")
+    memory.save_to_memory("third summary", "long_term")
+
+    assert len(view["short_term"]) == 1 and len(view["long_term"]) == 1
+    assert len(memory.get_memory_view()["short_term"]) == 2
+    memory.close()
@@ -0,0 +1,92 @@
+import json
+import os
+from datetime import datetime
+
+from benchmarks.fake_bot import fake_ai_bot
+from memory_handle import memory_manager
+from retrieval_handle import bm25_index
+
+
+def compact_long_term(memory, entries):
+    for entry in entries:
+        memory.save_to_memory(entry, "long_term")
+    memory.LONG_TERM_THRESHOLD = len(entries)
+    memory.LONG_TERM_KEEP_COUNT = 1
+    memory.check()
+
+
+def test_dropped_long_term_entries_are_archived_outside_the_database(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, retrieval=True)
+    compact_long_term(memory, ["the troll guards the bridge", "the lamp is in the attic", "the river is cold"])
+    memory.close()
+
+    with open(filepath) as f:
+        assert "long_term_archive" not in json.load(f)
+
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, retrieval=True)
+    assert memory.get_counts()["long_term_archive"] == 2
+    assert "troll" in memory.search_long_term("where is the troll", k=1)[0]
+    memory.close()
+
+
+def test_archive_section_of_older_databases_is_moved_out(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    with open(filepath, "w") as f:
+        json.dump({"short_term": {}, "long_term": [], "base_memory": "",
+                   "long_term_archive": ["the egg is in the nest"]}, f)
+
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, retrieval=True)
+    assert memory.search_long_term("egg", k=1) == ["the egg is in the nest"]
+    memory.close()
+
+    with open(filepath) as f:
+        assert not json.load(f)["long_term_archive"]
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, retrieval=True)
+    assert memory.search_long_term("egg", k=1) == ["the egg is in the nest"]
+    memory.close()
+
+
+def test_with_a_cold_archive_dropped_entries_are_archived_once_with_their_time(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    archive = str(tmp_path / "archive")
+    with open(filepath, "w") as f:
+        json.dump({"short_term": {}, "base_memory": "",
+                   "long_term": ["[2024-01-01 10:00:00] the troll guards the bridge",
+                                 "[2024-01-02 10:00:00] the lamp is in the attic",
+                                 "[2024-01-03 10:00:00] the river is cold"]}, f)
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, retrieval=True, archive=archive)
+    memory.LONG_TERM_THRESHOLD = 3
+    memory.LONG_TERM_KEEP_COUNT = 1
+    memory.check()
+    memory.close()
+
+    assert not os.path.exists(f"{filepath}.archive")
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, retrieval=True, archive=archive)
+    second_day = datetime(2024, 1, 2).timestamp()
+    assert [entry["value"] for entry in memory.get_archived(end=second_day)] == [
+        "[2024-01-01 10:00:00] the troll guards the bridge"]
+    assert len(memory.get_archived(section="long_term")) == 2
+    assert memory.get_counts()["long_term_archive"] == 2
+    assert "troll" in memory.search_long_term("where is the troll", k=1)[0]
+    memory.close()
+
+
+def test_a_topical_entry_outranks_one_of_the_same_day(tmp_path):
+    index = bm25_index()
+    index.add("bridge", "[2026-10-18 11:28:24] I crossed the bridge.")
+    index.add("lamp", "[2026-10-17 09:02:51] The brass lamp lies on the trophy case.")
+    query = "Time of the exchange: Sun Oct 18 11:30:02 2026\n Exchange: where is the lamp"
+
+    assert [doc_id for doc_id, _ in index.search(query)] == ["lamp"]
+
+
+def test_search_with_a_saved_entry_finds_its_topic(tmp_path):
+    memory = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=str(tmp_path / "memory.json"), retrieval=True)
+    for entry in ["I crossed the bridge.", "The brass lamp lies on the trophy case.", "The troll took my sword."]:
+        memory.save_to_memory(entry, "long_term")
+    memory.save_to_memory("where is the lamp", "short_term", "user")
+    query = memory.get_last_short_term(1)[0][1]
+
+    assert memory.search_long_term(query, k=1)[0].endswith("The brass lamp lies on the trophy case.")
+    memory.close()
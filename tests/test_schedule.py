@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from schedule_handle import count_scheduler, make_scheduler, token_scheduler
+
+
+def test_count_plan_follows_the_thresholds_of_the_memory():
+    memory = SimpleNamespace(SHORT_TERM_THRESHOLD=10, SHORT_TERM_KEEP_COUNT=3,
+                             LONG_TERM_THRESHOLD=5, LONG_TERM_KEEP_COUNT=2)
+    scheduler = make_scheduler("count")
+
+    assert isinstance(scheduler, count_scheduler) and not scheduler.needs_tokens
+    assert scheduler.plan_short_term(memory, {"short_term": 9})["compact"] is False
+    plan = scheduler.plan_short_term(memory, {"short_term": 10})
+    assert (plan["compact"], plan["keep"], plan["segment"]) == (True, 3, 7)
+    assert scheduler.plan_long_term(memory, {"long_term": 5})["compact"] is True
+
+
+def test_token_plan_keeps_what_fits_and_names_the_segment():
+    scheduler = token_scheduler(prompt_budget=1000, short_term_share=0.5, keep_share=0.3, min_keep=2)
+
+    under = scheduler.plan_short_term(None, {"short_term": [100] * 4})
+    assert (under["compact"], under["segment"]) == (False, 0)
+
+    over = scheduler.plan_short_term(None, {"short_term": [100] * 6})
+    assert over["compact"] is True
+    assert over["keep"] == 2  # Only one entry fits into 150 tokens, but min_keep are always kept
+    assert over["segment"] == 3  # 350 tokens are dropped for sure
+    assert scheduler.state()["last_plans"]["short_term"] == over
+
+
+def test_token_plan_starts_early_by_the_growth_during_a_summary():
+    scheduler = token_scheduler(prompt_budget=1000, short_term_share=0.5)
+    tokens = [90] * 5
+    assert scheduler.plan_short_term(None, {"short_term": tokens})["compact"] is False
+
+    scheduler.observe_summary("short_term", 2.0, 100, 20)  # 0.02 seconds per token
+    scheduler.growth = 10.0  # Tokens per second
+    plan = scheduler.plan_short_term(None, {"short_term": tokens})
+    assert plan["lead"] == 90 and plan["compact"] is True
+
+
+def test_token_plan_waits_while_summaries_are_not_shorter():
+    scheduler = token_scheduler(prompt_budget=1000, short_term_share=0.5)
+    scheduler.observe_summary("short_term", 0.0, 100, 150)
+
+    assert scheduler.plan_short_term(None, {"short_term": [100] * 6})["compact"] is False
+    assert scheduler.plan_short_term(None, {"short_term": [100] * 10})["compact"] is True
+
+
+def test_frequent_compactions_keep_less():
+    scheduler = token_scheduler(keep_share=0.4, min_turns_between=3)
+    scheduler.observe_compaction("short_term")
+    assert scheduler.keep_share == 0.4 * 0.75
+    for _ in range(13):
+        scheduler.observe_check(None, {"short_term": []})
+    scheduler.observe_compaction("short_term")
+    assert scheduler.keep_share == 0.4
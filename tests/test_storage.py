@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+import pytest
+
+from benchmarks.fake_bot import fake_ai_bot
+from memory_handle import memory_manager
+from storage_handle import journal_storage, json_storage, sqlite_storage
+
+
+def put(key, value):
+    return {"op": "put", "section": "short_term", "key": key, "value": value}
+
+
+def test_json_storage_keeps_changes_of_other_writers(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    first, second = json_storage(filepath), json_storage(filepath)
+    first.create()
+
+    first.apply([put("user_1", "a")])
+    second.apply([put("user_2", "b")])
+    first.apply([put("user_3", "c")])
+
+    assert json_storage(filepath).load()["short_term"] == {"user_1": "a", "user_2": "b", "user_3": "c"}
+
+
+def test_json_storage_does_not_parse_the_file_on_every_save(tmp_path, monkeypatch):
+    filepath = str(tmp_path / "memory.json")
+    storage = json_storage(filepath)
+    storage.create()
+    storage.load()
+
+    reads = []
+    original_load = json.load
+    monkeypatch.setattr(json, "load", lambda f, *args, **kwargs: reads.append(f) or original_load(f, *args, **kwargs))
+    for i in range(5):
+        storage.apply([put(f"user_{i}", "hello")])
+
+    assert reads == []
+    assert len(json_storage(filepath).load()["short_term"]) == 5
+
+
+def test_sqlite_long_term_replace_keeps_the_timestamps_of_kept_entries(tmp_path):
+    storage = sqlite_storage(str(tmp_path / "memory.db"))
+    storage.create()
+    storage.apply([{"op": "append", "section": "long_term", "value": "old"},
+                   {"op": "append", "section": "long_term", "value": "kept"}])
+    time.sleep(0.01)
+    after_appends = time.time()
+
+    storage.apply([{"op": "replace", "section": "long_term", "value": ["kept", "new"]}])
+
+    assert storage.load()["long_term"] == ["kept", "new"]
+    rows = storage._connect().execute("SELECT value FROM long_term WHERE ts >= ? ORDER BY id", (after_appends,))
+    assert [row[0] for row in rows] == ["new"]
+    storage.close()
+
+
+@pytest.mark.parametrize("backend, filename", [("json", "memory.json"), ("journal", "memory.json"),
+                                               ("sqlite", "memory.db")])
+def test_two_writers_never_create_the_same_key(tmp_path, backend, filename):
+    filepath = str(tmp_path / filename)
+    first = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend=backend)
+    second = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend=backend)
+    for i in range(5):
+        first.save_to_memory(f"first {i}", "short_term", "user")
+        second.save_to_memory(f"second {i}", "short_term", "user")
+    first.close()
+    second.close()
+
+    reloaded = memory_manager(ai_bot_instance=fake_ai_bot(), filepath=filepath, backend=backend)
+    entries = reloaded.get_memory_structure()["short_term"]
+    assert len(entries) == 10
+    reloaded.close()
+
+
+def test_json_storage_only_fsyncs_on_sync_unless_asked_to(tmp_path, monkeypatch):
+    fsyncs = []
+    original_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or original_fsync(fd))
+
+    storage = json_storage(str(tmp_path / "memory.json"))
+    storage.create()
+    fsyncs.clear()
+    for i in range(3):
+        storage.apply([put(f"user_{i}", "hello")])
+    assert fsyncs == []
+    storage.sync()
+    assert fsyncs
+
+    durable = json_storage(str(tmp_path / "durable.json"), fsync=True)
+    durable.create()
+    fsyncs.clear()
+    durable.apply([put("user_1", "hello")])
+    assert fsyncs
+
+
+def test_journal_cuts_off_a_torn_last_record(tmp_path, capsys):
+    filepath = str(tmp_path / "memory.json")
+    storage = journal_storage(filepath)
+    storage.create()
+    storage.apply([put("user_1", "a")])
+    storage.apply([put("user_2", "b")])
+    storage.close()
+    with open(f"{filepath}.log", "rb") as f:
+        intact = f.read()
+    with open(f"{filepath}.log", "ab") as f:
+        f.write(storage._encode(3, put("user_3", "c"))[:-10])  # A crash in the middle of the write
+
+    reopened = journal_storage(filepath)
+    assert reopened.load()["short_term"] == {"user_1": "a", "user_2": "b"}
+    assert "incomplete journal data" in capsys.readouterr().out
+    with open(f"{filepath}.log", "rb") as f:
+        assert f.read() == intact
+    reopened.apply([put("user_4", "d")])
+    reopened.close()
+    assert journal_storage(filepath).load()["short_term"] == {"user_1": "a", "user_2": "b", "user_4": "d"}
+
+
+def test_journal_skips_records_already_in_the_snapshot(tmp_path):
+    filepath = str(tmp_path / "memory.json")
+    storage = journal_storage(filepath, compact_every=3)
+    storage.create()
+    for i in range(4):
+        storage.apply([put(f"user_{i}", str(i))])
+    storage.close()
+    # A crash between writing the snapshot and truncating the journal leaves folded records behind
+    with open(f"{filepath}.log", "ab") as f:
+        f.write(storage._encode(1, put("user_0", "stale")))
+
+    assert journal_storage(filepath).load()["short_term"] == {f"user_{i}": str(i) for i in range(4)}
@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+
+from benchmarks.fake_bot import fake_ai_bot
+from store_handle import memory_store
+
+
+def make_store(tmp_path, **options):
+    return memory_store(str(tmp_path / "store"), ai_bot_instance=fake_ai_bot(), **options)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "journal"])
+def test_sessions_are_routed_to_their_shard(tmp_path, backend):
+    store = make_store(tmp_path, shards=4, backend=backend)
+    sessions = [f"user_{i}" for i in range(20)]
+    for session_id in sessions:
+        with store.session(session_id) as memory:
+            memory.save_to_memory(f"hello from {session_id}", "short_term", "user")
+    store.close()
+
+    assert {store.shard_of(session_id) for session_id in sessions} == {0, 1, 2, 3}
+    with memory_store(str(tmp_path / "store"), shards=4) as reopened:
+        assert [reopened.shard_of(session_id) for session_id in sessions] == \
+            [store.shard_of(session_id) for session_id in sessions]
+    assert len([name for name in os.listdir(tmp_path / "store") if name.startswith("shard_")]) == 4
+    for session_id in sessions:
+        filepath, _ = store._storage_for(session_id)
+        shard = f"shard_{store.shard_of(session_id):03d}"
+        assert os.path.relpath(filepath, tmp_path / "store").startswith(shard)
+
+
+def test_idle_sessions_are_flushed_and_evicted_beyond_max_active(tmp_path):
+    store = make_store(tmp_path, shards=2, max_active=2, write_back="close")
+    for session_id in ("a", "b", "c"):
+        with store.session(session_id) as memory:
+            memory.save_to_memory(f"note of {session_id}", "long_term")
+
+    assert len(store) == 2
+    assert "a" not in store and "c" in store
+
+    with store.session("a") as memory:
+        assert memory.get_counts()["long_term"] == 1
+        assert "note of a" in memory.get_long_term_since(0)[0]
+    assert "b" not in store
+    store.close()
+
+
+def test_saves_to_one_session_are_serialized(tmp_path):
+    store = make_store(tmp_path, shards=2)
+    inside = []
+    overlaps = []
+
+    def play(thread):
+        for i in range(20):
+            with store.session("shared") as memory:
+                inside.append(thread)
+                if len(inside) > 1:
+                    overlaps.append(thread)
+                memory.save_to_memory(f"thread {thread} turn {i}", "short_term", "user")
+                inside.remove(thread)
+
+    threads = [threading.Thread(target=play, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with store.session("shared") as memory:
+        assert memory.get_counts()["short_term"] == 160
+    store.close()
+    assert overlaps == []
@@ -0,0 +1,32 @@
+import pytest
+
+from ai_handle import json_field_stream, json_stream_error
+
+
+def feed_all(pieces):
+    stream = json_field_stream()
+    for piece in pieces:
+        stream.feed(piece)
+    return stream.fields
+
+
+def test_fields_split_across_pieces():
+    fields = feed_all(['{"thinking": "look', ' around", "resp', 'onse": "north\\', 'nnow"}'])
+    assert fields == {"thinking": "look around", "response": "north\nnow"}
+
+
+def test_surrogate_pair_is_joined_across_pieces():
+    fields = feed_all(['{"response": "hi \\uD83D', '\\uDE00 there"}'])
+    assert fields["response"] == "hi \U0001F600 there"
+    fields["response"].encode("utf-8")  # A lone surrogate would raise here
+
+
+def test_lone_surrogate_becomes_replacement_character():
+    fields = feed_all(['{"response": "a\\ud83db", "thinking": "\\ude00"}'])
+    assert fields == {"response": "a�b", "thinking": "�"}
+
+
+@pytest.mark.parametrize("text", ['{"response": "\\u12G4"}', '{"response": "\\q"}'])
+def test_bad_escape_is_a_parse_error(text):
+    with pytest.raises(json_stream_error):
+        feed_all([text[:15], text[15:]])
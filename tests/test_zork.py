@@ -0,0 +1,64 @@
+import asyncio
+import json
+import sys
+import time
+
+from zork import run_many
+from zork.run_zork import PROMPT_PATTERN, game_driver
+
+
+def read_from(script, **options):
+    """Starts a python script as the game, returns what read_output() got and how long it took."""
+    async def read():
+        game = game_driver([sys.executable, "-c", script], **options)
+        await game.start()
+        started = time.perf_counter()
+        try:
+            return await game.read_output(), time.perf_counter() - started, game.score
+        finally:
+            await game.close()
+
+    return asyncio.run(read())
+
+
+def test_the_prompt_is_a_lone_greater_than_sign_on_the_last_line():
+    assert PROMPT_PATTERN.search("West of House\nYou are standing in an open field.\n>")
+    assert PROMPT_PATTERN.search("West of House\n> ")
+    assert PROMPT_PATTERN.search(">")
+    assert not PROMPT_PATTERN.search("West of House\n>\nThere is a mailbox here.")
+    assert not PROMPT_PATTERN.search("Your score is 5 > 3")
+
+
+def test_output_is_complete_at_the_prompt():
+    script = "import sys, time; print('Your score is 35'); print('>', end=''); sys.stdout.flush(); time.sleep(10)"
+    output, seconds, score = read_from(script, timeout=10, idle_time=5)
+    assert output.endswith(">")
+    assert seconds < 2
+    assert score == 35
+
+
+def test_output_without_a_prompt_is_complete_once_idle():
+    script = "import sys, time; print('Game over.'); sys.stdout.flush(); time.sleep(10)"
+    output, seconds, _ = read_from(script, timeout=10, idle_time=0.3)
+    assert output == "Game over.\n"
+    assert seconds < 2
+
+
+def test_a_silent_game_times_out():
+    output, seconds, score = read_from("import time; time.sleep(10)", timeout=0.3, idle_time=5)
+    assert output == ""
+    assert 0.3 <= seconds < 2
+    assert score is None
+
+
+def test_run_many_plays_fake_games_with_the_local_backend(tmp_path):
+    output = tmp_path / "runs.json"
+    status = run_many.main(["--games", "2", "--turns", "3", "--fake", "--backend", "local", "--requests-per-minute", "0",
+                            "--memory-dir", str(tmp_path / "runs"), "--output", str(output)])
+
+    assert status == 0
+    with open(output) as f:
+        report = json.load(f)
+    assert [game["game"] for game in report["games"]] == ["game_0", "game_1"]
+    assert all(game["turns"] == 3 and game["error"] is None for game in report["games"])
+    assert report["totals"]["turns"] == 6
@@ -0,0 +1,193 @@
+# fake_interpreter.py
+# A scripted stand-in for a Z-machine interpreter, so the game runners can be tried and tested without frotz or a game file.
+
+# It reads commands from stdin and answers like an Infocom game would: a handful of rooms around the white house,
+# a few items worth points, the '>' prompt after every answer and "Your score is ..." when asked for the score.
+# The game ends after --max-moves moves (or on 'quit').
+
+# Usage:
+#   python zork/fake_interpreter.py [--max-moves 200] [--seed 0]
+
+
+import argparse
+import random
+import sys
+
+
+ROOMS = {
+    "West of House": {
+        "description": "You are standing in an open field west of a white house, with a boarded front door.",
+        "exits": {"north": "North of House", "south": "South of House", "west": "Forest"},
+        "items": ["mailbox"],
+    },
+    "North of House": {
+        "description": "You are facing the north side of a white house. There is no door here.",
+        "exits": {"west": "West of House", "east": "Behind House", "north": "Forest"},
+        "items": [],
+    },
+    "South of House": {
+        "description": "You are facing the south side of a white house. There is no door here.",
+        "exits": {"west": "West of House", "east": "Behind House"},
+        "items": [],
+    },
+    "Behind House": {
+        "description": "You are behind the white house. In one corner of the house there is a small window.",
+        "exits": {"north": "North of House", "south": "South of House", "west": "Kitchen", "enter window": "Kitchen"},
+        "items": [],
+    },
+    "Kitchen": {
+        "description": "You are in the kitchen of the white house. A passage leads west and a staircase leads up.",
+        "exits": {"east": "Behind House", "west": "Living Room", "up": "Attic", "go up": "Attic"},
+        "items": ["bottle"],
+    },
+    "Living Room": {
+        "description": "You are in the living room. There is a trophy case here and a large oriental rug.",
+        "exits": {"east": "Kitchen", "down": "Cellar", "go down": "Cellar"},
+        "items": ["lamp", "sword"],
+    },
+    "Attic": {
+        "description": "This is the attic. The only exit is a stairway leading down.",
+        "exits": {"down": "Kitchen", "go down": "Kitchen"},
+        "items": ["rope", "knife"],
+    },
+    "Cellar": {
+        "description": "You are in a dark and damp cellar with a narrow passageway leading north.",
+        "exits": {"up": "Living Room", "go up": "Living Room", "north": "Troll Room"},
+        "items": [],
+    },
+    "Troll Room": {
+        "description": "This is a small room with passages to the east and south. Bloodstains cover the walls.",
+        "exits": {"south": "Cellar"},
+        "items": ["egg"],
+    },
+    "Forest": {
+        "description": "This is a forest, with trees in all directions.",
+        "exits": {"east": "West of House", "south": "West of House"},
+        "items": [],
+    },
+}
+
+# Points for taking an item, and for reaching a room for the first time
+ITEM_POINTS = {"leaflet": 2, "lamp": 5, "sword": 5, "egg": 10, "bottle": 2, "rope": 2, "knife": 2}
+ROOM_POINTS = {"Kitchen": 10, "Cellar": 25, "Troll Room": 10, "Attic": 5}
+
+ALIASES = {"n": "north", "s": "south", "e": "east", "w": "west", "u": "up", "d": "down", "i": "inventory",
+           "l": "look", "get": "take"}
+
+
+class fake_game:
+    def __init__(self, max_moves=200, seed=0):
+        self.max_moves = max_moves
+        self.random = random.Random(seed)
+        self.rooms = {name: dict(room, items=list(room["items"])) for name, room in ROOMS.items()}
+        self.room = "West of House"
+        self.inventory = []
+        self.visited = {self.room}
+        self.mailbox_open = False
+        self.score = 0
+        self.moves = 0
+        self.over = False
+
+    def intro(self):
+        return ("ZORK I: The Great Underground Empire (a scripted imitation)\n\n"
+                f"{self.room}\n{self.look()}")
+
+    def look(self):
+        room = self.rooms[self.room]
+        text = room["description"]
+        if room["items"]:
+            text += "\n" + "\n".join(f"There is a {item} here." for item in room["items"])
+        return text
+
+    def _move(self, direction):
+        target = self.rooms[self.room]["exits"].get(direction)
+        if target is None:
+            return "You can't go that way."
+        self.room = target
+        if target not in self.visited:
+            self.visited.add(target)
+            self.score += ROOM_POINTS.get(target, 0)
+        return f"{target}\n{self.look()}"
+
+    def _take(self, item):
+        room = self.rooms[self.room]
+        if item not in room["items"]:
+            return "You can't see that here."
+        if item == "mailbox":
+            return "It is securely anchored."
+        room["items"].remove(item)
+        self.inventory.append(item)
+        self.score += ITEM_POINTS.get(item, 0)
+        return "Taken."
+
+    def command(self, line):
+        words = line.strip().lower().split()
+        if not words:
+            return "I beg your pardon?"
+        words[0] = ALIASES.get(words[0], words[0])
+        verb, rest = words[0], " ".join(words[1:])
+        phrase = " ".join(words)
+
+        if verb in ("quit", "exit"):
+            self.over = True
+            return f"Your score is {self.score} (total of 350 points), in {self.moves} moves."
+        if verb == "score":
+            return f"Your score is {self.score} (total of 350 points), in {self.moves} moves."
+
+        self.moves += 1
+        if phrase in self.rooms[self.room]["exits"]:
+            answer = self._move(phrase)
+        elif verb in ("north", "south", "east", "west", "up", "down"):
+            answer = self._move(verb)
+        elif verb == "go" and rest:
+            answer = self._move(ALIASES.get(rest, rest))
+        elif verb == "look":
+            answer = f"{self.room}\n{self.look()}"
+        elif verb == "inventory":
+            answer = ("You are carrying:\n" + "\n".join(f"  A {item}" for item in self.inventory)
+                      if self.inventory else "You are empty-handed.")
+        elif verb == "take" and rest:
+            answer = self._take(rest)
+        elif phrase == "open mailbox" and "mailbox" in self.rooms[self.room]["items"]:
+            if self.mailbox_open:
+                answer = "It is already open."
+            else:
+                self.mailbox_open = True
+                self.rooms[self.room]["items"].append("leaflet")
+                answer = "Opening the small mailbox reveals a leaflet."
+        elif verb in ("read", "examine") and rest:
+            if rest == "leaflet" and "leaflet" in self.inventory:
+                answer = "WELCOME TO ZORK!"
+            else:
+                answer = f"There's nothing special about the {rest}."
+        else:
+            answer = self.random.choice(("I don't know the word \"%s\"." % verb, "That's not a verb I recognise.",
+                                         "You can't do that here."))
+
+        if self.moves >= self.max_moves:
+            self.over = True
+            answer += (f"\n\n    ****  You have died  ****\n\n"
+                       f"Your score is {self.score} (total of 350 points), in {self.moves} moves.")
+        return answer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A scripted stand-in for a Z-machine interpreter.")
+    parser.add_argument("--max-moves", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    game = fake_game(args.max_moves, args.seed)
+    sys.stdout.write(game.intro() + "\n\n>")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        answer = game.command(line)
+        sys.stdout.write(answer + ("\n" if game.over else "\n\n>"))
+        sys.stdout.flush()
+        if game.over:
+            break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
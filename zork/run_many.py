@@ -0,0 +1,178 @@
+# run_many.py
+# Plays N Z-machine games at the same time, to compare memory settings over many rollouts.
+
+# Every game runs as its own asyncio subprocess (see run_zork.game_driver) with its own memory database, and all games
+# share one async_ai_bot, so its concurrency cap and rate limit hold for all of them together. When every game is done
+# the turns, throughput and score of each game are reported, followed by the totals.
+
+# Usage (from the project root):
+#   python -m zork.run_many --games 8 --turns 50 --fake --backend local      # offline, with the scripted interpreter
+#   python -m zork.run_many --games 4 --turns 100 --requests-per-minute 60   # frotz and the configured model
+#   python -m zork.run_many --games 8 --fake --summarization incremental --short-term-threshold 20 --output runs.json
+#   python -m zork.run_many --games 8 --fake --scheduler tokens --prompt-budget 2000
+# The games' own output and the memory manager's progress are hidden unless --verbose is given.
+
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shlex
+import statistics
+import sys
+import time
+
+from ai_handle import async_ai_bot, pooled_ai_bot
+from backend_handle import make_backend
+from memory_handle import memory_manager
+from metrics_handle import metrics
+from schedule_handle import SCHEDULERS
+from zork.run_zork import GAME_COMMAND, game_driver, play
+
+
+FAKE_INTERPRETER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_interpreter.py")
+
+
+def game_command(args, index):
+    """
+    Returns the command starting game number index.
+    """
+    if args.fake:
+        return [sys.executable, FAKE_INTERPRETER, "--seed", str(index), "--max-moves", str(args.max_moves)]
+    return shlex.split(args.command) if args.command else list(GAME_COMMAND)
+
+
+async def run_game(index, args, directory, bot, memory_bot):
+    """
+    Plays one game with its own memory, returns its result.
+    """
+    name = f"game_{index}"
+    scheduler_options = {"prompt_budget": args.prompt_budget} if args.scheduler == "tokens" else None
+    memory = memory_manager(ai_bot_instance=memory_bot, filepath=os.path.join(directory, f"{name}.json"),
+                            backend=args.storage, compaction=args.compaction, summarization=args.summarization,
+                            speculative=args.speculative, dedup=args.dedup, scheduler=args.scheduler,
+                            scheduler_options=scheduler_options)
+    if args.short_term_threshold:
+        memory.SHORT_TERM_THRESHOLD = args.short_term_threshold
+        memory.SHORT_TERM_KEEP_COUNT = max(1, args.short_term_threshold // 3)
+
+    game = game_driver(game_command(args, index))
+    turns = 0
+    error = None
+    started = time.perf_counter()
+    try:
+        await game.start()
+        turns = await play(game, memory, bot, max_turns=args.turns, name=name)
+        if game.running:
+            await game.send("score")  # Ask for the final score, it doesn't cost a move
+            await game.read_output()
+    except Exception as e:
+        error = repr(e)
+    finally:
+        elapsed = time.perf_counter() - started
+        await asyncio.to_thread(memory.close)  # Waits for summaries, which need the loop to keep running
+        await game.close()
+
+    result = {"game": name, "turns": turns, "score": game.score, "seconds": round(elapsed, 3),
+              "turns_per_minute": round(turns / elapsed * 60, 2) if elapsed else 0.0, "error": error}
+    if args.dedup:
+        result["dedup"] = memory.get_dedup_stats()
+    print(f"{name} finished: {turns} turns, score {game.score}" + (f", error {error}" if error else ""),
+          file=sys.stderr)
+    return result
+
+
+def summarize(results, elapsed):
+    """
+    Returns the totals over every game's result.
+    """
+    scores = [result["score"] for result in results if result["score"] is not None]
+    turns = sum(result["turns"] for result in results)
+    requests = metrics.to_dict()["timers"].get("llm_request_seconds", {})
+    request_count = sum(stats["count"] for stats in requests.values())
+    request_seconds = sum(stats["sum"] for stats in requests.values())
+    return {
+        "games": len(results),
+        "failed": sum(1 for result in results if result["error"]),
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_minute": round(turns / elapsed * 60, 2) if elapsed else 0.0,
+        "mean_score": round(statistics.mean(scores), 2) if scores else None,
+        "min_score": min(scores) if scores else None,
+        "max_score": max(scores) if scores else None,
+        "llm_requests": request_count,
+        "mean_llm_request_ms": round(request_seconds / request_count * 1000, 2) if request_count else None,
+        "dedup_tokens_saved": sum(result["dedup"]["tokens_saved"] for result in results if "dedup" in result),
+    }
+
+
+async def run_all(args):
+    directory = os.path.join(args.memory_dir, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(directory, exist_ok=True)
+
+    # One client for every game: the concurrency cap and the rate limit are shared
+    rate_limit = None if args.requests_per_minute is None else (args.requests_per_minute or False)
+    bot = async_ai_bot(backend=make_backend(args.backend) if args.backend else None,
+                       max_concurrency=args.max_concurrency, rate_limit=rate_limit)
+    # Summaries run on this event loop too, so the bot is only ever used from one loop
+    memory_bot = pooled_ai_bot(async_bot=bot, loop=asyncio.get_running_loop())
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_game(index, args, directory, bot, memory_bot)
+                                     for index in range(args.games)))
+    return list(results), summarize(results, time.perf_counter() - started), directory
+
+
+def print_report(results, totals):
+    print(f"\n{'game':<10}{'turns':>7}{'score':>7}{'seconds':>10}{'turns/min':>11}")
+    for result in results:
+        score = "-" if result["score"] is None else result["score"]
+        print(f"{result['game']:<10}{result['turns']:>7}{score:>7}{result['seconds']:>10.1f}"
+              f"{result['turns_per_minute']:>11.1f}" + (f"  error: {result['error']}" if result["error"] else ""))
+    print(f"\n{totals['games']} games ({totals['failed']} failed), {totals['turns']} turns in {totals['seconds']:.1f}s, "
+          f"{totals['turns_per_minute']:.1f} turns/min")
+    print(f"score mean {totals['mean_score']}, min {totals['min_score']}, max {totals['max_score']}")
+    print(f"{totals['llm_requests']} model requests, mean {totals['mean_llm_request_ms']} ms")
+    if totals["dedup_tokens_saved"]:
+        print(f"{totals['dedup_tokens_saved']} tokens saved by storing repeated game output as references")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays several text adventure games at the same time.")
+    parser.add_argument("--games", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=50, help="Turns per game")
+    parser.add_argument("--fake", action="store_true", help="Play the scripted fake interpreter instead of frotz")
+    parser.add_argument("--max-moves", type=int, default=200, help="Moves until a fake game ends")
+    parser.add_argument("--command", help=f"Command starting a game (default: {' '.join(GAME_COMMAND)})")
+    parser.add_argument("--backend", help="LLM backend ('openai' or 'local'), the one in config.ini by default")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Model requests in flight over all games")
+    parser.add_argument("--requests-per-minute", type=float,
+                        help="Request rate over all games, 0 for no limit (default: config.ini)")
+    parser.add_argument("--memory-dir", default="zork/runs", help="Every run stores its games' memories in here")
+    parser.add_argument("--storage", default="json", choices=["json", "journal", "sqlite"])
+    parser.add_argument("--compaction", default="background", choices=memory_manager.COMPACTION_MODES)
+    parser.add_argument("--summarization", default="full", choices=memory_manager.SUMMARIZATION_MODES)
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument("--dedup", action="store_true", help="Save repeated entries as references")
+    parser.add_argument("--short-term-threshold", type=int, help="For the 'count' scheduler")
+    parser.add_argument("--scheduler", default="count", choices=list(SCHEDULERS))
+    parser.add_argument("--prompt-budget", type=int, default=4000, help="Memory tokens per prompt, 'tokens' scheduler")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the games and the memory manager's progress")
+    args = parser.parse_args(argv)
+
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        results, totals, directory = asyncio.run(run_all(args))
+
+    print_report(results, totals)
+    print(f"Memories stored in {directory}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "games": results, "totals": totals}, f, indent=4)
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,17 @@
 # run_zork.py
 
-import subprocess
-import time
+# The game runs as an asyncio subprocess and is driven by events instead of sleeps: a read is complete as soon as the
+# interpreter shows its prompt ('>'), the memory check runs while the model chooses the next action and the action is
+# saved while the game works out its answer. The only waiting left is the model itself, and the rate limiter
+# (`requests_per_minute` in config.ini) where the API needs one.
+
+import asyncio
 import os
-import select
+import re
 import sys
-from ai_handle import ai_bot
+from ai_handle import async_ai_bot, pooled_ai_bot, memory_prompt_budget
 from memory_handle import memory_manager
+from metrics_handle import metrics
 # Now you can use ai_bot and memory_manager
 import configparser
 
@@ -14,116 +19,170 @@ config = configparser.ConfigParser()
 
 
 config.read('config.ini')
-sleep_time = int(config['ADVENTURE']['action_sleep_time'])
-
-
-
-shared_bot_instance = ai_bot()
-
-# Initialize memory manager with the shared bot instance
-memory_client = memory_manager(ai_bot_instance=shared_bot_instance, filepath="zork/game_memory_db.json")
-
-
-# Start Zork in Frotz with proper terminal settings
-
-process = subprocess.Popen(
-    ["frotz", "zork/ZORK1.DAT"], # Changing this to any other Z-Machine game should be enough to set up the agent to play it.
-    stdin=subprocess.PIPE,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
-    text=True,
-    env=os.environ.copy()  # Pass through environment variables
-)
-
-
-# Function to read game output with timeout
-def read_output(timeout=60.0):
-    output = ""
-    start_time = time.time()
-    
-    # Use select to check if there's data available to read
-    while time.time() - start_time < timeout:
-        # Check if there's data ready to read (with a short timeout)
-        ready_to_read, _, _ = select.select([process.stdout], [], [], 0.1)
-        
-        if process.stdout in ready_to_read:
-            # Read a chunk of data
-            chunk = os.read(process.stdout.fileno(), 4096).decode('utf-8', errors='replace')
-            if not chunk:
+prompt_timeout = config['ADVENTURE'].getfloat('prompt_timeout', fallback=60)  # Longest wait for the game's output
+prompt_idle_time = config['ADVENTURE'].getfloat('prompt_idle_time', fallback=2)  # Output complete without a prompt
+metrics.tracing = config['ADVENTURE'].getboolean('tracing', fallback=False)  # Traces every turn, see metrics_handle
+metrics_file = config['ADVENTURE'].get('metrics_file', fallback='')  # Where to dump the metrics when the game ends
+
+
+# Changing this to any other Z-Machine game should be enough to set up the agent to play it.
+GAME_COMMAND = ["frotz", "zork/ZORK1.DAT"]
+
+SYSTEM_PROMPT = "You are an AI agent in a text adventure game, you are tasked on exploring this environment via reasoning and commands to explore all it has to offer. For your response, make sure to only use commands that a CLI Text Adventure would recognize."
+
+# The interpreter's prompt, a '>' alone at the start of the last line
+PROMPT_PATTERN = re.compile(r"(^|\n)>\s*$")
+
+# How games report the score, "Your score is 35 (total of 350 points)" or a "Score: 35" status line
+SCORE_PATTERN = re.compile(r"[Ss]core(?: is|:)\s*(-?\d+)")
+
+
+class game_driver:
+    """
+    Runs a text adventure interpreter as an asyncio subprocess.
+
+    read_output() returns once the output ends with the prompt, for games that never show one once nothing new
+    arrived for idle_time seconds, and at the latest after timeout seconds.
+    The latest score the game reported is kept in score (None until it reports one).
+    """
+
+    def __init__(self, command, prompt=PROMPT_PATTERN, timeout=prompt_timeout, idle_time=prompt_idle_time):
+        self.command = command
+        self.prompt = prompt
+        self.timeout = timeout
+        self.idle_time = idle_time
+        self.process = None
+        self.score = None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=os.environ.copy()  # Pass through environment variables
+        )
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def read_output(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        output = ""
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
                 break
-            output += chunk
-        else:
-            # If no data for a bit and we already have some output, break
-            if output and time.time() - start_time > 0.5:
+            try:
+                chunk = await asyncio.wait_for(self.process.stdout.read(4096),
+                                               min(remaining, self.idle_time) if output else remaining)
+            except asyncio.TimeoutError:
+                break  # Either nothing came at all, or the output stopped without a prompt
+            if not chunk:
+                break  # The game exited
+            output += chunk.decode('utf-8', errors='replace')
+            if self.prompt.search(output):
                 break
-    
-    if output:
-        print("\nZork says:", output)
-        memory_client.save_to_memory(output,"short_term", "system")
-        #memory_client.check()
-
-        time.sleep(sleep_time) # Sleep in between actions
-
-    return output
-
-# Send AI-generated input
-def send_input(command):
-    if not command.endswith('\n'):
-        command += '\n'  # Ensure command ends with newline
-    
-    #print("\nSending:", command.strip())
-    try:
-        process.stdin.write(command)
-        process.stdin.flush()
-    except:
-        print("Error: Could not send input to Zork")
+        scores = SCORE_PATTERN.findall(output)
+        if scores:
+            self.score = int(scores[-1])
+        return output
+
+    async def send(self, command):
+        if not command.endswith('\n'):
+            command += '\n'  # Ensure command ends with newline
+        try:
+            self.process.stdin.write(command.encode('utf-8'))
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            print("Error: Could not send input to the game")
+
+    async def close(self):
+        if self.running:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 2)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
 
-# Main function with improved control
-def main():
-    print("Starting Zork... (Give it a moment to initialize)")
-    time.sleep(1)  # Give Frotz time to initialize
-    
-    # Read initial game intro
-    game_text = read_output()
+
+async def play(game, memory, bot, system_prompt=SYSTEM_PROMPT, max_turns=None, name="Zork"):
+    """
+    Plays until the game exits, the AI quits or max_turns were played. Returns the number of turns played.
+    """
+    game_text = await game.read_output()
     if not game_text:
-        print("WARNING: No initial output received from Zork. Check if Frotz is working correctly.")
-    
-    # Main game loop
+        print(f"WARNING: No initial output received from {name}. Check if the interpreter is working correctly.")
+    else:
+        print(f"\n{name} says:", game_text)
+        await asyncio.to_thread(memory.save_to_memory, game_text, "short_term", "system")
+
+    turn = 0
+    while game.running and (max_turns is None or turn < max_turns):
+        turn += 1
+        with metrics.span("zork_turn", turn=turn, game=name), metrics.timer("zork_turn_seconds"):
+            mem_structure = memory.get_memory_view()  # Read-only and not copied, later saves don't change it
+
+            # The check runs while the model chooses the action and the game answers, on the memories saved so far
+            checking = asyncio.create_task(asyncio.to_thread(memory.check))
+            try:
+                ai_action, ai_thoughts = await bot.adventure_response(mem_structure, system_prompt)
+                print(f"Thoughts: {ai_thoughts}\n")
+                print(f"Action: {ai_action}\n")
+
+                if ai_action.lower() in ['quit', 'exit']:
+                    break
+
+                await game.send(ai_action)
+                # The action is saved while the game works out its answer, and always before the answer
+                memory_snippet = f"Thoughts: {ai_thoughts}\n Action:{ai_action}"
+                saving = asyncio.create_task(asyncio.to_thread(memory.save_to_memory, memory_snippet, "short_term",
+                                                               "assistant"))
+                game_text = await game.read_output()
+                await saving
+
+                if game_text:
+                    print(f"\n{name} says:", game_text)
+                    await asyncio.to_thread(memory.save_to_memory, game_text, "short_term", "system")
+            finally:
+                await checking  # The next turn reads the memories the check left behind
+    return turn
+
+
+async def run():
+    bot = async_ai_bot()  # Retries rate limits and transient API errors instead of crashing the game loop
+    # Summaries run on this event loop too, so the bot is only ever used from one loop
+    memory_client = memory_manager(ai_bot_instance=pooled_ai_bot(async_bot=bot, loop=asyncio.get_running_loop()),
+                                   filepath="zork/game_memory_db.json", compaction="background",
+                                   dedup=True,  # The game repeats itself a lot
+                                   # One room description can be longer than ten short answers, so compaction
+                                   # goes by tokens instead of entries
+                                   scheduler="tokens", scheduler_options={"prompt_budget": memory_prompt_budget})
+    game = game_driver(GAME_COMMAND)
+    await game.start()
     try:
-        while process.poll() is None:  # Check if process is still running
-            mem_structure=memory_client.get_memory_structure()
-            ai_action, ai_thoughts = shared_bot_instance.adventure_response(mem_structure, "You are an AI agent in a text adventure game, you are tasked on exploring this environment via reasoning and commands to explore all it has to offer. For your response, make sure to only use commands that a CLI Text Adventure would recognize.")
-
-            memory_snippet= f"Thoughts: {ai_thoughts}\n Action:{ai_action}"
-            #print(f"this is our snippet! {memory_snippet}")
-            print(f"Thoughts: {ai_thoughts}\n")
-            print(f"Action: {ai_action}\n")
-            time.sleep(5)  # Give Frotz time
-
-            #ai_response = input("\nEnter your command (or 'quit' to exit): ")
-            memory_client.save_to_memory(memory_snippet,"short_term","assistant")
-            memory_client.check()
+        await play(game, memory_client, bot)
+    finally:
+        # Clean up
+        print("Cleaning up...")
+        await asyncio.to_thread(memory_client.close)  # Waits for summaries, which need the loop to keep running
+        if metrics_file:
+            with open(metrics_file, 'w') as f:
+                f.write(metrics.to_prometheus())
+            print(f"Metrics written to {metrics_file}")
+        await game.close()
 
-            time.sleep(2)
 
-            
-            if ai_action.lower() in ['quit', 'exit']:
-                break
-                
-            send_input(ai_action)
-            game_text = read_output()
+def main():
+    print("Starting Zork...")
+    try:
+        asyncio.run(run())
     except KeyboardInterrupt:
         print("\nExiting game...")
     finally:
-        # Clean up
-        print("Cleaning up...")
-        if process.poll() is None:
-            process.terminate()
-            try:
-                process.wait(timeout=2)
-            except subprocess.TimeoutExpired:
-                process.kill()
-        
         # Reset terminal
         if sys.platform != 'win32':
             os.system('stty sane')
@@ -131,4 +190,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-